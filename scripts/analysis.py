@@ -1,30 +1,42 @@
+import argparse
 import collections
+import csv
+import hashlib
+import json
 import numpy as np
 import matplotlib.pyplot as plt
+import os
 import sqlite3 as lite
-import sys
+import urllib.parse
 from itertools import cycle
 from matplotlib import cm
-from pyne import nucname
+from matplotlib.collections import PolyCollection
+from pyne import data, nucname
+from scipy.linalg import expm
 from collections import Counter
+from multiprocessing import Pool, cpu_count
 
-if len(sys.argv) < 2:
-    print('Usage: python analysis.py [cylus_output_file]')
 
-
-def cursor(file_name):
+def cursor(file_name, read_only=False):
     """Connects and returns a cursor to an sqlite output file
 
     Parameters
     ----------
     file_name: str
         name of the sqlite file
+    read_only: bool
+        if True, the file is opened read-only, e.g. to follow
+        an output Cyclus is still writing
 
     Returns
     -------
     sqlite cursor3
     """
-    con = lite.connect(file_name)
+    if read_only:
+        con = lite.connect('file:' + urllib.parse.quote(
+            os.path.abspath(file_name)) + '?mode=ro', uri=True)
+    else:
+        con = lite.connect(file_name)
     con.row_factory = lite.Row
     return con.cursor()
 
@@ -248,6 +260,45 @@ def timeseries_cum(specific_search, duration, kg_to_tons):
     return value_timeseries
 
 
+def grouped_timeseries(rows, keys, duration, kg_to_tons, is_cum=True):
+    """returns a key x time matrix from grouped query rows.
+
+    Parameters
+    ----------
+    rows: list
+        list of (key, time, value) rows, typically from
+        a query with GROUP BY key, time
+    keys: list
+        list of keys, defines the row order of the matrix
+    duration: int
+        duration of the simulation
+    kg_to_tons: bool
+        if True, matrix returned has units of tons
+        if False, matrix returned as units of kilograms
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+
+    Returns
+    -------
+    matrix: numpy array
+        array of shape (len(keys), duration), rows whose key is not
+        in keys or whose time is outside the simulation are ignored
+    """
+    matrix = np.zeros((len(keys), duration))
+    index = {key: i for i, key in enumerate(keys)}
+    selected = [(index[row[0]], row[1], row[2]) for row in rows
+                if row[0] in index and 0 <= row[1] < duration]
+    if len(selected) > 0:
+        key_index, time, value = zip(*selected)
+        np.add.at(matrix, (np.array(key_index), np.array(time)),
+                  np.array(value, dtype=float))
+    if is_cum:
+        matrix = np.cumsum(matrix, axis=1)
+    if kg_to_tons:
+        matrix *= 0.001
+    return matrix
+
+
 def isotope_transactions(resources, compositions):
     """Creates a dictionary with isotope name, mass, and time
 
@@ -277,6 +328,68 @@ def isotope_transactions(resources, compositions):
     return transactions
 
 
+composition_cache = {}
+
+
+def composition_matrix(cur, qualids):
+    """Returns the mass fraction matrix of the given qualities.
+    Compositions are cached per simulation, so later calls
+    only read the qualities they have not seen yet.
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    qualids: list
+        list of qualids, defines the row order of the matrix
+
+    Returns
+    -------
+    nucids: list
+        list of nucids, defines the column order of the matrix
+    matrix: numpy array
+        array of shape (len(qualids), len(nucids)) with the
+        mass fraction of every nuclide in every quality
+    """
+    database = cur.execute('PRAGMA database_list').fetchone()[2]
+    simid = cur.execute('SELECT simid FROM info').fetchone()
+    # a rerun written to the same file reuses qualids, hence the simid
+    if database and simid is not None:
+        cache = composition_cache.setdefault((database, simid[0]), {})
+    else:
+        cache = {}
+    missing = [int(x) for x in qualids if int(x) not in cache]
+    if len(missing) > 500:
+        # too many for an IN clause, a full scan is cheaper
+        rows = cur.execute('SELECT qualid, nucid, massfrac '
+                           'FROM compositions').fetchall()
+    elif len(missing) > 0:
+        rows = cur.execute('SELECT qualid, nucid, massfrac '
+                           'FROM compositions WHERE qualid IN (' +
+                           ', '.join('?' * len(missing)) + ')',
+                           missing).fetchall()
+    else:
+        rows = []
+    missing = set(missing)
+    for qualid in missing:
+        cache[qualid] = []
+    for qualid, nucid, massfrac in rows:
+        if qualid in missing:
+            cache[qualid].append((nucid, massfrac))
+    index = {qualid: i for i, qualid in enumerate(qualids)}
+    compositions = [(qualid,) + comp for qualid in index
+                    for comp in cache[int(qualid)]]
+    nucids = sorted({comp[1] for comp in compositions})
+    matrix = np.zeros((len(qualids), len(nucids)))
+    if len(compositions) > 0:
+        nuc_index = {nucid: i for i, nucid in enumerate(nucids)}
+        qualid, nucid, massfrac = zip(*compositions)
+        np.add.at(matrix, ([index[x] for x in qualid],
+                           [nuc_index[x] for x in nucid]),
+                  np.array(massfrac, dtype=float))
+    return nucids, matrix
+
+
 def facility_commodity_flux(cur, agentids,
                             facility_commodities, is_outflux,
                             is_cum=True):
@@ -437,6 +550,165 @@ def facility_commodity_flux_isotopics(
     return isotope_timeseries
 
 
+def inventory_index(cur):
+    """Builds an index of agent inventories from the agentstateinventories
+    and resources tables, that can be queried for any set of agents
+    without going back to the database.
+
+    Inventories are only recorded at snapshot times (SimTime). The
+    inventory at timestep t is taken from the first snapshot at or after t,
+    counting only the resources that were created at or before t,
+    which is exact at the snapshot times.
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+
+    Returns
+    -------
+    index: dictionary
+        dictionary of numpy arrays with one entry per
+        (agentid, inventoryname, qualid, simtime, timecreated):
+        agentid, inventoryname, qualid, quantity [kg],
+        start and stop (first and last timestep the entry counts for),
+        and the entries duration, nucids and compositions
+        (qualid x nuclide mass fraction matrix, rows ordered as qualids)
+    """
+    init_year, init_month, duration, timestep = simulation_timesteps(cur)
+    rows = cur.execute('SELECT agentid, inventoryname, qualid, simtime, '
+                       'timecreated, sum(quantity) '
+                       'FROM agentstateinventories INNER JOIN resources '
+                       'ON resources.resourceid = '
+                       'agentstateinventories.resourceid '
+                       'GROUP BY agentid, inventoryname, qualid, '
+                       'simtime, timecreated').fetchall()
+    columns = list(zip(*rows)) if len(rows) > 0 else [()] * 6
+    simtime = np.array(columns[3], dtype=int)
+    created = np.array(columns[4], dtype=int)
+    snapshots = np.unique(simtime)
+
+    # every entry counts for the timesteps after the previous snapshot
+    # up to its own snapshot (or the end of the simulation for the last)
+    snapshot_num = np.searchsorted(snapshots, simtime)
+    previous = np.append(-1, snapshots)[snapshot_num]
+    last = snapshots[-1] if len(snapshots) > 0 else 0
+    stop = np.where(simtime == last, duration - 1,
+                    np.minimum(simtime, duration - 1))
+    start = np.maximum(created, previous + 1)
+
+    qualids = sorted(set(columns[2]))
+    nucids, compositions = composition_matrix(cur, qualids)
+    qual_index = {qualid: i for i, qualid in enumerate(qualids)}
+
+    index = {'agentid': np.array(columns[0], dtype=int),
+             'inventoryname': np.array(columns[1], dtype=object),
+             'qualid': np.array([qual_index[x] for x in columns[2]],
+                                dtype=int),
+             'quantity': np.array(columns[5], dtype=float),
+             'start': start,
+             'stop': stop,
+             'duration': duration,
+             'nucids': nucids,
+             'compositions': compositions}
+    return index
+
+
+def inventory_selection(index, agentids, inventories=None):
+    """Returns the mask of index entries that belong to
+    the agents and inventories
+
+    Parameters
+    ----------
+    index: dictionary
+        inventory index from inventory_index
+    agentids: list
+        list of agentids
+    inventories: list
+        list of inventory names, all inventories if None
+
+    Returns
+    -------
+    mask: numpy array
+        boolean mask of selected index entries that
+        are present during the simulation
+    """
+    mask = np.isin(index['agentid'], [int(x) for x in agentids])
+    if inventories is not None:
+        mask &= np.isin(index['inventoryname'], list(inventories))
+    return mask & (index['start'] <= index['stop'])
+
+
+def inventory_timeseries(index, agentids, inventories=None,
+                         kg_to_tons=True):
+    """Returns timeseries of inventory mass of a set of agents
+
+    Parameters
+    ----------
+    index: dictionary
+        inventory index from inventory_index
+    agentids: list
+        list of agentids
+    inventories: list
+        list of inventory names, all inventories if None
+    kg_to_tons: bool
+        if True, timeseries returned has units of tons
+        if False, timeseries returned as units of kilograms
+
+    Returns
+    -------
+    mass: numpy array
+        timeseries of inventory mass
+    """
+    mask = inventory_selection(index, agentids, inventories)
+    change = np.zeros(index['duration'] + 1)
+    np.add.at(change, index['start'][mask], index['quantity'][mask])
+    np.add.at(change, index['stop'][mask] + 1, -index['quantity'][mask])
+    mass = np.cumsum(change)[:-1]
+    if kg_to_tons:
+        mass *= 0.001
+    return mass
+
+
+def inventory_isotopics(index, agentids, inventories=None,
+                        kg_to_tons=True):
+    """Returns timeseries of inventory mass of every isotope
+    of a set of agents
+
+    Parameters
+    ----------
+    index: dictionary
+        inventory index from inventory_index
+    agentids: list
+        list of agentids
+    inventories: list
+        list of inventory names, all inventories if None
+    kg_to_tons: bool
+        if True, timeseries returned has units of tons
+        if False, timeseries returned as units of kilograms
+
+    Returns
+    -------
+    isotope_timeseries: dictionary
+        dictionary with "key=isotope, and
+        value=timeseries of inventory mass"
+    """
+    mask = inventory_selection(index, agentids, inventories)
+    qualid = index['qualid'][mask]
+    quantity = index['quantity'][mask]
+    change = np.zeros((len(index['compositions']), index['duration'] + 1))
+    np.add.at(change, (qualid, index['start'][mask]), quantity)
+    np.add.at(change, (qualid, index['stop'][mask] + 1), -quantity)
+    masses = np.dot(index['compositions'].T, np.cumsum(change, axis=1))
+    if kg_to_tons:
+        masses *= 0.001
+    isotope_timeseries = collections.OrderedDict()
+    for nucid, mass in zip(index['nucids'], masses):
+        if np.any(mass):
+            isotope_timeseries[nucname.name(nucid)] = mass[:-1]
+    return isotope_timeseries
+
+
 def stockpiles(cur, facility, is_cum=True):
     """gets inventory timeseries in a fuel facility
 
@@ -447,7 +719,8 @@ def stockpiles(cur, facility, is_cum=True):
     facility: str
         name of facility
     is_cum: bool
-        gets cumulative timeseris if True, monthly value if False
+        gets inventory timeseries if True,
+        monthly change of the inventory if False
 
     Returns
     -------
@@ -457,15 +730,10 @@ def stockpiles(cur, facility, is_cum=True):
     """
     pile = collections.OrderedDict()
     agentid = agent_ids(cur, facility)
-    query = exec_string(agentid, 'agentid', 'timecreated, quantity, qualid')
-    query = query.replace('transactions', 'agentstateinventories')
-    stockpile = cur.execute(query).fetchall()
-    init_year, init_month, duration, timestep = simulation_timesteps(cur)
-    if is_cum:
-        stock_timeseries = timeseries_cum(stockpile, duration, True)
-    else:
-        stock_timeseries = timeseries(stockpile, duration, True)
-    pile[facility] = stock_timeseries
+    stock_timeseries = inventory_timeseries(inventory_index(cur), agentid)
+    if not is_cum:
+        stock_timeseries = np.diff(stock_timeseries, prepend=0)
+    pile[facility] = stock_timeseries.tolist()
 
     return pile
 
@@ -665,6 +933,48 @@ def nat_u_timeseries(cur, is_cum=True):
         return timeseries(feed, duration, True)
 
 
+def quality_isotopics(cur, rows, duration, is_cum=True, kg_to_tons=True):
+    """Returns isotopic timeseries from masses aggregated per quality,
+    by projecting them through the composition matrix
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    rows: list
+        list of (time, quantity, qualid) rows
+    duration: int
+        duration of the simulation
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+    kg_to_tons: bool
+        if True, timeseries returned has units of tons
+        if False, timeseries returned as units of kilograms
+
+    Returns
+    -------
+    isotope_timeseries: OrderedDict
+        dictionary with "key=isotope, and
+        value=timeseries list of masses"
+    """
+    columns = list(zip(*rows)) if len(rows) > 0 else [()] * 3
+    qualids, quality = np.unique(np.array(columns[2], dtype=int),
+                                 return_inverse=True)
+    mass = np.zeros((len(qualids), duration))
+    np.add.at(mass, (quality, np.array(columns[0], dtype=int)),
+              np.array(columns[1], dtype=float))
+    nucids, compositions = composition_matrix(cur, qualids.tolist())
+    masses = np.dot(compositions.T, mass)
+    if is_cum:
+        masses = np.cumsum(masses, axis=1)
+    if kg_to_tons:
+        masses *= 0.001
+    isotope_timeseries = collections.OrderedDict()
+    for nucid, series in zip(nucids, masses):
+        isotope_timeseries[nucname.name(nucid)] = series.tolist()
+    return isotope_timeseries
+
+
 def trade_timeseries(cur, sender, receiver,
                      is_prototype, do_isotopic,
                      is_cum=True):
@@ -683,7 +993,7 @@ def trade_timeseries(cur, sender, receiver,
         if True, search sender and receiver as prototype,
         if False, as facility type from spec.
     do_isotopic: bool
-        if True, perform isotopics (takes significantly longer)
+        if True, breaks the trades down by isotope
     is_cum: bool
         gets cumulative timeseris if True, monthly value if False
 
@@ -713,16 +1023,14 @@ def trade_timeseries(cur, sender, receiver,
         receiver_id = agent_ids(cur, receiver)
 
     if do_isotopic:
-        trade = cur.execute('SELECT time, sum(quantity)*massfrac, nucid '
+        trade = cur.execute('SELECT time, sum(quantity), qualid '
                             'FROM transactions INNER JOIN resources ON '
-                            'resources.resourceid = transactions.resourceid '
-                            'LEFT OUTER JOIN compositions '
-                            'ON compositions.qualid = resources.qualid '
-                            'WHERE (senderid = ' +
+                            'resources.resourceid = transactions.resourceid'
+                            ' WHERE (senderid = ' +
                             ' OR senderid = '.join(sender_id) +
                             ') AND (receiverid = ' +
                             ' OR receiverid = '.join(receiver_id) +
-                            ') GROUP BY time, nucid').fetchall()
+                            ') GROUP BY time, qualid').fetchall()
     else:
         trade = cur.execute('SELECT time, sum(quantity), qualid '
                             'FROM transactions INNER JOIN resources ON '
@@ -734,15 +1042,8 @@ def trade_timeseries(cur, sender, receiver,
                             ') GROUP BY time').fetchall(
         )
     if do_isotopic:
-        for time, amount, nucid in trade:
-            isotope_timeseries[nucname.name(nucid)].append((time, amount))
-        for key in isotope_timeseries:
-            if is_cum:
-                isotope_timeseries[key] = timeseries_cum(
-                    isotope_timeseries[key], duration, True)
-            else:
-                isotope_timeseries[key] = timeseries(
-                    isotope_timeseries[key], duration, True)
+        masses = quality_isotopics(cur, trade, duration, is_cum, True)
+        isotope_timeseries.update(masses)
         return isotope_timeseries
     else:
         key_name = str(sender)[:5] + ' to ' + str(receiver)[:5]
@@ -753,6 +1054,620 @@ def trade_timeseries(cur, sender, receiver,
         return trades
 
 
+def flow_tensor(cur):
+    """Returns every material flow of the simulation as a sparse
+    sender prototype x receiver prototype x commodity x time tensor,
+    computed with a single grouped query
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+
+    Returns
+    -------
+    flows: dictionary
+        prototypes and commodities (lists of names) and
+        one numpy array entry per nonzero element:
+        sender, receiver (indices into prototypes), commodity
+        (index into commodities), time and quantity [kg],
+        and the simulation duration
+    """
+    init_year, init_month, duration, timestep = simulation_timesteps(cur)
+    rows = cur.execute('SELECT sender.prototype, receiver.prototype, '
+                       'commodity, time, sum(quantity) '
+                       'FROM transactions INNER JOIN resources '
+                       'ON resources.resourceid = transactions.resourceid '
+                       'INNER JOIN agententry AS sender '
+                       'ON sender.agentid = transactions.senderid '
+                       'INNER JOIN agententry AS receiver '
+                       'ON receiver.agentid = transactions.receiverid '
+                       'GROUP BY sender.prototype, receiver.prototype, '
+                       'commodity, time').fetchall()
+    columns = list(zip(*rows)) if len(rows) > 0 else [()] * 5
+    prototypes, names = np.unique(np.array(columns[0] + columns[1],
+                                           dtype=str),
+                                  return_inverse=True)
+    commodities, commodity = np.unique(np.array(columns[2], dtype=str),
+                                       return_inverse=True)
+    return {'prototypes': prototypes.tolist(),
+            'commodities': commodities.tolist(),
+            'sender': names[:len(rows)],
+            'receiver': names[len(rows):],
+            'commodity': commodity,
+            'time': np.array(columns[3], dtype=int),
+            'quantity': np.array(columns[4], dtype=float),
+            'duration': duration}
+
+
+def flow_selection(flows, senders=None, receivers=None, commodities=None):
+    """Returns the mask of the flows between prototypes
+
+    Parameters
+    ----------
+    flows: dictionary
+        flow tensor from flow_tensor
+    senders: list
+        list of sender prototypes, all prototypes if None
+    receivers: list
+        list of receiver prototypes, all prototypes if None
+    commodities: list
+        list of commodities, all commodities if None
+
+    Returns
+    -------
+    mask: numpy array
+        boolean mask over the flow entries
+    """
+    mask = np.ones(len(flows['quantity']), dtype=bool)
+    for key, names, labels in (('sender', senders, 'prototypes'),
+                               ('receiver', receivers, 'prototypes'),
+                               ('commodity', commodities, 'commodities')):
+        if names is not None:
+            indices = [flows[labels].index(x) for x in names
+                       if x in flows[labels]]
+            mask &= np.isin(flows[key], indices)
+    return mask
+
+
+def flow_timeseries(flows, senders=None, receivers=None, commodities=None,
+                    is_cum=True, kg_to_tons=True):
+    """Returns the timeseries of mass sent between prototypes,
+    like trade_timeseries without isotopics
+
+    Parameters
+    ----------
+    flows: dictionary
+        flow tensor from flow_tensor
+    senders: list
+        list of sender prototypes, all prototypes if None
+    receivers: list
+        list of receiver prototypes, all prototypes if None
+    commodities: list
+        list of commodities, all commodities if None
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+    kg_to_tons: bool
+        if True, timeseries returned has units of tons
+        if False, timeseries returned as units of kilograms
+
+    Returns
+    -------
+    mass: numpy array
+        timeseries of mass
+    """
+    mask = flow_selection(flows, senders, receivers, commodities)
+    mass = np.zeros(flows['duration'])
+    np.add.at(mass, flows['time'][mask], flows['quantity'][mask])
+    if is_cum:
+        mass = np.cumsum(mass)
+    if kg_to_tons:
+        mass *= 0.001
+    return mass
+
+
+def flow_links(flows, start=None, end=None, kg_to_tons=True):
+    """Returns the total mass of every sender, receiver and
+    commodity combination, e.g. the links of a Sankey diagram
+
+    Parameters
+    ----------
+    flows: dictionary
+        flow tensor from flow_tensor
+    start: int
+        first timestep counted, the beginning of the simulation if None
+    end: int
+        last timestep counted, the end of the simulation if None
+    kg_to_tons: bool
+        if True, masses returned have units of tons
+        if False, masses returned as units of kilograms
+
+    Returns
+    -------
+    links: list
+        list of (sender, receiver, commodity, mass) tuples,
+        largest mass first
+    """
+    mask = np.ones(len(flows['time']), dtype=bool)
+    if start is not None:
+        mask &= flows['time'] >= start
+    if end is not None:
+        mask &= flows['time'] <= end
+    shape = (len(flows['prototypes']), len(flows['prototypes']),
+             len(flows['commodities']))
+    totals = np.zeros(shape)
+    np.add.at(totals, (flows['sender'][mask], flows['receiver'][mask],
+                       flows['commodity'][mask]), flows['quantity'][mask])
+    if kg_to_tons:
+        totals *= 0.001
+    links = []
+    for sender, receiver, commodity in zip(*np.nonzero(totals)):
+        links.append((flows['prototypes'][sender],
+                      flows['prototypes'][receiver],
+                      flows['commodities'][commodity],
+                      totals[sender, receiver, commodity]))
+    return sorted(links, key=lambda x: x[3], reverse=True)
+
+
+def flow_balance(flows, is_cum=True, kg_to_tons=True):
+    """Returns the net mass received (received - sent) by every
+    prototype, for mass balance checks
+
+    Parameters
+    ----------
+    flows: dictionary
+        flow tensor from flow_tensor
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+    kg_to_tons: bool
+        if True, timeseries returned has units of tons
+        if False, timeseries returned as units of kilograms
+
+    Returns
+    -------
+    balance: OrderedDict
+        key=prototype, value=timeseries of net mass received
+    """
+    net = np.zeros((len(flows['prototypes']), flows['duration']))
+    np.add.at(net, (flows['receiver'], flows['time']), flows['quantity'])
+    np.add.at(net, (flows['sender'], flows['time']), -flows['quantity'])
+    if is_cum:
+        net = np.cumsum(net, axis=1)
+    if kg_to_tons:
+        net *= 0.001
+    return collections.OrderedDict(zip(flows['prototypes'], net))
+
+
+def isotope_matrix(isotope_timeseries):
+    """Stacks an isotopic result into a nuclide x time matrix
+
+    Parameters
+    ----------
+    isotope_timeseries: dictionary
+        key=nuclide, value=timeseries of mass. Shorter
+        timeseries are padded with zeros at the end.
+
+    Returns
+    -------
+    nuclides: list
+        nuclides in row order
+    masses: np.array
+        nuclide x time matrix of masses
+    """
+    nuclides = list(isotope_timeseries.keys())
+    length = max([len(isotope_timeseries[x]) for x in nuclides] + [0])
+    masses = np.zeros((len(nuclides), length))
+    for row, nuclide in enumerate(nuclides):
+        series = isotope_timeseries[nuclide]
+        masses[row, :len(series)] = series
+    return nuclides, masses
+
+
+def decay_chain(nuclides):
+    """Reads the decay data of a set of nuclides and all
+    of their descendants from pyne.data
+
+    Parameters
+    ----------
+    nuclides: list
+        nuclide names or ids
+
+    Returns
+    -------
+    chain: OrderedDict
+        key=nuclide id, value=dictionary with decay_const [1/s],
+        atomic_mass [g/mol], q_val [MeV per decay] and
+        children (dictionary of child id: branch ratio)
+    """
+    chain = collections.OrderedDict()
+    queue = [nucname.id(nuclide) for nuclide in nuclides]
+    while len(queue) > 0:
+        nucid = queue.pop(0)
+        if nucid in chain:
+            continue
+        children = {}
+        for child in data.decay_children(nucid):
+            ratio = data.branch_ratio(nucid, child)
+            if ratio > 0:
+                children[child] = ratio
+                queue.append(child)
+        decay_const = data.decay_const(nucid)
+        chain[nucid] = {'decay_const': decay_const if np.isfinite(
+                            decay_const) else 0.0,
+                        'atomic_mass': data.atomic_mass(nucid),
+                        'q_val': np.nan_to_num(data.q_val(nucid)),
+                        'children': children}
+    return chain
+
+
+def decay_rate_matrix(chain):
+    """Returns the matrix A of the decay equations dN/dt = A N
+
+    Parameters
+    ----------
+    chain: OrderedDict
+        decay data from decay_chain
+
+    Returns
+    -------
+    rates: np.array
+        nuclide x nuclide matrix of decay rates [1/s]
+    """
+    position = dict((nucid, i) for i, nucid in enumerate(chain))
+    rates = np.zeros((len(chain), len(chain)))
+    for i, nucid in enumerate(chain):
+        decay_const = chain[nucid]['decay_const']
+        rates[i, i] = -decay_const
+        for child, ratio in chain[nucid]['children'].items():
+            if child in position:
+                rates[position[child], i] += ratio * decay_const
+    return rates
+
+
+decay_operator_cache = {}
+
+
+def decay_operator(chain, months):
+    """Returns the matrix decaying a nuclide mass vector by a time step.
+    Operators are cached per chain and time step.
+
+    Parameters
+    ----------
+    chain: OrderedDict
+        decay data from decay_chain
+    months: float
+        decay time [months]
+
+    Returns
+    -------
+    operator: np.array
+        nuclide x nuclide matrix, decayed masses = operator . masses
+    """
+    key = (tuple((nucid, value['decay_const'],
+                  tuple(sorted(value['children'].items())))
+                 for nucid, value in chain.items()), months)
+    if key not in decay_operator_cache:
+        seconds = months * 365.25 * 24 * 3600 / 12
+        atomic_mass = np.array([chain[x]['atomic_mass'] for x in chain])
+        # decay acts on atoms, so masses are converted to moles and back
+        decay_operator_cache[key] = (
+            expm(decay_rate_matrix(chain) * seconds) *
+            atomic_mass[:, np.newaxis] / atomic_mass[np.newaxis, :])
+    return decay_operator_cache[key]
+
+
+def chain_matrix(isotope_timeseries, chain=None):
+    """Stacks an isotopic result into a nuclide x time matrix
+    with one row per nuclide of its decay chain
+
+    Parameters
+    ----------
+    isotope_timeseries: dictionary
+        key=nuclide, value=timeseries of mass
+    chain: OrderedDict
+        decay data from decay_chain, read from pyne.data if None
+
+    Returns
+    -------
+    chain: OrderedDict
+        decay data, in row order
+    matrix: np.array
+        nuclide x time matrix of masses
+    """
+    if chain is None:
+        chain = decay_chain(isotope_timeseries.keys())
+    nuclides, masses = isotope_matrix(isotope_timeseries)
+    position = dict((nucid, i) for i, nucid in enumerate(chain))
+    matrix = np.zeros((len(chain), masses.shape[1]))
+    for nuclide, mass in zip(nuclides, masses):
+        matrix[position[nucname.id(nuclide)]] += mass
+    return chain, matrix
+
+
+def chain_timeseries(chain, matrix):
+    """Converts a nuclide x time matrix back to an isotopic result
+
+    Parameters
+    ----------
+    chain: OrderedDict
+        decay data, in row order
+    matrix: np.array
+        nuclide x time matrix of masses
+
+    Returns
+    -------
+    isotope_timeseries: OrderedDict
+        key=nuclide name, value=timeseries of mass,
+        for the nuclides with a nonzero mass
+    """
+    isotope_timeseries = collections.OrderedDict()
+    for nucid, mass in zip(chain, matrix):
+        if np.any(mass):
+            isotope_timeseries[nucname.name(nucid)] = mass
+    return isotope_timeseries
+
+
+def decay_timeseries(isotope_timeseries, months, chain=None):
+    """Decays every timestep of an isotopic inventory by the same
+    cooling time, e.g. the stockpile as it will be after months
+    in storage
+
+    Parameters
+    ----------
+    isotope_timeseries: dictionary
+        key=nuclide, value=timeseries of mass, e.g. from
+        inventory_isotopics or facility_commodity_flux_isotopics
+    months: float
+        cooling time [months]
+    chain: OrderedDict
+        decay data from decay_chain, read from pyne.data if None
+
+    Returns
+    -------
+    isotope_timeseries: OrderedDict
+        key=nuclide, value=timeseries of decayed mass,
+        including the daughters that build up
+    """
+    chain, masses = chain_matrix(isotope_timeseries, chain)
+    return chain_timeseries(chain, decay_operator(chain, months).dot(masses))
+
+
+def decay_storage(isotope_additions, chain=None, dt=1):
+    """Returns the inventory of a storage that receives isotopic
+    additions every timestep and decays in between, i.e.
+    inventory[t] = decay(inventory[t-1], dt) + additions[t].
+
+    The recurrence is evaluated as a prefix scan, in log2(timesteps)
+    matrix products over the whole nuclide x time matrix.
+
+    Parameters
+    ----------
+    isotope_additions: dictionary
+        key=nuclide, value=timeseries of mass added each timestep, e.g.
+        facility_commodity_flux_isotopics(..., is_cum=False)
+    chain: OrderedDict
+        decay data from decay_chain, read from pyne.data if None
+    dt: float
+        length of a timestep [months]
+
+    Returns
+    -------
+    isotope_timeseries: OrderedDict
+        key=nuclide, value=timeseries of decayed inventory
+    """
+    chain, inventory = chain_matrix(isotope_additions, chain)
+    operator = decay_operator(chain, dt)
+    shift = 1
+    while shift < inventory.shape[1]:
+        # each column now sums the additions of the last 2 * shift steps
+        inventory[:, shift:] += operator.dot(inventory[:, :-shift])
+        operator = operator.dot(operator)
+        shift *= 2
+    return chain_timeseries(chain, inventory)
+
+
+def activity_vector(chain):
+    """Returns the specific activity of every nuclide of a chain
+
+    Parameters
+    ----------
+    chain: OrderedDict
+        decay data from decay_chain
+
+    Returns
+    -------
+    activity: np.array
+        specific activity of every nuclide [Bq/kg], in chain order
+    """
+    decay_const = np.array([chain[x]['decay_const'] for x in chain])
+    atomic_mass = np.array([chain[x]['atomic_mass'] for x in chain])
+    return decay_const * 1000.0 / atomic_mass * 6.02214076e23
+
+
+def decay_heat_vector(chain):
+    """Returns the specific decay heat of every nuclide of a chain
+
+    Parameters
+    ----------
+    chain: OrderedDict
+        decay data from decay_chain
+
+    Returns
+    -------
+    decay_heat: np.array
+        specific decay heat of every nuclide [W/kg], in chain order
+    """
+    q_val = np.array([chain[x]['q_val'] for x in chain])
+    return activity_vector(chain) * q_val * 1.602176634e-13
+
+
+def activity_timeseries(isotope_timeseries, chain=None):
+    """Returns the total activity of an isotopic timeseries
+
+    Parameters
+    ----------
+    isotope_timeseries: dictionary
+        key=nuclide, value=timeseries of mass [kg]
+    chain: OrderedDict
+        decay data from decay_chain, read from pyne.data if None
+
+    Returns
+    -------
+    activity: np.array
+        timeseries of the total activity [Bq]
+    """
+    chain, masses = chain_matrix(isotope_timeseries, chain)
+    return activity_vector(chain).dot(masses)
+
+
+def decay_heat_timeseries(isotope_timeseries, chain=None):
+    """Returns the total decay heat of an isotopic timeseries
+
+    Parameters
+    ----------
+    isotope_timeseries: dictionary
+        key=nuclide, value=timeseries of mass [kg]
+    chain: OrderedDict
+        decay data from decay_chain, read from pyne.data if None
+
+    Returns
+    -------
+    decay_heat: np.array
+        timeseries of the total decay heat [W]
+    """
+    chain, masses = chain_matrix(isotope_timeseries, chain)
+    return decay_heat_vector(chain).dot(masses)
+
+
+def fission_product(z, a):
+    """Returns a mask of the fission products: nuclides lighter than
+    actinium within the mass window of the fission yields
+
+    Parameters
+    ----------
+    z: np.array
+        atomic numbers
+    a: np.array
+        mass numbers
+
+    Returns
+    -------
+    mask: np.array
+        True for the fission products
+    """
+    return (z < 89) & (a >= 66) & (a <= 172)
+
+
+def light_nuclide(z, a):
+    """Returns a mask of the nuclides lighter than actinium that are
+    not fission products, e.g. He4 from alpha decay, the Pb, Bi and Ra
+    of the decay chains and activation products
+
+    Parameters
+    ----------
+    z: np.array
+        atomic numbers
+    a: np.array
+        mass numbers
+
+    Returns
+    -------
+    mask: np.array
+        True for the other light nuclides
+    """
+    return (z < 89) & ~fission_product(z, a)
+
+
+def nuclide_groups():
+    """Returns the standard nuclide groups used in the fuel cycle
+    benchmarks: uranium, plutonium, minor actinides, transuranics,
+    the other actinides (Ac, Th and Pa), fission products (see
+    fission_product) and the other light nuclides. U, TRU, OA, FP
+    and other partition all nuclides, Pu and MA are parts of TRU.
+
+    Returns
+    -------
+    groups: OrderedDict
+        key=group name, value=tuple of atomic numbers or
+        a mask function as in group_matrix
+    """
+    groups = collections.OrderedDict()
+    groups['U'] = (92,)
+    groups['Pu'] = (94,)
+    groups['MA'] = (93,) + tuple(range(95, 104))
+    groups['TRU'] = tuple(range(93, 104))
+    groups['OA'] = (89, 90, 91)
+    groups['FP'] = fission_product
+    groups['other'] = light_nuclide
+    return groups
+
+
+group_matrix_cache = {}
+
+
+def group_matrix(nuclides, groups=None):
+    """Returns the group x nuclide membership matrix of a list of
+    nuclides. Matrices are cached per nuclide list and groups.
+
+    Parameters
+    ----------
+    nuclides: list
+        nuclide names or ids (e.g. 'U235', 922350000)
+    groups: dictionary
+        key=group name, value=iterable of atomic numbers or a
+        function of the (atomic number, mass number) arrays returning
+        a boolean mask. Defaults to nuclide_groups(). A nuclide can
+        belong to several groups (e.g. Pu and TRU).
+
+    Returns
+    -------
+    matrix: np.array
+        len(groups) x len(nuclides) matrix of 0 and 1
+    """
+    if groups is None:
+        groups = nuclide_groups()
+    key = (tuple(nuclides),
+           tuple((name, member if callable(member) else tuple(member))
+                 for name, member in groups.items()))
+    if key in group_matrix_cache:
+        return group_matrix_cache[key]
+    z = np.array([nucname.znum(nuclide) for nuclide in nuclides], dtype=int)
+    a = np.array([nucname.anum(nuclide) for nuclide in nuclides], dtype=int)
+    matrix = np.zeros((len(groups), len(nuclides)))
+    for row, member in enumerate(groups.values()):
+        if callable(member):
+            matrix[row] = member(z, a)
+        else:
+            matrix[row] = np.isin(z, list(member))
+    group_matrix_cache[key] = matrix
+    return matrix
+
+
+def group_timeseries(isotope_timeseries, groups=None):
+    """Sums an isotopic result into nuclide groups with one
+    matrix product, e.g. the output of facility_commodity_flux_isotopics,
+    trade_timeseries(do_isotopic=True) or mass_timeseries
+
+    Parameters
+    ----------
+    isotope_timeseries: dictionary
+        key=nuclide, value=timeseries of mass. Shorter
+        timeseries are padded with zeros at the end.
+    groups: dictionary
+        groups as in group_matrix, defaults to nuclide_groups()
+
+    Returns
+    -------
+    group_series: OrderedDict
+        key=group name, value=timeseries of mass of the group
+    """
+    if groups is None:
+        groups = nuclide_groups()
+    nuclides, masses = isotope_matrix(isotope_timeseries)
+    sums = group_matrix(nuclides, groups).dot(masses)
+    return collections.OrderedDict(zip(groups.keys(), sums))
+
+
 def final_stockpile(cur, facility):
     """get final stockpile in a fuel facility
 
@@ -803,88 +1718,513 @@ def final_stockpile(cur, facility):
         mthm_stockpile += '\n'
     mthm_stockpile += '\n'
 
-    return mthm_stockpile
+    return mthm_stockpile
+
+
+def fuel_into_reactors(cur, is_cum=True):
+    """Finds timeseries of mass of fuel received by reactors
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+
+    Returns
+    -------
+    timeseries list of fuel into reactors [tons]
+    """
+    init_year, init_month, duration, timestep = simulation_timesteps(cur)
+    fuel = cur.execute('SELECT time, sum(quantity) FROM transactions '
+                       'INNER JOIN resources ON '
+                       'resources.resourceid = transactions.resourceid '
+                       'INNER JOIN agententry ON '
+                       'transactions.receiverid = agententry.agentid '
+                       'WHERE spec LIKE "%Reactor%" '
+                       'GROUP BY time').fetchall()
+
+    if is_cum:
+        return timeseries_cum(fuel, duration, True)
+    else:
+        return timeseries(fuel, duration, True)
+
+
+def u_util_calc(cur):
+    """Returns fuel utilization factor of fuel cycle
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+
+    Returns
+    -------
+    u_util_timeseries: numpy array
+        Timeseries of Uranium utilization factor
+    Prints simulation average Uranium Utilization
+    """
+    # timeseries of natural uranium
+    u_supply_timeseries = np.array(nat_u_timeseries(cur))
+
+    # timeseries of fuel into reactors
+    fuel_usage = np.array(fuel_into_reactors(cur))
+
+    # timeseries of Uranium utilization
+    u_util_timeseries = np.nan_to_num(fuel_usage / u_supply_timeseries)
+    print('The Average Fuel Utilization Factor is: ')
+    print(sum(u_util_timeseries) / len(u_util_timeseries))
+
+    return u_util_timeseries
+
+
+def plot_uranium_utilization(cur):
+    """Plots uranium utilization factor of fuel cycle
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+
+    Returns
+    -------
+    none
+    """
+
+    u_util_timeseries = u_util_calc(cur)
+    plt.plot(u_util_timeseries, label='Uranium utilization')
+    plt.xlabel('time [months]')
+    plt.ylabel('Uranium Utilization')
+    plt.legend()
+    plt.show()
+
+
+def fuel_cycle_metrics(cur, is_cum=True):
+    """Returns the standard bundle of fuel cycle metrics, computed with
+    one pass over each of the tables involved (transactions, enrichment
+    timeseries and reactor power) instead of one scan per metric.
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+        (capacity, deployments and uranium utilization are levels
+        and are not affected)
+
+    Returns
+    -------
+    metrics: dictionary
+        dictionary with the following keys, every timeseries has
+        the length of the simulation duration:
+        timestep: numpy array of timesteps [months]
+        years: numpy array of years
+        nat_u: natural uranium feed to enrichment [MTHM]
+        swu: dictionary with "key=Enrichment (facility number),
+             and value=swu timeseries"
+        fuel_loaded: mass of fuel received by reactors [MTHM]
+        spent_fuel: mass of fuel discharged by reactors [MTHM]
+        entered_power: power capacity entered [MWe] (non-cumulative)
+        capacity: dictionary with "key=government, and
+                  value=timeseries of installed capacity [GWe]"
+        deployments: dictionary with "key=government, and
+                     value=timeseries number of reactors"
+        u_util: uranium utilization factor
+    """
+    init_year, init_month, duration, timestep = simulation_timesteps(cur)
+    insts = institutions(cur)
+    metrics = collections.OrderedDict()
+    metrics['timestep'] = timestep
+    metrics['years'] = timestep_to_years(init_year, timestep)
+
+    # enrichment feed and swu
+    feed = cur.execute('SELECT 0, time, sum(value) '
+                       'FROM timeseriesenrichmentfeed '
+                       'GROUP BY time').fetchall()
+    nat_u = grouped_timeseries(feed, [0], duration, True, False)[0]
+    swu = cur.execute('SELECT agentid, time, sum(value) '
+                      'FROM timeseriesenrichmentswu '
+                      'GROUP BY agentid, time').fetchall()
+    enrichment_ids = sorted({row[0] for row in swu})
+    swu = grouped_timeseries(swu, enrichment_ids, duration, False, is_cum)
+
+    # fuel into and out of reactors from one transactions scan
+    fuel = cur.execute('SELECT time, '
+                       'sum(CASE WHEN receiver.spec LIKE "%Reactor%" '
+                       'THEN quantity ELSE 0 END), '
+                       'sum(CASE WHEN sender.spec LIKE "%Reactor%" '
+                       'THEN quantity ELSE 0 END) '
+                       'FROM transactions INNER JOIN resources '
+                       'ON resources.resourceid = transactions.resourceid '
+                       'INNER JOIN agententry AS receiver '
+                       'ON receiver.agentid = transactions.receiverid '
+                       'INNER JOIN agententry AS sender '
+                       'ON sender.agentid = transactions.senderid '
+                       'GROUP BY time').fetchall()
+    fuel = ([(0, row[0], row[1]) for row in fuel] +
+            [(1, row[0], row[2]) for row in fuel])
+    fuel_loaded, spent_fuel = grouped_timeseries(fuel, [0, 1], duration,
+                                                 True, False)
+
+    # capacity, deployments and entered power from one power scan
+    reactors = cur.execute('SELECT agententry.agentid, parentid, '
+                           'entertime, lifetime, exittime, spec, '
+                           'max(value) FROM agententry '
+                           'INNER JOIN timeseriespower '
+                           'ON agententry.agentid = timeseriespower.agentid '
+                           'LEFT OUTER JOIN agentexit '
+                           'ON agententry.agentid = agentexit.agentid '
+                           'GROUP BY agententry.agentid').fetchall()
+    capacity_change = []
+    deployment_change = []
+    entered = []
+    for reactor in reactors:
+        power = reactor['max(value)']
+        parent = reactor['parentid']
+        capacity_change.append((parent, reactor['entertime'], power * 0.001))
+        deployment_change.append((parent, reactor['entertime'], 1))
+        if reactor['lifetime'] >= 0:
+            capacity_change.append((parent, reactor['entertime'] +
+                                    reactor['lifetime'], -power * 0.001))
+        if reactor['exittime'] is not None:
+            deployment_change.append((parent, reactor['exittime'], -1))
+        if 'reactor' in reactor['spec'].lower():
+            entered.append((0, reactor['entertime'], power))
+    inst_ids = [inst['agentid'] for inst in insts]
+    capacity = grouped_timeseries(capacity_change, inst_ids, duration,
+                                  False, True)
+    deployment = grouped_timeseries(deployment_change, inst_ids, duration,
+                                    False, True)
+
+    nat_u_cum = np.cumsum(nat_u)
+    fuel_loaded_cum = np.cumsum(fuel_loaded)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u_util = np.nan_to_num(fuel_loaded_cum / nat_u_cum)
+    if is_cum:
+        nat_u = nat_u_cum
+        fuel_loaded = fuel_loaded_cum
+        spent_fuel = np.cumsum(spent_fuel)
+
+    metrics['nat_u'] = nat_u
+    metrics['swu'] = collections.OrderedDict(
+        ('Enrichment_' + str(num), row)
+        for num, row in zip(enrichment_ids, swu))
+    metrics['fuel_loaded'] = fuel_loaded
+    metrics['spent_fuel'] = spent_fuel
+    metrics['entered_power'] = grouped_timeseries(entered, [0], duration,
+                                                  False, False)[0]
+    metrics['capacity'] = collections.OrderedDict(
+        (inst['prototype'], row) for inst, row in zip(insts, capacity))
+    metrics['deployments'] = collections.OrderedDict(
+        (inst['prototype'], row) for inst, row in zip(insts, deployment))
+    metrics['u_util'] = u_util
+    return metrics
+
+
+def incremental_state(cur):
+    """Returns an empty state for incremental_refresh.
+
+    The state remembers the last processed rowid of every table it reads,
+    so that a growing Cyclus output can be refreshed by reading only
+    the rows written since the last refresh. The output is only read,
+    the refreshes must use the connection of cur, which holds their
+    temporary table.
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor, e.g. from cursor(file_name, read_only=True)
 
+    Returns
+    -------
+    state: dictionary
+        rowid: dictionary with key=table, and value=last processed rowid
+        pending: list of transaction rowids whose resource
+                 was not written yet
+        commodity: dictionary with key=commodity, and
+                   value=monthly mass timeseries [kg]
+        timeseries: dictionary with key=timeseries table (lower case),
+                    and value=monthly sum of values
+        duration: duration of the simulation
+    """
+    init_year, init_month, duration, timestep = simulation_timesteps(cur)
+    # every refresh joins resources on resourceid. The output is not
+    # changed, the quantities are copied into a temporary table keyed
+    # by resourceid, which each refresh extends with the new resources
+    cur.execute('DROP TABLE IF EXISTS temp.incremental_resources')
+    cur.execute('CREATE TEMP TABLE incremental_resources '
+                '(resourceid INTEGER PRIMARY KEY, quantity REAL)')
+    return {'rowid': collections.defaultdict(int),
+            'pending': [],
+            'commodity': collections.OrderedDict(),
+            'timeseries': collections.OrderedDict(),
+            'duration': duration}
+
+
+def accumulate(accumulators, rows, duration):
+    """Adds (key, time, value) rows to timeseries accumulators
+
+    Parameters
+    ----------
+    accumulators: dictionary
+        dictionary with key=key, and value=numpy array timeseries
+    rows: list
+        list of (key, time, value) rows
+    duration: int
+        duration of the simulation
+    """
+    for key, time, value in rows:
+        if key not in accumulators:
+            accumulators[key] = np.zeros(duration)
+        if 0 <= time < duration:
+            accumulators[key][time] += value
 
-def fuel_into_reactors(cur, is_cum=True):
-    """Finds timeseries of mass of fuel received by reactors
+
+def incremental_refresh(cur, state):
+    """Folds the Transactions, Resources and TimeSeries rows written
+    since the last refresh into the accumulators of state
 
     Parameters
     ----------
     cur: sqlite cursor
         sqlite cursor
+    state: dictionary
+        state from incremental_state, updated in place
+
+    Returns
+    -------
+    new_rows: dictionary
+        dictionary with key=table, and value=number of new rows read
+    """
+    new_rows = collections.OrderedDict()
+    rowid = state['rowid']
+    duration = state['duration']
+
+    # transactions whose resource was not written at the last refresh
+    last_resource = cur.execute('SELECT max(rowid) '
+                                'FROM resources').fetchone()[0] or 0
+    new_rows['resources'] = last_resource - rowid['resources']
+    cur.execute('INSERT OR REPLACE INTO incremental_resources '
+                'SELECT resourceid, quantity FROM resources '
+                'WHERE rowid > ? AND rowid <= ?',
+                (rowid['resources'], last_resource))
+    # ends the implicit transaction, which would keep a read lock
+    # on the output and block the writer
+    cur.connection.commit()
+    rowid['resources'] = last_resource
+    trades = []
+    if len(state['pending']) > 0 and new_rows['resources'] > 0:
+        pending = ', '.join(str(x) for x in state['pending'])
+        trades += cur.execute('SELECT transactions.rowid, commodity, time, '
+                              'quantity FROM transactions '
+                              'LEFT OUTER JOIN incremental_resources '
+                              'ON incremental_resources.resourceid = '
+                              'transactions.resourceid '
+                              'WHERE transactions.rowid IN '
+                              '(' + pending + ')').fetchall()
+        state['pending'] = []
+
+    new_trades = cur.execute('SELECT transactions.rowid, commodity, time, '
+                             'quantity FROM transactions '
+                             'LEFT OUTER JOIN incremental_resources '
+                             'ON incremental_resources.resourceid = '
+                             'transactions.resourceid '
+                             'WHERE transactions.rowid > ?',
+                             (rowid['transactions'],)).fetchall()
+    new_rows['transactions'] = len(new_trades)
+    if len(new_trades) > 0:
+        rowid['transactions'] = max(row[0] for row in new_trades)
+    trades += new_trades
+    state['pending'] += [row[0] for row in trades if row[3] is None]
+    accumulate(state['commodity'],
+               [row[1:] for row in trades if row[3] is not None], duration)
+
+    tables = cur.execute('SELECT name FROM sqlite_master '
+                         'WHERE type = "table" AND '
+                         'name LIKE "TimeSeries%"').fetchall()
+    for table in tables:
+        table = table[0].lower()
+        values = cur.execute('SELECT rowid, time, value FROM ' + table +
+                             ' WHERE rowid > ?',
+                             (rowid[table],)).fetchall()
+        new_rows[table] = len(values)
+        if len(values) > 0:
+            rowid[table] = max(row[0] for row in values)
+        accumulate(state['timeseries'],
+                   [(table, row[1], row[2]) for row in values], duration)
+    return new_rows
+
+
+def incremental_timeseries(state, key, kg_to_tons=False, is_cum=True):
+    """Returns a timeseries from the accumulators of state
+
+    Parameters
+    ----------
+    state: dictionary
+        state from incremental_state
+    key: str
+        commodity name or timeseries table name
+    kg_to_tons: bool
+        if True, list returned has units of tons
+        if False, list returned as units of kilograms
     is_cum: bool
         gets cumulative timeseris if True, monthly value if False
 
     Returns
     -------
-    timeseries list of fuel into reactors [tons]
+    timeseries list of key, zeros if key was not recorded yet
     """
-    init_year, init_month, duration, timestep = simulation_timesteps(cur)
-    fuel = cur.execute('SELECT time, sum(quantity) FROM transactions '
-                       'INNER JOIN resources ON '
-                       'resources.resourceid = transactions.resourceid '
-                       'INNER JOIN agententry ON '
-                       'transactions.receiverid = agententry.agentid '
-                       'WHERE spec LIKE "%Reactor%" '
-                       'GROUP BY time').fetchall()
-
+    values = state['commodity'].get(key)
+    if values is None:
+        values = state['timeseries'].get(key, np.zeros(state['duration']))
     if is_cum:
-        return timeseries_cum(fuel, duration, True)
-    else:
-        return timeseries(fuel, duration, True)
+        values = np.cumsum(values)
+    if kg_to_tons:
+        values = values * 0.001
+    return values.tolist()
 
 
-def u_util_calc(cur):
-    """Returns fuel utilization factor of fuel cycle
+def flatten_timeseries(dictionary):
+    """Flattens a dictionary of timeseries with nested dictionaries
+    (eg. capacity per government) to a list
 
     Parameters
     ----------
-    cur: sqlite cursor
-        sqlite cursor
+    dictionary: dictionary
+        dictionary with "key=name, and value=timeseries
+        or dictionary of timeseries"
 
     Returns
     -------
-    u_util_timeseries: numpy array
-        Timeseries of Uranium utilization factor
-    Prints simulation average Uranium Utilization
+    flat: list
+        list of (name, parent key, timeseries) tuples,
+        nested timeseries are named "parent/child"
     """
-    # timeseries of natural uranium
-    u_supply_timeseries = np.array(nat_u_timeseries(cur))
+    flat = []
+    for key, value in dictionary.items():
+        if isinstance(value, dict):
+            for child, child_value in value.items():
+                flat.append((str(key) + '/' + str(child), key, child_value))
+        else:
+            flat.append((str(key), key, value))
+    return flat
 
-    # timeseries of fuel into reactors
-    fuel_usage = np.array(fuel_into_reactors(cur))
 
-    # timeseries of Uranium utilization
-    u_util_timeseries = np.nan_to_num(fuel_usage / u_supply_timeseries)
-    print('The Average Fuel Utilization Factor is: ')
-    print(sum(u_util_timeseries) / len(u_util_timeseries))
+def write_timeseries_table(dictionary, file_name, units=None, attrs=None):
+    """Writes a dictionary of equally long timeseries to a columnar
+    table: a float64 .npy matrix with one row per timeseries and
+    a .json schema naming the rows. The table can be read back
+    with read_timeseries_table without copying the data.
 
-    return u_util_timeseries
+    Parameters
+    ----------
+    dictionary: dictionary
+        dictionary with "key=name, and value=timeseries",
+        nested dictionaries (eg. capacity per government) are
+        stored with "parent/child" names
+    file_name: str
+        path of the table without extension
+    units: dictionary
+        dictionary with "key=name (or parent name), and value=units"
+    attrs: dictionary
+        json serializable information stored in the schema
 
+    Returns
+    -------
+    schema: dictionary
+        schema written to file_name.json
+    """
+    units = units or {}
+    flat = flatten_timeseries(dictionary)
+    matrix = np.array([row[2] for row in flat], dtype=np.float64, ndmin=2)
+    directory = os.path.dirname(file_name)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    np.save(file_name + '.npy', matrix)
+    schema = {'format': 'npy',
+              'data': os.path.basename(file_name) + '.npy',
+              'dtype': str(matrix.dtype),
+              'shape': list(matrix.shape),
+              'rows': [{'name': name, 'units': units.get(parent, '')}
+                       for name, parent, values in flat],
+              'attrs': attrs or {}}
+    with open(file_name + '.json', 'w') as output:
+        json.dump(schema, output, indent=1)
+    return schema
+
+
+def read_timeseries_table(file_name, mmap=True):
+    """Reads a table written by write_timeseries_table
 
-def plot_uranium_utilization(cur):
-    """Plots uranium utilization factor of fuel cycle
+    Parameters
+    ----------
+    file_name: str
+        path of the table without extension
+    mmap: bool
+        if True, the timeseries are read-only views of
+        the memory-mapped file, if False they are loaded in memory
+
+    Returns
+    -------
+    dictionary: dictionary
+        dictionary with "key=name, and value=timeseries array",
+        "parent/child" names are returned as nested dictionaries
+    """
+    with open(file_name + '.json', 'r') as source:
+        schema = json.load(source)
+    matrix = np.load(os.path.join(os.path.dirname(file_name),
+                                  schema['data']),
+                     mmap_mode='r' if mmap else None)
+    dictionary = collections.OrderedDict()
+    for row, info in zip(matrix, schema['rows']):
+        parent, _, child = info['name'].partition('/')
+        if child:
+            dictionary.setdefault(parent, collections.OrderedDict())
+            dictionary[parent][child] = row
+        else:
+            dictionary[parent] = row
+    return dictionary
+
+
+def export_metrics(cur, file_name, is_cum=True):
+    """Computes the standard metrics with fuel_cycle_metrics and
+    writes them to a columnar table with write_timeseries_table
 
     Parameters
     ----------
     cur: sqlite cursor
         sqlite cursor
+    file_name: str
+        path of the table without extension
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
 
     Returns
     -------
-    none
+    schema: dictionary
+        schema written to file_name.json
     """
-
-    u_util_timeseries = u_util_calc(cur)
-    plt.plot(u_util_timeseries, label='Uranium utilization')
-    plt.xlabel('time [months]')
-    plt.ylabel('Uranium Utilization')
-    plt.legend()
-    plt.show()
+    units = {'timestep': 'month',
+             'years': 'year',
+             'nat_u': 'MTHM',
+             'swu': 'kg SWU',
+             'fuel_loaded': 'MTHM',
+             'spent_fuel': 'MTHM',
+             'entered_power': 'MWe',
+             'capacity': 'GWe',
+             'deployments': 'reactors',
+             'u_util': ''}
+    init_year, init_month, duration, timestep = simulation_timesteps(cur)
+    attrs = {'init_year': init_year,
+             'init_month': init_month,
+             'duration': duration,
+             'is_cum': is_cum}
+    return write_timeseries_table(fuel_cycle_metrics(cur, is_cum),
+                                  file_name, units, attrs)
 
 
-def commodity_origin(cur, commodity, prototypes, is_cum=True):
+def commodity_origin(cur, commodity, prototypes=None, is_cum=True):
     """Returns dict of where a commodity is from
 
     Parameters
@@ -894,7 +2234,10 @@ def commodity_origin(cur, commodity, prototypes, is_cum=True):
     commodity: str
         name of commodity
     prototypes: list
-        list of prototypes that provide the commodity
+        list of prototypes that provide the commodity,
+        if None, every prototype that sent the commodity is returned
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
 
     Returns
     -------
@@ -903,25 +2246,28 @@ def commodity_origin(cur, commodity, prototypes, is_cum=True):
         value=timeseries list of commodity sent from prototypes"
     """
     init_year, init_month, duration, timestep = simulation_timesteps(cur)
-    query = ('SELECT time, sum(quantity) FROM transactions '
-             'INNER JOIN resources ON resources.resourceid = '
-             'transactions.resourceid WHERE commodity = "' +
-             str(commodity) + '" AND senderid '
-             '= 9999 GROUP BY time')
+    sent = cur.execute('SELECT lower(prototype), time, sum(quantity), '
+                       'prototype '
+                       'FROM transactions '
+                       'INNER JOIN resources ON resources.resourceid = '
+                       'transactions.resourceid '
+                       'INNER JOIN agententry '
+                       'ON agententry.agentid = transactions.senderid '
+                       'WHERE commodity = ? '
+                       'GROUP BY lower(prototype), time',
+                       (commodity,)).fetchall()
+    if prototypes is None:
+        prototypes = sorted({row['prototype'] for row in sent})
+    matrix = grouped_timeseries(sent, [x.lower() for x in prototypes],
+                                duration, True, is_cum)
     prototype_trades = collections.OrderedDict()
-    for agent in prototypes:
-        agent_id = prototype_id(cur, agent)
-        from_agent = cur.execute(query.replace(
-            '9999', ' OR senderid = '.join(agent_id))).fetchall()
-        if is_cum:
-            prototype_trades[agent] = timeseries_cum(
-                from_agent, duration, True)
-        else:
-            prototype_trades[agent] = timeseries(from_agent, duration, True)
+    for agent, row in zip(prototypes, matrix):
+        prototype_trades[agent] = row.tolist()
     return prototype_trades
 
 
-def commodity_per_institution(cur, commodity, timestep=10000):
+def commodity_per_institution(cur, commodity, timestep=10000,
+                              is_timeseries=False, is_cum=True):
     """Outputs outflux of commodity per institution
         before timestep
 
@@ -931,29 +2277,50 @@ def commodity_per_institution(cur, commodity, timestep=10000):
         sqlite cursor
     commodity: str
         commodity to search for
+    timestep: int
+        only transactions before this timestep are counted
+    is_timeseries: bool
+        if True, returns the timeseries of outflux for every institution,
+        if False, returns the total outflux before timestep
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+        (only used if is_timeseries is True)
 
     Returns
     -------
     institution_output: dictionary
         key = institution
-        value = timeseries list of outflux of commodity
+        value = total outflux of commodity [kg]
+                (None if the institution never sent the commodity),
+                or timeseries list of outflux of commodity [kg]
+                if is_timeseries
     """
-
     insts = institutions(cur)
+    outflux = cur.execute('SELECT parentid, time, sum(quantity) '
+                          'FROM transactions '
+                          'INNER JOIN resources '
+                          'ON resources.resourceid = '
+                          'transactions.resourceid '
+                          'INNER JOIN agententry '
+                          'ON agententry.agentid = transactions.senderid '
+                          'WHERE commodity = ? AND time < ? '
+                          'GROUP BY parentid, time',
+                          (commodity, timestep)).fetchall()
     institution_output = collections.OrderedDict()
+    if is_timeseries:
+        init_year, init_month, duration, timestep = simulation_timesteps(cur)
+        inst_ids = [inst['agentid'] for inst in insts]
+        matrix = grouped_timeseries(outflux, inst_ids, duration,
+                                    False, is_cum)
+        for inst, row in zip(insts, matrix):
+            institution_output[inst['prototype']] = row.tolist()
+        return institution_output
+
+    totals = {}
+    for parentid, time, quantity in outflux:
+        totals[parentid] = totals.get(parentid, 0) + quantity
     for inst in insts:
-        inst_id = inst[1]
-        inst_name = inst[0]
-        facilities = cur.execute('SELECT agentid FROM agententry '
-                                 'WHERE parentid = ' + str(inst_id)).fetchall()
-        facilities_collected = []
-        for fac in facilities:
-            facilities_collected.append(fac[0])
-        query = exec_string(facilities_collected, 'senderid', 'sum(quantity)')
-        query += ' AND commodity = "' + commodity + \
-            '" and time < ' + str(timestep)
-        institution_output[inst_name] = cur.execute(query).fetchone()[0]
-
+        institution_output[inst['prototype']] = totals.get(inst['agentid'])
     return institution_output
 
 
@@ -1093,6 +2460,163 @@ def reactor_deployments(insts, timestep, entry, exit_step):
     return deployment
 
 
+def top_series(dictionary, top, by='final', other='other'):
+    """Keeps the top series of a dictionary and sums the rest
+    into a single 'other' series
+
+    Parameters
+    ----------
+    dictionary: dictionary
+        dictionary with key: timeseries data (all of the same length)
+    top: int
+        number of series to keep, None keeps every series
+    by: str
+        'final' ranks the series by their last value,
+        'peak' by their maximum
+    other: str
+        key of the series holding the sum of the dropped series
+
+    Returns
+    -------
+    selection: OrderedDict
+        the kept series, largest first, followed by
+        the other series if any series was dropped
+    """
+    keys = list(dictionary.keys())
+    selection = collections.OrderedDict()
+    if len(keys) == 0:
+        return selection
+    matrix = np.array([dictionary[key] for key in keys], dtype=float)
+    if by == 'final':
+        score = matrix[:, -1]
+    elif by == 'peak':
+        score = matrix.max(axis=1)
+    else:
+        raise ValueError('Unknown ranking: ' + by)
+    if top is None or top >= len(keys):
+        kept = np.argsort(-score, kind='mergesort')
+    else:
+        # only the top entries are partitioned out, then ordered
+        kept = np.argpartition(-score, top - 1)[:top]
+        kept = kept[np.argsort(-score[kept], kind='mergesort')]
+    for index in kept:
+        selection[keys[index]] = matrix[index]
+    if len(kept) < len(keys):
+        dropped = np.ones(len(keys), dtype=bool)
+        dropped[kept] = False
+        selection[other] = matrix[dropped].sum(axis=0)
+    return selection
+
+
+def lttb_indices(x, y, max_points):
+    """Returns indices of the points kept by the
+    largest-triangle-three-buckets downsampling of a series
+
+    Parameters
+    ----------
+    x: np.array
+        x values of the series
+    y: np.array
+        y values of the series
+    max_points: int
+        number of points to keep
+
+    Returns
+    -------
+    np.array of sorted indices into x and y
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+    # first and last points are always kept, the rest is split into
+    # max_points - 2 buckets that each contribute one point
+    edges = np.append(np.linspace(1, n - 1, max_points - 1).astype(int), n)
+    indices = np.empty(max_points, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    prev = 0
+    for i in range(max_points - 2):
+        start, stop = edges[i], edges[i + 1]
+        avg_x = x[stop:edges[i + 2]].mean()
+        avg_y = y[stop:edges[i + 2]].mean()
+        area = np.abs((x[prev] - avg_x) * (y[start:stop] - y[prev]) -
+                      (x[prev] - x[start:stop]) * (avg_y - y[prev]))
+        prev = start + np.argmax(area)
+        indices[i + 1] = prev
+    return indices
+
+
+def minmax_indices(y, max_points):
+    """Returns indices of the minimum and maximum of every bucket
+    of a series, so that spikes survive the downsampling
+
+    Parameters
+    ----------
+    y: np.array
+        y values of the series
+    max_points: int
+        number of points to keep
+
+    Returns
+    -------
+    np.array of sorted indices into y
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if max_points >= n or max_points < 4:
+        return np.arange(n)
+    buckets = (max_points - 2) // 2
+    bucket = np.repeat(np.arange(buckets),
+                       np.diff(np.linspace(0, n, buckets + 1).astype(int)))
+    # sorted by bucket then by value: first of each bucket is its minimum
+    # and last of each bucket its maximum
+    order = np.lexsort((y, bucket))
+    bounds = np.searchsorted(bucket[order], np.arange(buckets))
+    minimum = order[bounds]
+    maximum = order[np.append(bounds[1:], n) - 1]
+    return np.unique(np.concatenate(([0, n - 1], minimum, maximum)))
+
+
+def decimate(x, y, max_points, method='lttb'):
+    """Downsamples a series (or a stack of series sharing x)
+    to at most max_points points before plotting
+
+    Parameters
+    ----------
+    x: np.array
+        x values
+    y: np.array
+        y values, either one series or a 2D array with one
+        series per row (the points are then chosen from the sum
+        of the rows, so a stackplot keeps its envelope)
+    max_points: int
+        number of points to keep, None keeps every point
+    method: str
+        'lttb' (largest-triangle-three-buckets) or 'minmax'
+
+    Returns
+    -------
+    x: np.array
+        downsampled x values
+    y: np.array
+        downsampled y values
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    if max_points is None or len(x) <= max_points:
+        return x, y
+    envelope = y if y.ndim == 1 else y.sum(axis=0)
+    if method == 'lttb':
+        indices = lttb_indices(x, envelope, max_points)
+    elif method == 'minmax':
+        indices = minmax_indices(envelope, max_points)
+    else:
+        raise ValueError('Unknown decimation method: ' + method)
+    return x[indices], y[..., indices]
+
+
 def multiple_line_plots(dictionary, timestep,
                         xlabel, ylabel, title,
                         outputname, init_year):
@@ -1117,11 +2641,20 @@ def multiple_line_plots(dictionary, timestep,
     Returns
     -------
     plot: plot
-        multiple line plots
+        one line plot per key, saved as [label]_[outputname].png
     """
-    # set different colors for each bar
-    color_index = 0
-    # for every country, create bar chart with different color
+    # one figure and line are reused for every key,
+    # so that every file is rendered once
+    fig, ax = plt.subplots()
+    line, = ax.plot([], [])
+    if sum(sum(dictionary[k]) for k in dictionary) > 1000:
+        ax.get_yaxis().set_major_formatter(
+            plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.grid(True)
+    years = timestep_to_years(init_year, timestep)
     for key in dictionary:
         # label is the name of the nuclide (converted from ZZAAA0000 format)
         if isinstance(key, str) is True:
@@ -1129,23 +2662,80 @@ def multiple_line_plots(dictionary, timestep,
         else:
             label = str(key)
 
-        plt.plot(timestep_to_years(init_year, timestep),
-                 dictionary[key],
-                 label=label)
-        color_index += 1
-        if sum(sum(dictionary[k]) for k in dictionary) > 1000:
-            ax = plt.gca()
-            ax.get_yaxis().set_major_formatter(
-                plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-        plt.ylabel(ylabel)
-        plt.title(title)
-        plt.xlabel(xlabel)
-        plt.legend(loc=(1.0, 0), prop={'size': 10})
-        plt.grid(True)
-        plt.savefig(label + '_' + outputname + '.png',
+        line.set_data(years, dictionary[key])
+        line.set_label(label)
+        ax.relim()
+        ax.autoscale_view()
+        ax.legend(loc=(1.0, 0), prop={'size': 10})
+        fig.savefig(label + '_' + outputname + '.png',
                     format='png',
                     bbox_inches='tight')
-        plt.close()
+    plt.close(fig)
+
+
+def render_figure(job):
+    """Calls a plotting function that saves its figure to file,
+    used by render_figures to render one figure in a worker process
+
+    Parameters
+    ----------
+    job: tuple
+        (function, args) or (function, args, kwargs) where function
+        is a plotting function of this module (or its name)
+
+    Returns
+    -------
+    result of the plotting function, None for axes and figures
+    since they cannot leave the worker process
+    """
+    function, args = job[0], job[1]
+    kwargs = job[2] if len(job) > 2 else {}
+    if isinstance(function, str):
+        function = globals()[function]
+    open_figures = set(plt.get_fignums())
+    result = function(*args, **kwargs)
+    # only the figures of this job are closed, not the caller's
+    for number in set(plt.get_fignums()) - open_figures:
+        plt.close(number)
+    if isinstance(result, (plt.Axes, plt.Figure)):
+        return None
+    return result
+
+
+def render_figures(jobs, workers=None):
+    """Renders many independent figures in a pool of worker processes
+    using the non-interactive Agg backend. With a single worker, the
+    figures are rendered in the calling process, with its backend,
+    and the figures it has open are left open.
+
+    Only plotting functions that save their figure to file
+    (eg. stacked_bar_chart, combined_line_plot, multiple_line_plots,
+    double_axis_bar_line_plot) are meaningful here.
+
+    Parameters
+    ----------
+    jobs: list
+        list of (function, args) or (function, args, kwargs) tuples,
+        see render_figure
+    workers: int
+        number of worker processes, number of cpus if None
+
+    Returns
+    -------
+    results: list
+        list of the results of the plotting functions
+    """
+    if workers is None:
+        workers = cpu_count()
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        return [render_figure(job) for job in jobs]
+    pool = Pool(workers, initializer=plt.switch_backend,
+                initargs=('Agg',))
+    results = pool.map(render_figure, jobs)
+    pool.close()
+    pool.join()
+    return results
 
 
 def combined_line_plot(dictionary, timestep,
@@ -1399,7 +2989,7 @@ def double_axis_line_line_plot(dictionary1, dictionary2, timestep,
 def stacked_bar_chart(dictionary, timestep,
                       xlabel, ylabel, title,
                       outputname, init_year,
-                      colormap=cm.viridis):
+                      colormap=cm.viridis, max_bars=300):
     """Creates stacked bar chart of timstep vs dictionary
 
     Parameters
@@ -1416,69 +3006,77 @@ def stacked_bar_chart(dictionary, timestep,
         title of plot
     init_year: int
         simulation start year
+    max_bars: int
+        above this many timesteps the bars are drawn as stepped
+        areas (one polygon per key) instead of one collection of
+        rectangles per key
 
     Returns
     -------
-    plot : plot
-        plot of stacked bar chart of timstep vs dictionary
+    ax : matplotlib axes
+        axes of the stacked bar chart of timstep vs dictionary,
+        saved in outputname.png. None if dictionary is empty
     """
-    # set different colors for each bar
-    color_index = 0
-    top_index = True
-    prev = np.zeros(1)
-    plots = []
-    # for every country, create bar chart with different color
-    for key in dictionary:
+    years = timestep_to_years(init_year, timestep)
+    keys = list(dictionary.keys())
+    if len(keys) == 0:
+        return
+    matrix = np.array([dictionary[key] for key in keys], dtype=float)
+    # every row is stacked on the cumulative sum of the rows before it
+    top = np.cumsum(matrix, axis=0)
+    bottom = top - matrix
+    totals = matrix.sum(axis=1)
+
+    labels = []
+    for key in keys:
         if isinstance(key, str) is True:
-            label = key.replace('_government', '')
+            labels.append(key.replace('_government', ''))
         else:
-            label = str(key)
-        # very first country does not have a 'bottom' argument
-        if sum(dictionary[key]) == 0:
-            print(label + ' has no values')
-        elif top_index is True:
-            plot = plt.bar(x=timestep_to_years(init_year, timestep),
-                           height=dictionary[key],
-                           width=0.5,
-                           color=colormap(
-                float(color_index) / len(dictionary)),
-                edgecolor='none',
-                label=label)
-            prev = dictionary[key]
-            top_index = False
-            plots.append(plot)
-
-        # All curves except the first have a 'bottom'
-        # defined by the previous curve
+            labels.append(str(key))
+    colors = [colormap(float(i) / len(keys)) for i in range(len(keys))]
+    shown = []
+    for i in range(len(keys)):
+        if totals[i] == 0:
+            print(labels[i] + ' has no values')
         else:
-            plot = plt.bar(x=timestep_to_years(init_year, timestep),
-                           height=dictionary[key],
-                           width=0.5,
-                           color=colormap(
-                float(color_index) / len(dictionary)),
-                edgecolor='none',
-                bottom=prev,
-                label=label)
-            prev = np.add(prev, dictionary[key])
-            plots.append(plot)
-
-        color_index += 1
-
-    # plot
-    if sum(sum(dictionary[k]) for k in dictionary) > 1000:
-        ax = plt.gca()
+            shown.append(i)
+
+    fig, ax = plt.subplots()
+    if len(shown) > 0 and len(years) > max_bars:
+        for i in shown:
+            ax.fill_between(years, bottom[i], top[i], step='mid',
+                            color=colors[i], edgecolor='none',
+                            label=labels[i])
+    elif len(shown) > 0:
+        # the bars of each stack are one collection of rectangles
+        left = np.asarray(years, dtype=float) - 0.25
+        right = left + 0.5
+        for i in shown:
+            bars = np.stack([np.column_stack((left, bottom[i])),
+                             np.column_stack((left, top[i])),
+                             np.column_stack((right, top[i])),
+                             np.column_stack((right, bottom[i]))], axis=1)
+            collection = PolyCollection(bars, facecolors=[colors[i]],
+                                        edgecolors='none', label=labels[i])
+            # like ax.bar, the y axis starts at the base of the bars
+            collection.sticky_edges.y.append(0)
+            ax.add_collection(collection)
+        ax.autoscale_view()
+    if totals.sum() > 1000:
         ax.get_yaxis().set_major_formatter(
             plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-    plt.ylabel(ylabel)
-    plt.title(title)
-    plt.xlabel(xlabel)
-    axes = plt.gca()
-    handles, labels = ax.get_legend_handles_labels()
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
     if len(dictionary) > 1:
-        plt.legend(handles[::-1], labels[::-1], loc=(1.0, 0), )
-    plt.grid(True)
-    plt.savefig(outputname + '.png', format='png', bbox_inches='tight')
-    plt.close()
+        handles = [plt.Rectangle((0, 0), 1, 1, color=colors[i])
+                   for i in shown]
+        ax.legend(handles[::-1], [labels[i] for i in shown][::-1],
+                  loc=(1.0, 0), )
+    ax.grid(True)
+    fig.savefig(outputname + '.png', format='png', bbox_inches='tight')
+    plt.close(fig)
+    return ax
 
 
 def plot_power(cur):
@@ -1508,7 +3106,8 @@ def plot_power(cur):
 
 
 def plot_in_out_flux(cur, facility, influx_bool,
-                     title, is_cum=False, is_tot=False):
+                     title, is_cum=False, is_tot=False,
+                     max_points=4000, method='lttb', top=10):
     """Plots timeseries influx/ outflux from facility name in kg.
 
     Parameters
@@ -1527,6 +3126,14 @@ def plot_in_out_flux(cur, facility, influx_bool,
     is_cum: Boolean:
         true: add isotope masses over time
         false: do not add isotope masses at each timestep
+    max_points: int
+        point budget of the figure, longer series are decimated
+        before drawing (None draws every point)
+    method: str
+        decimation method, 'lttb' or 'minmax' (see decimate)
+    top: int
+        number of nuclides drawn in cumulative plots, the others
+        are summed into one 'other' series (None draws every nuclide)
 
     Returns
     -------
@@ -1572,10 +3179,15 @@ def plot_in_out_flux(cur, facility, influx_bool,
         for key in waste_mass.keys():
             keys.append(key)
 
+        series_points = None
+        if max_points is not None:
+            series_points = max(max_points // max(len(keys), 1), 3)
         for element in range(len(keys)):
             time_and_mass = np.array(time_waste[keys[element]])
-            time = [item[0] for item in time_and_mass]
-            mass = [item[1] for item in time_and_mass]
+            if len(time_and_mass) == 0:
+                continue
+            time, mass = decimate(time_and_mass[:, 0], time_and_mass[:, 1],
+                                  series_points, method)
             plt.plot(time, mass, linestyle=' ', marker='.',
                      markersize=1, label=nucname.name(keys[0]))
 
@@ -1615,11 +3227,13 @@ def plot_in_out_flux(cur, facility, influx_bool,
             times.append(time)
             nuclides.append(str(nuclide))
             masstime[nucname.name(keys[element])] = mass_cum
-        mass_sort = sorted(
-            masstime.items(), key=lambda e: e[1][-1], reverse=True)
-        nuclides = [item[0] for item in mass_sort]
-        masses = [item[1] for item in mass_sort]
-        plt.stackplot(times[0], masses, labels=nuclides)
+        # a facility without transactions gets an empty figure
+        if len(times) > 0:
+            selection = top_series(masstime, top)
+            nuclides = list(selection.keys())
+            masses = list(selection.values())
+            time, masses = decimate(times[0], masses, max_points, method)
+            plt.stackplot(time, masses, labels=nuclides)
         plt.legend(loc='upper left')
         plt.title(title)
         plt.xlabel('time [months]')
@@ -1633,13 +3247,16 @@ def plot_in_out_flux(cur, facility, influx_bool,
         for key in waste_mass.keys():
             keys.append(key)
 
-        total_mass = np.zeros(len(waste_mass[keys[0]]))
+        # a facility without transactions has no keys, only zeros
+        total_mass = np.zeros(len(waste_mass[keys[0]]) if keys else duration)
         for element in range(len(keys)):
             for index in range(len(waste_mass[keys[0]])):
                 total_mass[index] += waste_mass[keys[element]][index]
 
+        time, total_mass = decimate(np.arange(len(total_mass)), total_mass,
+                                    max_points, method)
         total_mass[total_mass == 0] = np.nan
-        plt.plot(total_mass, linestyle=' ', marker='.', markersize=1)
+        plt.plot(time, total_mass, linestyle=' ', marker='.', markersize=1)
         plt.title(title)
         plt.xlabel('time [months]')
         plt.ylabel('mass [kg]')
@@ -1665,11 +3282,13 @@ def plot_in_out_flux(cur, facility, influx_bool,
             times.append(time)
             nuclides.append(str(nuclide))
             masstime[nucname.name(keys[element])] = mass_cum
-        mass_sort = sorted(
-            masstime.items(), key=lambda e: e[1][-1], reverse=True)
-        nuclides = [item[0] for item in mass_sort]
-        masses = [item[1] for item in mass_sort]
-        plt.stackplot(times[0], masses, labels=nuclides)
+        # a facility without transactions gets an empty figure
+        if len(times) > 0:
+            selection = top_series(masstime, top)
+            nuclides = list(selection.keys())
+            masses = list(selection.values())
+            time, masses = decimate(times[0], masses, max_points, method)
+            plt.stackplot(time, masses, labels=nuclides)
         plt.legend(loc='upper left')
         plt.title(title)
         plt.xlabel('time [months]')
@@ -1735,7 +3354,10 @@ def source_throughput(cur, duration, frac_prod, frac_tail):
 def plot_in_flux_cumulative(
         cur,
         facility,
-        title):
+        title,
+        max_points=4000,
+        method='lttb',
+        top=10):
     """Plots timeseries influx/ outflux from facility name in kg.
 
     Parameters
@@ -1754,18 +3376,25 @@ def plot_in_flux_cumulative(
     is_cum: Boolean:
         true: add isotope masses over time
         false: do not add isotope masses at each timestep
+    max_points: int
+        point budget of the figure, longer series are decimated
+        before drawing (None draws every point)
+    method: str
+        decimation method, 'lttb' or 'minmax' (see decimate)
+    top: int
+        number of nuclides drawn in cumulative plots, the others
+        are summed into one 'other' series (None draws every nuclide)
 
     Returns
     -------
     """
 
-    masstime = cumulative_mass_timeseries(cur, facility, flux='in')[0]
-    times = cumulative_mass_timeseries(cur, facility, flux='in')[1]
-    mass_sort = sorted(masstime.items(), key=lambda e: e[
-                       1][-1], reverse=True)
-    nuclides = [item[0] for item in mass_sort]
-    masses = [item[1] for item in mass_sort]
-    plt.stackplot(times[0], masses, labels=nuclides)
+    masstime, times = cumulative_mass_timeseries(cur, facility, flux='in')
+    selection = top_series(masstime, top)
+    nuclides = list(selection.keys())
+    masses = list(selection.values())
+    time, masses = decimate(times[0], masses, max_points, method)
+    plt.stackplot(time, masses, labels=nuclides)
     plt.legend(loc='upper left')
     plt.title(title)
     plt.xlabel('time [months]')
@@ -1778,7 +3407,10 @@ def plot_in_flux_cumulative(
 def plot_out_flux_cumulative(
         cur,
         facility,
-        title):
+        title,
+        max_points=4000,
+        method='lttb',
+        top=10):
     """Plots timeseries influx/ outflux from facility name in kg.
 
     Parameters:
@@ -1797,20 +3429,25 @@ def plot_out_flux_cumulative(
     is_cum: Boolean:
         true: add isotope masses over time
         false: do not add isotope masses at each timestep
+    max_points: int
+        point budget of the figure, longer series are decimated
+        before drawing (None draws every point)
+    method: str
+        decimation method, 'lttb' or 'minmax' (see decimate)
+    top: int
+        number of nuclides drawn in cumulative plots, the others
+        are summed into one 'other' series (None draws every nuclide)
 
     Returns:
     --------
     """
 
-    masses = cumulative_mass_timeseries(cur, facility, flux='out')
-    masstime = masses[0]
-    times = masses[1]
-
-    mass_sort = sorted(masstime.items(), key=lambda e: e[
-                       1][-1], reverse=True)
-    nuclides = [item[0] for item in mass_sort]
-    masses = [item[1] for item in mass_sort]
-    plt.stackplot(times[0], masses, labels=nuclides)
+    masstime, times = cumulative_mass_timeseries(cur, facility, flux='out')
+    selection = top_series(masstime, top)
+    nuclides = list(selection.keys())
+    masses = list(selection.values())
+    time, masses = decimate(times[0], masses, max_points, method)
+    plt.stackplot(time, masses, labels=nuclides)
     plt.legend(loc='upper left')
     plt.title(title)
     plt.xlabel('time [months]')
@@ -1823,7 +3460,9 @@ def plot_out_flux_cumulative(
 def plot_in_flux_basic(
         cur,
         facility,
-        title):
+        title,
+        max_points=4000,
+        method='lttb'):
     """Plots timeseries influx/ outflux from facility name in kg.
 
     Parameters
@@ -1842,6 +3481,11 @@ def plot_in_flux_basic(
     is_cum: Boolean:
         true: add isotope masses over time
         false: do not add isotope masses at each timestep
+    max_points: int
+        point budget of the figure, longer series are decimated
+        before drawing (None draws every point)
+    method: str
+        decimation method, 'lttb' or 'minmax' (see decimate)
 
     Returns
     -------
@@ -1854,8 +3498,12 @@ def plot_in_flux_basic(
         1][-1], reverse=True)
     nuclides = [item[0] for item in mass_sort]
     masses = [item[1] for item in mass_sort]
+    series_points = None
+    if max_points is not None:
+        series_points = max(max_points // max(len(times), 1), 3)
     for i in range(len(times)):
-        plt.plot(times[i], masses[i], label=nuclides[i])
+        time, mass = decimate(times[i], masses[i], series_points, method)
+        plt.plot(time, mass, label=nuclides[i])
     plt.legend(loc='upper left')
     plt.title(title)
     plt.xlabel('time [months]')
@@ -1868,7 +3516,9 @@ def plot_in_flux_basic(
 def plot_out_flux_basic(
         cur,
         facility,
-        title):
+        title,
+        max_points=4000,
+        method='lttb'):
     """Plots timeseries influx/ outflux from facility name in kg.
 
     Parameters
@@ -1887,6 +3537,11 @@ def plot_out_flux_basic(
     is_cum: Boolean:
         true: add isotope masses over time
         false: do not add isotope masses at each timestep
+    max_points: int
+        point budget of the figure, longer series are decimated
+        before drawing (None draws every point)
+    method: str
+        decimation method, 'lttb' or 'minmax' (see decimate)
 
     Returns
     -------
@@ -1901,8 +3556,12 @@ def plot_out_flux_basic(
         1][-1], reverse=True)
     nuclides = [item[0] for item in mass_sort]
     masses = [item[1] for item in mass_sort]
+    series_points = None
+    if max_points is not None:
+        series_points = max(max_points // max(len(times), 1), 3)
     for i in range(len(times)):
-        plt.plot(times[i], masses[i], label=nuclides[i])
+        time, mass = decimate(times[i], masses[i], series_points, method)
+        plt.plot(time, mass, label=nuclides[i])
     plt.legend(loc='upper left')
     plt.title(title)
     plt.xlabel('time [months]')
@@ -1915,7 +3574,10 @@ def plot_out_flux_basic(
 def plot_net_flux(
         cur,
         facility,
-        title):
+        title,
+        max_points=4000,
+        method='lttb',
+        top=10):
     """Plots net flux of all isotopes over the duration of the simulation.
     Parameters
     ----------
@@ -1925,25 +3587,33 @@ def plot_net_flux(
         name of facility
     title : str
         title of plot
+    max_points : int
+        point budget of the figure, longer series are decimated
+        before drawing (None draws every point)
+    method : str
+        decimation method, 'lttb' or 'minmax' (see decimate)
+    top : int
+        number of nuclides drawn per direction, the others
+        are summed into one 'other' series (None draws every nuclide)
     Returns
     -------
     plot : plot
         plot of net flux of isotopes
     """
-    masstime_in = mass_timeseries(cur, facility, flux='in')[0]
-    times_in = mass_timeseries(cur, facility, flux='in')[1]
-    masstime_out = mass_timeseries(cur, facility, flux='out')[0]
-    times_out = mass_timeseries(cur, facility, flux='out')[1]
-    mass_sort_in = sorted(masstime_in.items(), key=lambda e: e[
-        1][-1], reverse=True)
-    mass_sort_out = sorted(masstime_out.items(), key=lambda e: e[
-        1][-1], reverse=True)
-    nuclides_in = [item[0] for item in mass_sort_in]
-    masses_in = [item[1] for item in mass_sort_in]
-    nuclides_out = [item[0] for item in mass_sort_out]
-    masses_out = np.negative([item[1] for item in mass_sort_out])
-    plt.stackplot(times_in[0], masses_in, labels=nuclides_in)
-    plt.stackplot(times_out[0], masses_out, labels=nuclides_out)
+    masstime_in, times_in = mass_timeseries(cur, facility, flux='in')
+    masstime_out, times_out = mass_timeseries(cur, facility, flux='out')
+    selection_in = top_series(masstime_in, top)
+    selection_out = top_series(masstime_out, top)
+    nuclides_in = list(selection_in.keys())
+    masses_in = list(selection_in.values())
+    nuclides_out = list(selection_out.keys())
+    masses_out = np.negative(list(selection_out.values()))
+    time_in, masses_in = decimate(times_in[0], masses_in,
+                                  max_points, method)
+    time_out, masses_out = decimate(times_out[0], masses_out,
+                                    max_points, method)
+    plt.stackplot(time_in, masses_in, labels=nuclides_in)
+    plt.stackplot(time_out, masses_out, labels=nuclides_out)
     plt.legend(loc='upper left')
     plt.title(title)
     plt.xlabel('time [months]')
@@ -2377,3 +4047,251 @@ def total_isotope_used(cur, facility):
         mass = total_isotope[i]
         total_mass_used[nuclide] = mass
     return total_mass_used
+
+
+def select_metrics(metrics, names=None, start=None, end=None):
+    """Selects metrics and a time window from fuel_cycle_metrics output
+
+    Parameters
+    ----------
+    metrics: dictionary
+        dictionary from fuel_cycle_metrics
+    names: list
+        list of metric names to keep (timestep and years are always kept),
+        all metrics if None
+    start: int
+        first timestep of the window, start of simulation if None
+    end: int
+        timestep after the window, end of simulation if None
+
+    Returns
+    -------
+    selected: dictionary
+        dictionary with the selected metrics in the time window
+    """
+    if names is not None:
+        unknown = set(names) - set(metrics.keys())
+        if len(unknown) > 0:
+            raise ValueError('Unknown metrics: ' +
+                             ', '.join(sorted(unknown)))
+    window = slice(start, end)
+    selected = collections.OrderedDict()
+    for key, value in metrics.items():
+        if (names is not None and key not in names and
+                key not in ('timestep', 'years')):
+            continue
+        if isinstance(value, dict):
+            selected[key] = collections.OrderedDict(
+                (child, np.asarray(child_value)[window])
+                for child, child_value in value.items())
+        else:
+            selected[key] = np.asarray(value)[window]
+    return selected
+
+
+def write_metrics_csv(metrics, file_name):
+    """Writes metrics as a csv file with one column per timeseries
+
+    Parameters
+    ----------
+    metrics: dictionary
+        dictionary with "key=name, and value=timeseries
+        or dictionary of timeseries"
+    file_name: str
+        path of the csv file
+    """
+    flat = flatten_timeseries(metrics)
+    with open(file_name, 'w') as output:
+        writer = csv.writer(output)
+        writer.writerow([name for name, parent, values in flat])
+        for row in zip(*[values for name, parent, values in flat]):
+            writer.writerow(['%.10g' % x for x in row])
+
+
+def write_metrics_json(metrics, file_name):
+    """Writes metrics as a json file with one list per timeseries
+
+    Parameters
+    ----------
+    metrics: dictionary
+        dictionary with "key=name, and value=timeseries
+        or dictionary of timeseries"
+    file_name: str
+        path of the json file
+    """
+    flat = flatten_timeseries(metrics)
+    with open(file_name, 'w') as output:
+        json.dump(collections.OrderedDict(
+            (name, np.asarray(values).tolist())
+            for name, parent, values in flat), output)
+
+
+def path_hash(file_name):
+    """Returns a short hash of the absolute path of a file
+
+    Parameters
+    ----------
+    file_name: str
+        path of the file
+
+    Returns
+    -------
+    hex digest of 8 characters
+    """
+    path = os.path.abspath(file_name).encode('utf-8')
+    return hashlib.sha1(path).hexdigest()[:8]
+
+
+def output_names(file_names):
+    """Returns the names of the results of Cyclus output files:
+    the base name of each file, followed by a hash of its path
+    if another file has the same base name
+
+    Parameters
+    ----------
+    file_names: list
+        paths of the Cyclus output files
+
+    Returns
+    -------
+    names: list
+        result name of each file
+    """
+    bases = [os.path.splitext(os.path.basename(x))[0] for x in file_names]
+    count = Counter(bases)
+    return [base if count[base] == 1 else base + '_' + path_hash(file_name)
+            for base, file_name in zip(bases, file_names)]
+
+
+def analyze_file(job):
+    """Computes the metrics of one Cyclus output file and writes them
+    in the output directory. Used by main, one job per output file.
+
+    Parameters
+    ----------
+    job: tuple
+        (file_name, options, base) where file_name is the path of the
+        Cyclus output, options is a dictionary with the keys
+        metrics, output_dir, format, start, end, is_cum and cache,
+        and base is the name of the result from output_names
+
+    Returns
+    -------
+    out_file: str
+        path of the written result
+    """
+    file_name, options, base = job
+    output_dir = options['output_dir']
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    # the path hash keeps outputs with the same name apart
+    cache_name = os.path.join(output_dir, '.' + base + '_' +
+                              path_hash(file_name) + '_cache')
+    metrics = None
+    if (options['cache'] and os.path.isfile(cache_name + '.json') and
+            os.path.isfile(cache_name + '.npy') and
+            os.path.getmtime(cache_name + '.npy') >=
+            os.path.getmtime(file_name)):
+        with open(cache_name + '.json', 'r') as source:
+            is_cum = json.load(source)['attrs'].get('is_cum')
+        if is_cum == options['is_cum']:
+            metrics = read_timeseries_table(cache_name)
+    if metrics is None:
+        cur = cursor(file_name)
+        if options['cache']:
+            export_metrics(cur, cache_name, options['is_cum'])
+            metrics = read_timeseries_table(cache_name)
+        else:
+            metrics = fuel_cycle_metrics(cur, options['is_cum'])
+        cur.connection.close()
+    metrics = select_metrics(metrics, options['metrics'],
+                             options['start'], options['end'])
+
+    out_file = os.path.join(output_dir, base)
+    if options['format'] == 'csv':
+        out_file += '.csv'
+        write_metrics_csv(metrics, out_file)
+    elif options['format'] == 'json':
+        out_file += '.json'
+        write_metrics_json(metrics, out_file)
+    else:
+        write_timeseries_table(metrics, out_file)
+        out_file += '.npy'
+    return out_file
+
+
+def main(argv=None):
+    """Command line entry point: computes the standard fuel cycle metrics
+    of one or more Cyclus output files and writes them to files.
+
+    Parameters
+    ----------
+    argv: list
+        command line arguments, sys.argv[1:] if None
+    """
+    parser = argparse.ArgumentParser(
+        description='Computes fuel cycle metrics of Cyclus output files.')
+    parser.add_argument('files', nargs='+',
+                        help='Cyclus output files (.sqlite)')
+    parser.add_argument('--config',
+                        help='json file with default values for the '
+                             'options below (keys are the option names '
+                             'with underscores)')
+    parser.add_argument('--metrics', nargs='+',
+                        help='metrics to write (default: all of '
+                             'fuel_cycle_metrics)')
+    parser.add_argument('--format', choices=['csv', 'json', 'npy'],
+                        help='output format (default: csv)')
+    parser.add_argument('--output-dir',
+                        help='directory for the results (default: .)')
+    parser.add_argument('--workers', type=int,
+                        help='number of files processed in parallel '
+                             '(default: 1)')
+    parser.add_argument('--start', type=int,
+                        help='first timestep of the time window')
+    parser.add_argument('--end', type=int,
+                        help='timestep after the time window')
+    parser.add_argument('--monthly', action='store_const', const=True,
+                        help='write monthly values instead of '
+                             'cumulative timeseries')
+    parser.add_argument('--cache', action='store_const', const=True,
+                        help='reuse metrics cached in the output '
+                             'directory if newer than the output file')
+    args = parser.parse_args(argv)
+
+    options = {'metrics': None,
+               'format': 'csv',
+               'output_dir': '.',
+               'workers': 1,
+               'start': None,
+               'end': None,
+               'monthly': False,
+               'cache': False}
+    if args.config is not None:
+        with open(args.config, 'r') as source:
+            config = json.load(source)
+        unknown = set(config.keys()) - set(options.keys())
+        if len(unknown) > 0:
+            parser.error('unknown config keys: ' + ', '.join(sorted(unknown)))
+        options.update(config)
+    for key in options:
+        if getattr(args, key) is not None:
+            options[key] = getattr(args, key)
+    options['is_cum'] = not options.pop('monthly')
+    workers = options.pop('workers')
+
+    jobs = [(file_name, options, base) for file_name, base
+            in zip(args.files, output_names(args.files))]
+    if workers > 1 and len(jobs) > 1:
+        pool = Pool(min(workers, len(jobs)))
+        out_files = pool.map(analyze_file, jobs)
+        pool.close()
+        pool.join()
+    else:
+        out_files = [analyze_file(job) for job in jobs]
+    for file_name, out_file in zip(args.files, out_files):
+        print(file_name + ' -> ' + out_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,8 @@
-from fuzzywuzzy import fuzz
 import numpy as np
 import pandas as pd
 import sqlite3 as sql
 import sys
+from name_matching import cached_match_names, match_names
 
 if len(sys.argv) < 3:
     print('Usage: python merge_coordinates.py [pris_link] [webscrape_link]')
@@ -133,7 +133,7 @@ def sanitize_webscrape_name(name):
     return name
 
 
-def merge_coordinates(pris_link, scrape_link):
+def merge_coordinates(pris_link, scrape_link, workers=1, cache_link=None):
     """ Merges webscrape data with pris data performed by string
     comparison of reactor names from pris and webscrape. Returns
     updated pris database with coordinates.
@@ -144,6 +144,11 @@ def merge_coordinates(pris_link, scrape_link):
         path to reactors_pris_2016.original.csv file
     scrape_link: str
         path to webscrape.sqlite file
+    workers: int
+        number of processes used for the fuzzy matching
+    cache_link: str
+        path to a sqlite cache of match decisions, so that only
+        the pairs of names never compared are fuzzy matched
 
     Returns
     -------
@@ -152,22 +157,21 @@ def merge_coordinates(pris_link, scrape_link):
     """
     others = edge_cases()
     pris = import_pris(pris_link)
-    coords = import_webscrape_data(scrape_link)
-    for web in coords:
-        for idx, prs in pris.iterrows():
-            webscrape_name = sanitize_webscrape_name(web['name'])
-            pris_name = prs[1].lower()
-            if fuzz.ratio(webscrape_name, pris_name) > 64:
-                prs[13] = web['lat']
-                prs[14] = web['long']
-            else:
-                for other in others.keys():
-                    edge_case_key = other.lower()
-                    edge_case_value = others[other].lower()
-                    if (fuzz.ratio(pris_name, edge_case_key) > 80 and
-                            fuzz.ratio(webscrape_name, edge_case_value) > 75):
-                        prs[13] = web['lat']
-                        prs[14] = web['long']
+    coords = import_webscrape_data(scrape_link).fetchall()
+    pris_names = [x.lower() for x in pris.iloc[:, 1]]
+    webscrape_names = [sanitize_webscrape_name(x['name']) for x in coords]
+    if cache_link is None:
+        matches = match_names(pris_names, webscrape_names, others, 64,
+                              workers)
+    else:
+        # cached_match_names prints its hit rate
+        matches = cached_match_names(
+            pris_names, webscrape_names, others, 64, cache_link,
+            [(x['lat'], x['long']) for x in coords], workers)[0]
+    for i, match in enumerate(matches):
+        if match is not None:
+            pris.iat[i, 13] = coords[match]['lat']
+            pris.iat[i, 14] = coords[match]['long']
     return pris
 
 
@@ -0,0 +1,448 @@
+import hashlib
+import numpy as np
+import sqlite3 as sql
+from fuzzywuzzy import fuzz
+from multiprocessing import Pool
+
+
+def get_ngrams(name, n=3):
+    """ Returns the character n-grams of a name, padded with a
+    space on each side so that short names still have n-grams.
+
+    Parameters
+    ----------
+    name: str
+        sanitized name
+    n: int
+        length of the n-grams
+
+    Returns
+    -------
+    ngrams: set
+        set of n-grams of the name
+    """
+    padded = ' ' + name + ' '
+    return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+def get_candidates(left_names, right_names, threshold, full_scan_length=8):
+    """ Returns the pairs of names worth scoring against threshold.
+    This is an approximate recall filter: pairs are generated from
+    an n-gram blocking index over the right names, so two names
+    that share no padded trigram are never paired, even if their
+    fuzz.ratio exceeds threshold. Left names shorter than
+    full_scan_length, where this happens most, are paired with
+    every right name instead. The pairs whose lengths alone bound
+    fuzz.ratio to threshold or below are dropped.
+
+    Parameters
+    ----------
+    left_names: list
+        list of sanitized names
+    right_names: list
+        list of sanitized names
+    threshold: int
+        fuzz.ratio score a pair needs to exceed
+    full_scan_length: int
+        left names shorter than this are compared with
+        every right name
+
+    Returns
+    -------
+    left: np.array
+        indices into left_names
+    right: np.array
+        indices into right_names
+    """
+    index = {}
+    for i, name in enumerate(right_names):
+        for ngram in get_ngrams(name):
+            index.setdefault(ngram, []).append(i)
+    right_length = np.array([len(x) for x in right_names], dtype=int)
+    every_name = np.arange(len(right_names))
+    left, right = [], []
+    for i, name in enumerate(left_names):
+        if len(name) < full_scan_length:
+            candidates = every_name
+        else:
+            postings = [index[x] for x in get_ngrams(name) if x in index]
+            if len(postings) == 0:
+                continue
+            candidates = np.unique(np.concatenate(postings))
+        # fuzz.ratio <= 200 * min(length) / (sum of lengths)
+        lengths = right_length[candidates]
+        bound = (200.0 * np.minimum(lengths, len(name)) /
+                 np.maximum(lengths + len(name), 1))
+        candidates = candidates[bound > threshold]
+        left.append(np.full(len(candidates), i))
+        right.append(candidates)
+    if len(left) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    return np.concatenate(left), np.concatenate(right)
+
+
+def score_pairs(pairs):
+    """ Returns fuzz.ratio of every pair of names
+
+    Parameters
+    ----------
+    pairs: list
+        list of (name, name) tuples
+
+    Returns
+    -------
+    scores: list
+        fuzz.ratio of every pair
+    """
+    return [fuzz.ratio(a, b) for a, b in pairs]
+
+
+def get_scores(pairs, workers=1, batch_size=10000):
+    """ Scores pairs of names in batches, in a process
+    pool if workers is more than 1
+
+    Parameters
+    ----------
+    pairs: list
+        list of (name, name) tuples
+    workers: int
+        number of processes
+    batch_size: int
+        number of pairs scored per batch
+
+    Returns
+    -------
+    scores: np.array
+        fuzz.ratio of every pair
+    """
+    batches = [pairs[i:i + batch_size]
+               for i in range(0, len(pairs), batch_size)]
+    if workers > 1 and len(batches) > 1:
+        with Pool(min(workers, len(batches))) as pool:
+            scores = pool.map(score_pairs, batches)
+    else:
+        scores = [score_pairs(batch) for batch in batches]
+    return np.array([x for batch in scores for x in batch], dtype=int)
+
+
+def match_matrix(pris_names, webscrape_names, others, threshold, workers=1):
+    """ Returns which pairs of sanitized PRIS reactor names and
+    webscrape plant names match. A pair matches if its fuzz.ratio
+    exceeds threshold, or if the PRIS name matches an edge case key
+    (score above 80) and the plant name matches its value
+    (score above 75).
+
+    Parameters
+    ----------
+    pris_names: np.array
+        array of sanitized PRIS reactor names
+    webscrape_names: np.array
+        array of sanitized webscrape plant names
+    others: dict
+        dictionary of edge cases with "key=pris_reactor_name, and
+        value=webscrape_plant_name"
+    threshold: int
+        fuzz.ratio score a direct match needs to exceed
+    workers: int
+        number of processes used to score the pairs
+
+    Returns
+    -------
+    matched: np.array
+        boolean matrix of shape (len(pris_names), len(webscrape_names))
+    """
+    matched = np.zeros((len(pris_names), len(webscrape_names)), dtype=bool)
+    pris, web = get_candidates(pris_names, webscrape_names, threshold)
+    scores = get_scores(list(zip(pris_names[pris], webscrape_names[web])),
+                        workers)
+    matched[pris[scores > threshold], web[scores > threshold]] = True
+
+    keys = np.array([x.lower() for x in others.keys()], dtype=str)
+    values = np.array([x.lower() for x in others.values()], dtype=str)
+    pris_edge = np.zeros((len(pris_names), len(keys)), dtype=bool)
+    pris, key = get_candidates(pris_names, keys, 80)
+    pris_edge[pris, key] = get_scores(
+        list(zip(pris_names[pris], keys[key]))) > 80
+    web_edge = np.zeros((len(webscrape_names), len(values)), dtype=bool)
+    web, value = get_candidates(webscrape_names, values, 75)
+    web_edge[web, value] = get_scores(
+        list(zip(webscrape_names[web], values[value]))) > 75
+    matched |= np.dot(pris_edge.astype(int), web_edge.T.astype(int)) > 0
+    return matched
+
+
+def get_last_matches(matched, pris_inverse, web_inverse):
+    """ Returns the webscrape row matching every PRIS row,
+    the last one if several match
+
+    Parameters
+    ----------
+    matched: np.array
+        boolean matrix of matching unique PRIS and webscrape names
+    pris_inverse: np.array
+        unique PRIS name of every PRIS row
+    web_inverse: np.array
+        unique webscrape name of every webscrape row
+
+    Returns
+    -------
+    matches: list
+        index of the matching webscrape row for every PRIS row,
+        None if no name matches
+    """
+    web_last = np.full(matched.shape[1], -1)
+    np.maximum.at(web_last, web_inverse, np.arange(len(web_inverse)))
+    best = np.where(matched, web_last[np.newaxis, :], -1).max(
+        axis=1, initial=-1)
+    return [int(best[i]) if best[i] >= 0 else None for i in pris_inverse]
+
+
+def match_names(pris_names, webscrape_names, others, threshold, workers=1):
+    """ Matches sanitized PRIS reactor names to sanitized webscrape
+    plant names (see match_matrix). Every name is compared once,
+    however often it repeats.
+
+    Parameters
+    ----------
+    pris_names: list
+        list of sanitized PRIS reactor names
+    webscrape_names: list
+        list of sanitized webscrape plant names
+    others: dict
+        dictionary of edge cases with "key=pris_reactor_name, and
+        value=webscrape_plant_name"
+    threshold: int
+        fuzz.ratio score a direct match needs to exceed
+    workers: int
+        number of processes used to score the pairs
+
+    Returns
+    -------
+    matches: list
+        index of the matching webscrape name for every PRIS name
+        (the last one if several match), None if no name matches
+    """
+    pris_unique, pris_inverse = np.unique(np.array(pris_names, dtype=str),
+                                          return_inverse=True)
+    web_unique, web_inverse = np.unique(np.array(webscrape_names,
+                                                 dtype=str),
+                                        return_inverse=True)
+    matched = match_matrix(pris_unique, web_unique, others, threshold,
+                           workers)
+    return get_last_matches(matched, pris_inverse, web_inverse)
+
+
+def get_match_cache(cache_link):
+    """ Opens (or creates) the sqlite cache of match decisions.
+    The comparisons table holds every pair of sanitized names
+    already compared, with the threshold and edge cases it was
+    compared under, whether it matched and the coordinates of
+    the matched plant. The forced table holds the decisions of
+    force_match, which hold under any threshold.
+
+    Parameters
+    ----------
+    cache_link: str
+        path to the cache sqlite file
+
+    Returns
+    -------
+    con: sqlite connection
+        connection to the cache
+    """
+    con = sql.connect(cache_link)
+    con.execute('CREATE TABLE IF NOT EXISTS comparisons '
+                '(pris_name TEXT, webscrape_name TEXT, threshold INTEGER, '
+                'edge_cases TEXT, matched INTEGER, lat REAL, long REAL, '
+                'PRIMARY KEY (pris_name, webscrape_name, threshold, '
+                'edge_cases))')
+    con.execute('CREATE TABLE IF NOT EXISTS forced '
+                '(pris_name TEXT, webscrape_name TEXT, matched INTEGER, '
+                'PRIMARY KEY (pris_name, webscrape_name))')
+    return con
+
+
+def get_edge_case_hash(others):
+    """ Returns a hash of the edge cases, so that the comparisons
+    made with other edge cases are not reused.
+
+    Parameters
+    ----------
+    others: dict
+        dictionary of edge cases with "key=pris_reactor_name, and
+        value=webscrape_plant_name"
+
+    Returns
+    -------
+    hash: str
+        sha1 hex digest of the sorted edge cases
+    """
+    return hashlib.sha1(
+        repr(sorted(others.items())).encode('utf-8')).hexdigest()
+
+
+def force_match(cache_link, pris_name, webscrape_name, matched=True):
+    """ Records a match decision that overrides the fuzzy matching
+    of a pair of sanitized names in later runs.
+
+    Parameters
+    ----------
+    cache_link: str
+        path to the cache sqlite file
+    pris_name: str
+        sanitized PRIS reactor name
+    webscrape_name: str
+        sanitized webscrape plant name
+    matched: bool
+        True forces the pair to match, False forces it not to
+
+    Returns
+    -------
+    null
+        writes the decision to the cache
+    """
+    con = get_match_cache(cache_link)
+    con.execute('INSERT OR REPLACE INTO forced '
+                '(pris_name, webscrape_name, matched) VALUES (?, ?, ?)',
+                (pris_name, webscrape_name, int(matched)))
+    con.commit()
+    con.close()
+
+
+def invalidate_match(cache_link, pris_name=None, webscrape_name=None):
+    """ Drops the cached decisions of a sanitized PRIS reactor name
+    and/or webscrape plant name (forced ones included), so that they
+    are matched again in the next run. Drops the whole cache if
+    neither name is given.
+
+    Parameters
+    ----------
+    cache_link: str
+        path to the cache sqlite file
+    pris_name: str
+        sanitized PRIS reactor name
+    webscrape_name: str
+        sanitized webscrape plant name
+
+    Returns
+    -------
+    null
+        removes the decisions from the cache
+    """
+    con = get_match_cache(cache_link)
+    for table in ('comparisons', 'forced'):
+        if pris_name is None and webscrape_name is None:
+            con.execute('DELETE FROM ' + table)
+        for column, name in (('pris_name', pris_name),
+                             ('webscrape_name', webscrape_name)):
+            if name is not None:
+                con.execute('DELETE FROM ' + table + ' WHERE ' + column +
+                            ' = ?', (name,))
+    con.commit()
+    con.close()
+
+
+def cached_match_names(pris_names, webscrape_names, others, threshold,
+                       cache_link, coordinates=None, workers=1):
+    """ Matches sanitized PRIS reactor names to sanitized webscrape
+    plant names like match_names, but only fuzzy matches the pairs
+    that were never compared under the same threshold and edge
+    cases. Decisions of every run are added to the cache and
+    forced decisions (see force_match) override the fuzzy ones.
+
+    Parameters
+    ----------
+    pris_names: list
+        list of sanitized PRIS reactor names
+    webscrape_names: list
+        list of sanitized webscrape plant names
+    others: dict
+        dictionary of edge cases with "key=pris_reactor_name, and
+        value=webscrape_plant_name"
+    threshold: int
+        fuzz.ratio score a direct match needs to exceed
+    cache_link: str
+        path to the cache sqlite file
+    coordinates: list
+        list of (lat, long) of every webscrape name, stored
+        with the matched pairs
+    workers: int
+        number of processes used to score the pairs
+
+    Returns
+    -------
+    matches: list
+        index of the matching webscrape name for every PRIS name
+        (the last one if several match), None if no name matches
+    stats: dict
+        number of cached and new pairs of names, and the hit rate
+        (share of the pairs answered by the cache)
+    """
+    pris_unique, pris_inverse = np.unique(np.array(pris_names, dtype=str),
+                                          return_inverse=True)
+    web_unique, web_inverse = np.unique(np.array(webscrape_names,
+                                                 dtype=str),
+                                        return_inverse=True)
+    pris_index = {name: i for i, name in enumerate(pris_unique)}
+    web_index = {name: i for i, name in enumerate(web_unique)}
+    edge_cases = get_edge_case_hash(others)
+    con = get_match_cache(cache_link)
+
+    shape = (len(pris_unique), len(web_unique))
+    compared = np.zeros(shape, dtype=bool)
+    matched = np.zeros(shape, dtype=bool)
+    for pris_name, web_name, is_match in con.execute(
+            'SELECT pris_name, webscrape_name, matched FROM comparisons '
+            'WHERE threshold = ? AND edge_cases = ?',
+            (int(threshold), edge_cases)):
+        if pris_name in pris_index and web_name in web_index:
+            compared[pris_index[pris_name], web_index[web_name]] = True
+            matched[pris_index[pris_name], web_index[web_name]] = is_match
+    cached = compared.copy()
+    # PRIS names never compared are matched against every plant name,
+    # the rest only against the plant names they miss
+    new_pris = np.flatnonzero(~compared.any(axis=1))
+    if len(new_pris) > 0:
+        matched[new_pris] = match_matrix(pris_unique[new_pris], web_unique,
+                                         others, threshold, workers)
+        compared[new_pris] = True
+    pris_missing = np.flatnonzero(~compared.all(axis=1))
+    web_missing = np.flatnonzero(~compared[pris_missing].all(axis=0))
+    if len(pris_missing) > 0:
+        block = np.ix_(pris_missing, web_missing)
+        missing = ~compared[block]
+        matched[block] = np.where(
+            missing, match_matrix(pris_unique[pris_missing],
+                                  web_unique[web_missing], others,
+                                  threshold, workers),
+            matched[block])
+
+    # new pairs are stored, and matched ones get their coordinates
+    stored = ~cached
+    if coordinates is not None:
+        stored |= matched
+    last_row = dict(zip(web_inverse, range(len(web_inverse))))
+    rows = []
+    for pris, web in zip(*np.nonzero(stored)):
+        lat, long = None, None
+        if coordinates is not None and matched[pris, web]:
+            lat, long = coordinates[last_row[web]]
+        rows.append((pris_unique[pris], web_unique[web], int(threshold),
+                     edge_cases, int(matched[pris, web]), lat, long))
+    con.executemany('INSERT OR REPLACE INTO comparisons '
+                    '(pris_name, webscrape_name, threshold, edge_cases, '
+                    'matched, lat, long) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    forced = con.execute('SELECT pris_name, webscrape_name, matched '
+                         'FROM forced').fetchall()
+    con.commit()
+    con.close()
+    for pris_name, web_name, is_match in forced:
+        if pris_name in pris_index and web_name in web_index:
+            matched[pris_index[pris_name], web_index[web_name]] = is_match
+
+    stats = {'cached_pairs': int(cached.sum()),
+             'new_pairs': int((~cached).sum()),
+             'hit_rate': float(np.mean(cached)) if cached.size else 1.0}
+    print('Match cache: %d of %d pairs of names cached, hit rate %.1f%%'
+          % (stats['cached_pairs'], cached.size, 100 * stats['hit_rate']))
+    return get_last_matches(matched, pris_inverse, web_inverse), stats
@@ -1,12 +1,20 @@
+import collections
 import csv
 import dateutil.parser as date
+import hashlib
 import jinja2
+import json
 import numpy as np
 import os
 import pathlib
 import pandas as pd
+import re
 import sqlite3 as sql
-from fuzzywuzzy import fuzz
+import urllib.parse
+import xml.etree.ElementTree as ET
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from name_matching import cached_match_names, match_names
 from pyne import nucname as nn
 
 
@@ -172,7 +180,7 @@ def is_int(str):
     return answer
 
 
-def merge_coordinates(pris_link, scrape_link):
+def merge_coordinates(pris_link, scrape_link, workers=1, cache_link=None):
     """ Obtains coordinates from webscrape.sqlite and
     writes them to matching reactors in PRIS reactor file.
 
@@ -182,6 +190,12 @@ def merge_coordinates(pris_link, scrape_link):
         path and name of pris reactor text file
     scrape: str
         path and name of webscrape sqlite file
+    workers: int
+        number of processes used for the fuzzy matching
+    cache_link: str
+        path to a sqlite cache of match decisions, so that only
+        the pairs of names never compared are fuzzy matched
+        (see cached_match_names)
 
     Returns
     -------
@@ -190,22 +204,21 @@ def merge_coordinates(pris_link, scrape_link):
     """
     others = get_edge_cases()
     pris = import_pris(pris_link)
-    coords = import_webscrape_data(scrape_link)
-    for web in coords:
-        for i, prs in pris.iterrows():
-            webscrape_name = sanitize_webscrape_name(web['name'])
-            pris_name = sanitize_pris_name(prs[1])
-            if fuzz.ratio(webscrape_name, pris_name) > 78:
-                prs[13] = web['lat']
-                prs[14] = web['long']
-            else:
-                for other in others.keys():
-                    edge_case_key = other.lower()
-                    edge_case_value = others[other].lower()
-                    if fuzz.ratio(pris_name, edge_case_key) > 80:
-                        if fuzz.ratio(webscrape_name, edge_case_value) > 75:
-                            prs[13] = web['lat']
-                            prs[14] = web['long']
+    coords = import_webscrape_data(scrape_link).fetchall()
+    pris_names = [sanitize_pris_name(x) for x in pris.iloc[:, 1]]
+    webscrape_names = [sanitize_webscrape_name(x['name']) for x in coords]
+    if cache_link is None:
+        matches = match_names(pris_names, webscrape_names, others, 78,
+                              workers)
+    else:
+        # cached_match_names prints its hit rate
+        matches = cached_match_names(
+            pris_names, webscrape_names, others, 78, cache_link,
+            [(x['lat'], x['long']) for x in coords], workers)[0]
+    for i, match in enumerate(matches):
+        if match is not None:
+            pris.iat[i, 13] = coords[match]['lat']
+            pris.iat[i, 14] = coords[match]['long']
     pris.to_csv('reactors_pris_2016.csv', index=False, sep=',')
 
 
@@ -233,8 +246,13 @@ def import_csv(in_csv, delimit):
     return data_list
 
 
+template_environment = jinja2.Environment()
+template_cache = {}
+
+
 def load_template(in_template):
-    """ Returns a jinja2 template from file.
+    """ Returns a jinja2 template from file. Compiled templates
+    are cached until the file changes.
 
     Parameters
     ---------
@@ -245,9 +263,324 @@ def load_template(in_template):
     -------
     output_template: jinja template object
     """
-    with open(in_template, 'r') as default:
-        output_template = jinja2.Template(default.read())
-    return output_template
+    path = os.path.abspath(in_template)
+    key = (path, os.path.getmtime(path))
+    if key not in template_cache:
+        with open(path, 'r') as default:
+            source = default.read()
+        template_cache[key] = template_environment.from_string(source)
+        template_cache[key].source_hash = get_hash(source)
+    return template_cache[key]
+
+
+def get_hash(text):
+    """ Returns the sha1 hex digest of a string.
+
+    Parameters
+    ----------
+    text: str
+        string to hash
+
+    Returns
+    -------
+    digest: str
+        hex digest of text
+    """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def canonical_value(value):
+    """ Converts numpy values to python values for json, so
+    the hash of rendering parameters does not depend on
+    their numpy type.
+
+    Parameters
+    ----------
+    value: numpy scalar or array
+        value json cannot serialize
+
+    Returns
+    -------
+    value: int, float, str or list
+        the same value as python types
+    """
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError('%r is not serializable' % (value,))
+
+
+def render_output(template, path, **kwargs):
+    """ Renders a template into the text of an output file, with a
+    hash of everything the text depends on: the template source and
+    the rendering parameters.
+
+    Parameters
+    ----------
+    template: jinja template object
+        template from load_template
+    path: str
+        path of the output file
+    kwargs:
+        parameters of the template
+
+    Returns
+    -------
+    output: tuple
+        path of the file, its text and the hash of its inputs
+    """
+    inputs = get_hash(getattr(template, 'source_hash', '') +
+                      json.dumps(sorted(kwargs.items()),
+                                 default=canonical_value))
+    return path, template.render(**kwargs), inputs
+
+
+def load_manifest(manifest):
+    """ Loads the manifest of generated files.
+
+    Parameters
+    ----------
+    manifest: str
+        path to the manifest json file
+
+    Returns
+    -------
+    records: dict
+        dictionary with key=[file path relative to the manifest],
+        and value=[dictionary of the input hash, output hash,
+        size and modification time of the file]
+    """
+    if not os.path.exists(manifest):
+        return {}
+    with open(manifest, 'r') as source:
+        return json.load(source)
+
+
+def save_manifest(manifest, records):
+    """ Saves the manifest of generated files.
+
+    Parameters
+    ----------
+    manifest: str
+        path to the manifest json file
+    records: dict
+        records from load_manifest
+
+    Returns
+    -------
+    null
+    """
+    pathlib.Path(os.path.dirname(os.path.abspath(manifest))).mkdir(
+        parents=True, exist_ok=True)
+    with open(manifest, 'w') as output:
+        json.dump(records, output, indent=1, sort_keys=True)
+
+
+def file_record(path, inputs, output):
+    """ Returns the manifest record of a file on disk.
+
+    Parameters
+    ----------
+    path: str
+        path of the file
+    inputs: str
+        hash of the inputs of the file
+    output: str
+        hash of the text of the file
+
+    Returns
+    -------
+    record: dict
+        manifest record of the file
+    """
+    stat = os.stat(path)
+    return {'inputs': inputs, 'output': output, 'size': stat.st_size,
+            'mtime': stat.st_mtime_ns}
+
+
+def disk_hash(path, record):
+    """ Returns the hash of a file on disk, taken from its manifest
+    record if the file was not touched since it was recorded.
+
+    Parameters
+    ----------
+    path: str
+        path of the file
+    record: dict
+        manifest record of the file, or None
+
+    Returns
+    -------
+    digest: str
+        hash of the file, None if it does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    if (record is not None and record['size'] == stat.st_size and
+            record['mtime'] == stat.st_mtime_ns):
+        return record['output']
+    with open(path, 'r', encoding='utf-8') as source:
+        return get_hash(source.read())
+
+
+def write_file(output):
+    """ Writes text to a file in a single buffered write.
+
+    Parameters
+    ----------
+    output: tuple
+        path of the file and its text
+
+    Returns
+    -------
+    null
+    """
+    path, text = output[:2]
+    with open(path, 'w', buffering=2**16, encoding='utf-8') as out_file:
+        out_file.write(text)
+
+
+def write_files(outputs, workers=1, manifest=None, dry_run=False):
+    """ Writes rendered files, in parallel through a pool
+    of threads if workers > 1. With a manifest, only the files
+    whose inputs changed, or that differ from their text on disk,
+    are rewritten.
+
+    Parameters
+    ----------
+    outputs: list
+        list of (path, text) tuples, or (path, text, inputs)
+        tuples from render_output
+    workers: int
+        number of writing threads
+    manifest: str
+        path to the manifest json file, every file is
+        written if None
+    dry_run: bool
+        if True, reports the files that would be written
+        without writing them or the manifest
+
+    Returns
+    -------
+    changed: list
+        list of (path, reason) of the files written
+    """
+    if manifest is None and not dry_run:
+        changed = [(output[0], 'written') for output in outputs]
+        outputs = list(outputs)
+    else:
+        records = load_manifest(manifest) if manifest is not None else {}
+        if manifest is not None:
+            base = os.path.dirname(os.path.abspath(manifest))
+        else:
+            base = os.path.commonpath(
+                [os.path.dirname(os.path.abspath(output[0]))
+                 for output in outputs] or [os.getcwd()])
+        changed = []
+        pending = []
+        for output in outputs:
+            path, text = output[:2]
+            inputs = output[2] if len(output) > 2 else get_hash(text)
+            key = os.path.relpath(os.path.abspath(path), base)
+            record = records.get(key)
+            on_disk = disk_hash(path, record)
+            if (record is not None and record['inputs'] == inputs and
+                    record['output'] == on_disk):
+                continue
+            output_hash = get_hash(text)
+            if on_disk == output_hash:
+                # same text, only the record is out of date
+                if not dry_run:
+                    records[key] = file_record(path, inputs, output_hash)
+                continue
+            if on_disk is None:
+                reason = 'new'
+            elif record is None or record['output'] != on_disk:
+                reason = 'modified on disk'
+            else:
+                reason = 'inputs changed'
+            changed.append((path, reason))
+            pending.append((key, path, text, inputs, output_hash))
+        if dry_run:
+            print('%d of %d files would be written:'
+                  % (len(changed), len(outputs)))
+            for path, reason in changed:
+                print('%s (%s)' % (path, reason))
+            return changed
+        outputs = [(path, text) for _, path, text, _, _ in pending]
+    if workers > 1 and len(outputs) > 1:
+        with ThreadPool(workers) as pool:
+            pool.map(write_file, outputs)
+    else:
+        for output in outputs:
+            write_file(output)
+    if manifest is not None:
+        for key, path, _, inputs, output_hash in pending:
+            records[key] = file_record(path, inputs, output_hash)
+        save_manifest(manifest, records)
+    return changed
+
+
+burnup_columns = {33: (1, 2), 51: (3, 4), 100: (5, 6)}
+
+
+def get_composition_table(in_list):
+    """ Returns the nuclide ids and compositions of the
+    vision_recipes data, converting every nuclide once.
+
+    Parameters
+    ---------
+    in_list: list
+        list containing vision_recipes data
+
+    Returns
+    -------
+    nuclides: list
+        list of nuclide ids
+    compositions: np.array
+        array of compositions, with one row per nuclide
+        and one column per vision_recipes column
+    """
+    rows = in_list[2:]
+    nuclides = [nn.id(row[0]) for row in rows]
+    compositions = np.array([row[1:7] for row in rows], dtype=float)
+    return nuclides, compositions.reshape(len(rows), 6)
+
+
+def get_recipe_burnup(burnup):
+    """ Returns the vision_recipes burnup used for a burnup:
+    33 and 51 have their own columns, any other burnup
+    reads the 100 columns.
+
+    Parameters
+    ---------
+    burnup: int
+        burnup
+
+    Returns
+    -------
+    burnup: int
+        33, 51 or 100
+    """
+    return burnup if burnup in burnup_columns.keys() else 100
+
+
+def get_column(burnup, spent):
+    """ Returns the vision_recipes column of a burnup.
+
+    Parameters
+    ---------
+    burnup: int
+        burnup, see get_recipe_burnup
+    spent: bool
+        True for spent fuel, False for fresh UOX
+
+    Returns
+    -------
+    column: int
+        column of the composition in vision_recipes
+    """
+    return burnup_columns[get_recipe_burnup(burnup)][int(spent)]
 
 
 def get_composition_fresh(in_list, burnup):
@@ -267,19 +600,9 @@ def get_composition_fresh(in_list, burnup):
         dictionary with key=[isotope],
         and value=[composition]
     """
-    data_dict = {}
-    for i in range(len(in_list)):
-        if i > 1:
-            if burnup == 33:
-                data_dict.update({nn.id(in_list[i][0]):
-                                  float(in_list[i][1])})
-            elif burnup == 51:
-                data_dict.update({nn.id(in_list[i][0]):
-                                  float(in_list[i][3])})
-            else:
-                data_dict.update({nn.id(in_list[i][0]):
-                                  float(in_list[i][5])})
-    return data_dict
+    nuclides, compositions = get_composition_table(in_list)
+    column = get_column(burnup, False) - 1
+    return dict(zip(nuclides, compositions[:, column].tolist()))
 
 
 def get_composition_spent(in_list, burnup):
@@ -299,23 +622,72 @@ def get_composition_spent(in_list, burnup):
         dictionary with key=[isotope],
         and value=[composition]
     """
-    data_dict = {}
-    for i in range(len(in_list)):
-        if i > 1:
-            if burnup == 33:
-                data_dict.update({nn.id(in_list[i][0]):
-                                  float(in_list[i][2])})
-            elif burnup == 51:
-                data_dict.update({nn.id(in_list[i][0]):
-                                  float(in_list[i][4])})
-            else:
-                data_dict.update({nn.id(in_list[i][0]):
-                                  float(in_list[i][6])})
-    return data_dict
+    nuclides, compositions = get_composition_table(in_list)
+    column = get_column(burnup, True) - 1
+    return dict(zip(nuclides, compositions[:, column].tolist()))
 
 
-def write_recipes(fresh_dict, spent_dict, in_template, burnup, region):
-    """ Renders jinja template using fresh and spent fuel composition.
+recipe_library_cache = {}
+
+
+def load_recipe_library(in_csv):
+    """ Returns the fresh and spent fuel compositions of every
+    burnup in vision_recipes. The csv is parsed once and the
+    library is cached until the file changes.
+
+    Parameters
+    ---------
+    in_csv: str
+        path and name of recipe file
+
+    Returns
+    -------
+    library: dict
+        dictionary with key=[(burnup, 'fresh' or 'spent')],
+        and value=[dictionary with key=[isotope], and
+        value=[composition]]
+    """
+    path = os.path.abspath(in_csv)
+    key = (path, os.path.getmtime(path))
+    if key not in recipe_library_cache:
+        nuclides, compositions = get_composition_table(
+            import_csv(path, ','))
+        library = {}
+        for burnup, columns in sorted(burnup_columns.items()):
+            for fuel, column in zip(('fresh', 'spent'), columns):
+                library[(burnup, fuel)] = dict(
+                    zip(nuclides, compositions[:, column - 1].tolist()))
+        recipe_library_cache[key] = library
+    return recipe_library_cache[key]
+
+
+def get_recipe(in_csv, burnup, fuel='fresh'):
+    """ Returns a composition from the recipe library.
+
+    Parameters
+    ---------
+    in_csv: str
+        path and name of recipe file
+    burnup: int
+        burnup, see get_recipe_burnup
+    fuel: str
+        'fresh' or 'spent'
+
+    Returns
+    -------
+    data_dict: dict
+        dictionary with key=[isotope],
+        and value=[composition]
+    """
+    library = load_recipe_library(in_csv)
+    key = (get_recipe_burnup(burnup), fuel)
+    if key not in library.keys():
+        raise ValueError(fuel + ' is not a valid fuel')
+    return library[key]
+
+
+def get_recipe_output(fresh_dict, spent_dict, in_template, burnup, region):
+    """ Renders the recipe file of a burnup and region.
 
     Parameters
     ---------
@@ -329,21 +701,57 @@ def write_recipes(fresh_dict, spent_dict, in_template, burnup, region):
         jinja template object to be rendered
     burnup: int
         amount of burnup
+    region: str
+        region name
 
     Returns
     -------
-    null
-        generates recipe files for cyclus.
+    output: tuple
+        output of render_output
     """
     out_path = 'cyclus/input/' + region + '/recipes/'
     pathlib.Path(out_path).mkdir(parents=True, exist_ok=True)
-    rendered = in_template.render(fresh=fresh_dict,
-                                  spent=spent_dict)
-    with open(out_path + '/uox_' + str(burnup) + '.xml', 'w') as output:
-        output.write(rendered)
+    return render_output(in_template,
+                         out_path + '/uox_' + str(burnup) + '.xml',
+                         fresh=fresh_dict, spent=spent_dict)
+
+
+def write_recipes(fresh_dict, spent_dict, in_template, burnup, region,
+                  manifest=None, dry_run=False):
+    """ Renders jinja template using fresh and spent fuel composition.
+
+    Parameters
+    ---------
+    fresh_dict: dict
+        dictionary with key=[isotope], and
+        value=[composition] for fresh UOX
+    spent_dict: dict
+        dictionary with key=[isotope], and
+        value=[composition] for spent fuel
+    in_template: jinja template object
+        jinja template object to be rendered
+    burnup: int
+        amount of burnup
+    region: str
+        region name
+    manifest: str
+        path to the manifest json file, every file is
+        written if None
+    dry_run: bool
+        if True, only reports the files that would be written
+
+    Returns
+    -------
+    changed: list
+        list of (path, reason) of the files written
+    """
+    output = get_recipe_output(fresh_dict, spent_dict, in_template, burnup,
+                               region)
+    return write_files([output], manifest=manifest, dry_run=dry_run)
 
 
-def produce_recipes(in_csv, recipe_template, burnup):
+def produce_recipes(in_csv, recipe_template, burnup, region, manifest=None,
+                    dry_run=False):
     """ Generates commodity composition xml input for cyclus.
 
     Parameters
@@ -354,16 +762,67 @@ def produce_recipes(in_csv, recipe_template, burnup):
         path and name of recipe template
     burnup: int
         amount of burnup
+    region: str
+        region name
+    manifest: str
+        path to the manifest json file, every file is
+        written if None
+    dry_run: bool
+        if True, only reports the files that would be written
 
     Returns
     -------
-    null
-        Generates commodity composition xml input for cyclus.
+    changed: list
+        list of (path, reason) of the files written
     """
-    recipe = import_csv(in_csv, ',')
-    write_recipes(get_composition_fresh(recipe, burnup),
-                  get_composition_spent(recipe, burnup),
-                  load_template(recipe_template), burnup)
+    return write_recipes(get_recipe(in_csv, burnup, 'fresh'),
+                         get_recipe(in_csv, burnup, 'spent'),
+                         load_template(recipe_template), burnup, region,
+                         manifest=manifest, dry_run=dry_run)
+
+
+def produce_recipe_library(in_csv, recipe_template, regions=None,
+                           burnups=None, workers=1, manifest=None,
+                           dry_run=False):
+    """ Generates the commodity composition xml inputs of every
+    burnup and region together.
+
+    Parameters
+    ---------
+    in_csv: str
+        path and name of recipe file
+    recipe_template: str
+        path and name of recipe template
+    regions: list
+        names of the regions, every region if None
+    burnups: list
+        burnups, every burnup in vision_recipes if None
+    workers: int
+        number of threads writing the files
+    manifest: str
+        path to the manifest json file, every file is
+        written if None
+    dry_run: bool
+        if True, only reports the files that would be written
+
+    Returns
+    -------
+    changed: list
+        list of (path, reason) of the files written
+    """
+    if regions is None:
+        regions = sorted(get_regions().keys())
+    if burnups is None:
+        burnups = sorted(burnup_columns.keys())
+    template = load_template(recipe_template)
+    outputs = []
+    for region in regions:
+        for burnup in burnups:
+            outputs.append(get_recipe_output(
+                get_recipe(in_csv, burnup, 'fresh'),
+                get_recipe(in_csv, burnup, 'spent'),
+                template, burnup, region))
+    return write_files(outputs, workers, manifest, dry_run)
 
 
 def confirm_deployment(date_str, capacity):
@@ -386,29 +845,21 @@ def confirm_deployment(date_str, capacity):
     """
     is_deployed = False
     if len(date_str) > 4 and float(capacity) > 400:
-        try:
-            date.parse(date_str)
-            is_deployed = True
-        except:
-            pass
+        is_deployed = parse_date(date_str) is not None
     return is_deployed
 
 
-def select_region(in_list, region):
-    """ Returns a list of reactors that will be deployed for
-    CYCLUS by checking the capacity and commercial date
+def get_regions():
+    """ Returns the countries of every region
 
     Parameters
     ----------
-    in_list: list
-            imported csv file in list format
-    region: str
-            name of the region
 
     Returns
     -------
-    reactor_list: list
-            list of reactors from PRIS
+    regions: dict
+            dictionary with key=[region name], and
+            value=[set of country names]
     """
     ASIA = {'IRAN', 'JAPAN', 'KAZAKHSTAN',
             'BANGLADESH', 'CHINA', 'INDIA',
@@ -436,6 +887,26 @@ def select_region(in_list, region):
                'NORTH_AMERICA': NORTH_AMERICA,
                'UNITED_STATES': UNITED_STATES,
                'ALL': ALL}
+    return regions
+
+
+def select_region(in_list, region):
+    """ Returns a list of reactors that will be deployed for
+    CYCLUS by checking the capacity and commercial date
+
+    Parameters
+    ----------
+    in_list: list
+            imported csv file in list format
+    region: str
+            name of the region
+
+    Returns
+    -------
+    reactor_list: list
+            list of reactors from PRIS
+    """
+    regions = get_regions()
     if region.upper() not in regions.keys():
         raise ValueError(region + 'is not a valid region')
     reactor_list = []
@@ -475,79 +946,317 @@ def get_lifetime(in_row):
         return int(delta / n_days_month)
 
 
-def write_reactors(in_list, out_path, reactor_template):
+def load_pris(in_csv):
+    """ Parses the PRIS reactor csv once into typed columns,
+    with the derived columns the input generation needs.
+
+    Parameters
+    ----------
+    in_csv: str
+        path to pris reactor database
+
+    Returns
+    -------
+    pris: dict
+        dictionary of columns, one entry per csv row:
+        rows (the csv rows as lists of strings),
+        country, name, file_name (name used for reactor files), type,
+        capacity [MWe], commercial_date and shutdown_date (datetimes,
+        None if missing), lifetime [months], build_month (months since
+        year 0 of the commercial date) and deployable
+        (see confirm_deployment)
+    """
+    rows = import_csv(in_csv, ',')
+    pris = {'header': None}
+    if len(rows) > 0 and not is_float(rows[0][3]):
+        pris['header'] = rows[0]
+        rows = rows[1:]
+    pris['rows'] = rows
+    columns = {'country': 0, 'name': 1, 'type': 2}
+    for key, column in columns.items():
+        pris[key] = np.array([row[column] for row in rows], dtype=str)
+    pris['country'] = np.char.upper(pris['country'])
+    pris['file_name'] = np.char.replace(pris['name'], ' ', '_')
+    pris['reactor_file'] = np.char.add(pris['file_name'], '.xml')
+    pris['capacity'] = np.array([float(row[3]) if is_float(row[3])
+                                 else np.nan for row in rows])
+    pris['date_errors'] = []
+    for key, column in (('commercial_date', 10), ('shutdown_date', 11)):
+        strings = [row[column].strip() for row in rows]
+        if key == 'commercial_date':
+            # four characters or less is a year at most, not a date
+            strings = [x if len(x) > 4 else '' for x in strings]
+        pris[key], failed = parse_dates(strings)
+        pris['date_errors'] += [(i, pris['header'][column]
+                                 if pris['header'] else column,
+                                 rows[i][column]) for i in failed]
+    if len(pris['date_errors']) > 0:
+        print('Could not parse %d PRIS dates (row, column, value):'
+              % len(pris['date_errors']))
+        for error in pris['date_errors']:
+            print(error)
+    commercial = pd.DatetimeIndex(pris['commercial_date'])
+    has_commercial = ~np.isnat(pris['commercial_date'])
+    has_shutdown = ~np.isnat(pris['shutdown_date'])
+    pris['deployable'] = has_commercial & (pris['capacity'] > 400)
+    n_days_month = 365.0 / 12
+    with np.errstate(invalid='ignore'):
+        days = ((pris['shutdown_date'] - pris['commercial_date']) //
+                np.timedelta64(1, 'D'))
+    pris['lifetime'] = np.where(has_commercial & has_shutdown,
+                                np.trunc(days / n_days_month),
+                                720).astype(int)
+    pris['build_month'] = np.where(
+        has_commercial,
+        commercial.year * 12 + commercial.month +
+        np.round(commercial.day / n_days_month), 0).astype(int)
+    return pris
+
+
+date_cache = {}
+
+
+def parse_dates(date_strings, formats=('%Y-%m-%d', '%Y-%m-%d %H:%M:%S',
+                                       '%b %d, %Y', '%B %d, %Y')):
+    """ Parses an array of date strings. The explicit formats are
+    tried first, vectorized; the remaining strings are parsed
+    with dateutil, once per distinct string.
+
+    Parameters
+    ----------
+    date_strings: list
+        list of date strings, empty strings are missing dates
+    formats: tuple
+        formats tried in order
+
+    Returns
+    -------
+    dates: np.array
+        datetime64 array, NaT for missing and unparsed dates
+    failed: np.array
+        indices of the nonempty strings that could not be parsed
+    """
+    strings = pd.Series(date_strings, dtype=object).fillna('')
+    dates = pd.Series(pd.NaT, index=strings.index, dtype='datetime64[ns]')
+    missing = np.array(strings != '')
+    for date_format in formats:
+        if not missing.any():
+            break
+        dates[missing] = pd.to_datetime(strings[missing],
+                                        format=date_format,
+                                        errors='coerce')
+        missing &= np.array(dates.isna())
+    for date_str in strings[missing].unique():
+        if date_str not in date_cache:
+            parsed = parse_date(date_str)
+            date_cache[date_str] = (np.datetime64(parsed.replace(tzinfo=None))
+                                    if parsed is not None else None)
+    if missing.any():
+        dates[missing] = [pd.NaT if date_cache[x] is None else date_cache[x]
+                          for x in strings[missing]]
+    failed = np.flatnonzero(missing & dates.isna().values)
+    return dates.values, failed
+
+
+def select_pris(pris, region):
+    """ Returns the reactors of the PRIS dataset that will be
+    deployed for CYCLUS in a region
+
+    Parameters
+    ----------
+    pris: dict
+        PRIS dataset from load_pris
+    region: str
+        name of the region
+
+    Returns
+    -------
+    indices: np.array
+        indices of the deployed reactors, in file order
+    """
+    regions = get_regions()
+    if region.upper() not in regions.keys():
+        raise ValueError(region + 'is not a valid region')
+    in_region = np.isin(pris['country'], list(regions[region.upper()]))
+    return np.flatnonzero(in_region & pris['deployable'])
+
+
+def partition_regions(pris, regions=None):
+    """ Returns the reactors of the PRIS dataset that will be
+    deployed for CYCLUS in each of many regions, in one pass
+
+    Parameters
+    ----------
+    pris: dict
+        PRIS dataset from load_pris
+    regions: list
+        names of the regions, every region if None
+
+    Returns
+    -------
+    partition: OrderedDict
+        dictionary with key=[region name], and value=[indices
+        of the deployed reactors, in file order]
+    """
+    all_regions = get_regions()
+    if regions is None:
+        regions = sorted(all_regions.keys())
+    country_regions = collections.defaultdict(list)
+    for region in regions:
+        if region.upper() not in all_regions.keys():
+            raise ValueError(region + 'is not a valid region')
+        for country in all_regions[region.upper()]:
+            country_regions[country].append(region)
+    partition = collections.OrderedDict((region, []) for region in regions)
+    for i in np.flatnonzero(pris['deployable']):
+        for region in country_regions.get(pris['country'][i], []):
+            partition[region].append(i)
+    return collections.OrderedDict(
+        (region, np.array(indices, dtype=int))
+        for region, indices in partition.items())
+
+
+def parse_date(date_str):
+    """ Parses a date string, returns None if it is not a date
+
+    Parameters
+    ----------
+    date_str: str
+        date string from PRIS data file
+
+    Returns
+    -------
+    datetime or None
+    """
+    try:
+        return date.parse(date_str)
+    except (ValueError, OverflowError):
+        return None
+
+
+def is_float(str):
+    """ Checks if input string is a number
+
+    Parameters
+    ----------
+    str: str
+        string to test
+
+    Returns
+    -------
+    answer: bool
+        returns True if string is a number; False if string is not
+    """
+    try:
+        float(str)
+    except ValueError:
+        return False
+    return True
+
+
+def rendered_reactors(pris, indices):
+    """ Selects the reactors write_reactors renders a file for,
+    the ones of at least 400 MWe.
+
+    Parameters
+    ----------
+    pris: dict
+        PRIS dataset from load_pris
+    indices: list
+        indices of the reactors
+
+    Returns
+    -------
+    rendered: list
+        indices of the reactors with a reactor file
+    """
+    return [i for i in indices if pris['capacity'][i] >= 400]
+
+
+def write_reactors(pris, indices, out_path, reactor_template, workers=1,
+                   manifest=None, dry_run=False):
     """ Renders CYCAMORE::reactor specifications using jinja2.
 
     Parameters
     ----------
-    in_list: list
-        list containing PRIS data
+    pris: dict
+        PRIS dataset from load_pris
+    indices: list
+        indices of the reactors to write
     out_path: str
         output path for reactor files
     reactor_template: str
         path to reactor template
+    workers: int
+        number of threads writing the files
+    manifest: str
+        path to the manifest json file, every file is
+        written if None
+    dry_run: bool
+        if True, only reports the files that would be written
 
     Returns
     -------
-    null
-        writes xml files with CYCAMORE::reactor config
+    changed: list
+        list of (path, reason) of the files written
     """
     if out_path[-1] != '/':
         out_path += '/'
     pathlib.Path(out_path).mkdir(parents=True, exist_ok=True)
     reactor_template = load_template(reactor_template)
-    for row in in_list:
-        capacity = float(row[3])
-        if capacity >= 400:
-            name = row[1].replace(' ', '_')
-            assem_per_batch = 0
-            assem_no = 0
-            assem_size = 0
-            reactor_type = row[2]
-            latitude = row[13] if row[13] != '' else 0
-            longitude = row[14] if row[14] != '' else 0
-            if reactor_type in ['BWR', 'ESBWR']:
-                assem_no = 732
-                assem_per_batch = int(assem_no / 3)
-                assem_size = 138000 / assem_no
-            elif reactor_type in ['GCR', 'HWGCR']:  # Need batch number
-                assem_no = 324
-                assem_per_batch = int(assem_no / 3)
-                assem_size = 114000 / assem_no
-            elif reactor_type == 'HTGR':  # Need batch number
-                assem_no = 3944
-                assem_per_batch = int(assem_no / 3)
-                assem_size = 39000 / assem_no
-            elif reactor_type == 'PHWR':
-                assem_no = 390
-                assem_per_batch = int(assem_no / 45)
-                assem_size = 80000 / assem_no
-            elif reactor_type == 'VVER':  # Need batch number
-                assem_no = 312
-                assem_per_batch = int(assem_no / 3)
-                assem_size = 41500 / assem_no
-            elif reactor_type == 'VVER-1200':  # Need batch number
-                assem_no = 163
-                assem_per_batch = int(assem_no / 3)
-                assem_size = 80000 / assem_no
-            else:
-                assem_no = 241
-                assem_per_batch = int(assem_no / 3)
-                assem_size = 103000 / assem_no
-            config = reactor_template.render(name=name,
-                                             lifetime=get_lifetime(row),
-                                             assem_size=assem_size,
-                                             n_assem_core=assem_no,
-                                             n_assem_batch=assem_per_batch,
-                                             power_cap=row[3],
-                                             lon=longitude,
-                                             lat=latitude)
-            with open(out_path + name.replace(' ', '_') + '.xml',
-                      'w') as output:
-                output.write(config)
-
-
-def obtain_reactors(in_csv, region, reactor_template):
+    outputs = []
+    for i in rendered_reactors(pris, indices):
+        row = pris['rows'][i]
+        name = pris['file_name'][i]
+        assem_per_batch = 0
+        assem_no = 0
+        assem_size = 0
+        reactor_type = pris['type'][i]
+        latitude = row[13] if row[13] != '' else 0
+        longitude = row[14] if row[14] != '' else 0
+        if reactor_type in ['BWR', 'ESBWR']:
+            assem_no = 732
+            assem_per_batch = int(assem_no / 3)
+            assem_size = 138000 / assem_no
+        elif reactor_type in ['GCR', 'HWGCR']:  # Need batch number
+            assem_no = 324
+            assem_per_batch = int(assem_no / 3)
+            assem_size = 114000 / assem_no
+        elif reactor_type == 'HTGR':  # Need batch number
+            assem_no = 3944
+            assem_per_batch = int(assem_no / 3)
+            assem_size = 39000 / assem_no
+        elif reactor_type == 'PHWR':
+            assem_no = 390
+            assem_per_batch = int(assem_no / 45)
+            assem_size = 80000 / assem_no
+        elif reactor_type == 'VVER':  # Need batch number
+            assem_no = 312
+            assem_per_batch = int(assem_no / 3)
+            assem_size = 41500 / assem_no
+        elif reactor_type == 'VVER-1200':  # Need batch number
+            assem_no = 163
+            assem_per_batch = int(assem_no / 3)
+            assem_size = 80000 / assem_no
+        else:
+            assem_no = 241
+            assem_per_batch = int(assem_no / 3)
+            assem_size = 103000 / assem_no
+        outputs.append(render_output(reactor_template,
+                                     out_path + pris['reactor_file'][i],
+                                     name=name,
+                                     lifetime=pris['lifetime'][i],
+                                     assem_size=assem_size,
+                                     n_assem_core=assem_no,
+                                     n_assem_batch=assem_per_batch,
+                                     power_cap=row[3],
+                                     lon=longitude,
+                                     lat=latitude))
+    return write_files(outputs, workers, manifest, dry_run)
+
+
+def obtain_reactors(in_csv, region, reactor_template, pris=None, workers=1,
+                    manifest=None, dry_run=False):
     """ Writes xml files for individual reactors in a given
     region.
 
@@ -559,23 +1268,84 @@ def obtain_reactors(in_csv, region, reactor_template):
         region name
     reactor_template: str
         path to CYCAMORE::reactor config template file
+    pris: dict
+        PRIS dataset from load_pris, loaded from in_csv if None
+    workers: int
+        number of threads writing the files
+    manifest: str
+        path to the manifest json file, every file is
+        written if None
+    dry_run: bool
+        if True, only reports the files that would be written
 
     Returns
     -------
-    null
-        Writes xml files for individual reactors in region.
+    changed: list
+        list of (path, reason) of the reactor files written
     """
-    in_data = import_csv(in_csv, ',')
-    reactor_list = select_region(in_data, region)
+    if pris is None:
+        pris = load_pris(in_csv)
     out_path = 'cyclus/input/' + region + '/reactors'
-    write_reactors(reactor_list, out_path, reactor_template)
+    return write_reactors(pris, select_pris(pris, region), out_path,
+                          reactor_template, workers, manifest, dry_run)
+
+
+def get_countries(in_dict):
+    """ Returns the countries of the reactors, compared without case,
+    each spelled like its first reactor spells it.
+
+    Parameters
+    ---------
+    in_dict: dictionary
+        dictionary with key=[reactor name], and
+        value=[set of country and buildtime]
+
+    Returns
+    -------
+    countries: OrderedDict
+        dictionary with key=[upper case country], and
+        value=[country], in order of the reactors
+    """
+    countries = collections.OrderedDict()
+    for country, _ in in_dict.values():
+        countries.setdefault(country.upper(), country)
+    return countries
+
+
+def consolidate_inclusions(inclusions, reactor_files):
+    """ Replaces the children of the rendered inclusions template by
+    the reactor files, so inclusions.xml contains the reactors
+    instead of including them.
+
+    Parameters
+    ---------
+    inclusions: str
+        text of the rendered inclusions template
+    reactor_files: list
+        paths to the reactor files, in deployment order. Files not
+        written yet (in a dry run) are left out
+
+    Returns
+    -------
+    inclusions: str
+        text of the consolidated inclusions.xml
+    """
+    root = ET.fromstring(inclusions)
+    root.text = '\n'
+    root[:] = [ET.parse(path).getroot() for path in reactor_files
+               if os.path.exists(path)]
+    for facility in root:
+        facility.tail = '\n'
+    return ET.tostring(root, encoding='unicode') + '\n'
 
 
 def write_deployment(in_dict, out_path, deployinst_template,
-                     inclusions_template):
+                     inclusions_template, workers=1, reactor_files=None,
+                     manifest=None, dry_run=False):
     """ Renders jinja template using dictionary of reactor name and buildtime.
     Outputs an xml file that uses xinclude to include the reactor xml files
-    located in cyclus_input/reactors.
+    located in cyclus_input/reactors, or that contains them if
+    reactor_files is given.
 
     Parameters
     ---------
@@ -587,46 +1357,67 @@ def write_deployment(in_dict, out_path, deployinst_template,
         path to deployinst template
     inclusions_template: str
         path to inclusions template
+    workers: int
+        number of threads writing the files
+    reactor_files: dict
+        dictionary with key=[reactor name], and value=[path to
+        reactor file]. If given, the reactor files replace the
+        xincludes of the rendered inclusions template, see
+        consolidate_inclusions
+    manifest: str
+        path to the manifest json file, every file is
+        written if None
+    dry_run: bool
+        if True, only reports the files that would be written
 
     Returns
     -------
-    null
-        generates input files that have deployment and xml inclusions
+    changed: list
+        list of (path, reason) of the files written
     """
     if out_path[-1] != '/':
         out_path += '/'
     pathlib.Path(out_path).mkdir(parents=True, exist_ok=True)
     deployinst_template = load_template(deployinst_template)
+    countries = get_countries(in_dict)
+    by_country = collections.OrderedDict((x, collections.OrderedDict())
+                                         for x in countries)
+    for reactor, (country, buildtime) in in_dict.items():
+        by_country[country.upper()][reactor] = buildtime
+    outputs = []
+    for nation, reactors in by_country.items():
+        nation_path = out_path + countries[nation].replace(' ', '_') + '/'
+        pathlib.Path(nation_path).mkdir(parents=True, exist_ok=True)
+        outputs.append(render_output(deployinst_template,
+                                     nation_path + 'deployinst.xml',
+                                     reactors=reactors))
     inclusions_template = load_template(inclusions_template)
-    country_list = {value[0] for value in in_dict.values()}
-    for nation in country_list:
-        temp_dict = {}
-        for reactor in in_dict.keys():
-            if in_dict[reactor][0].upper() == nation.upper():
-                temp_dict.update({reactor: in_dict[reactor][1]})
-        pathlib.Path(out_path + nation.replace(' ', '_') +
-                     '/').mkdir(parents=True, exist_ok=True)
-        deployinst = deployinst_template.render(reactors=temp_dict)
-        with open(out_path + nation.replace(' ', '_') +
-                  '/deployinst.xml', 'w') as output1:
-            output1.write(deployinst)
-    inclusions = inclusions_template.render(reactors=in_dict)
-    with open(out_path + 'inclusions.xml', 'w') as output2:
-        output2.write(inclusions)
-
-
-def get_buildtime(in_list, start_year, path_list):
+    inclusions = render_output(inclusions_template,
+                               out_path + 'inclusions.xml',
+                               reactors=in_dict)
+    if reactor_files is not None:
+        # the text depends on the reactor files, so it is its own hash
+        inclusions = (inclusions[0], consolidate_inclusions(
+            inclusions[1], [reactor_files[x] for x in in_dict.keys()]))
+    outputs.append(inclusions)
+    return write_files(outputs, workers, manifest, dry_run)
+
+
+def get_buildtime(pris, indices, start_year, path_list):
     """ Calculates the buildtime required for reactor
     deployment in months.
 
     Parameters
     ----------
-    in_list: list
-        list of reactors
+    pris: dict
+        PRIS dataset from load_pris
+    indices: list
+        indices of the reactors
     start_year: int
         starting year of simulation
-    path_list: list
-        list of paths to reactor files
+    path_list: list or dict
+        list of paths to reactor files, or their
+        index from index_reactor_files
 
     Returns
     -------
@@ -634,25 +1425,73 @@ def get_buildtime(in_list, start_year, path_list):
         dictionary with key=[name of reactor], and
         value=[set of country and buildtime]
     """
+    if not isinstance(path_list, dict):
+        path_list = index_reactor_files(path_list)
+    matched, _, _ = reconcile_reactors(pris, indices, path_list)
     buildtime_dict = {}
-    for row in in_list:
-        comm_date = date.parse(row[10])
-        start_date = [comm_date.year, comm_date.month, comm_date.day]
-        delta = ((start_date[0] - int(start_year)) * 12 +
-                 (start_date[1]) +
-                 round(start_date[2] / (365.0 / 12)))
-        for index, reactor in enumerate(path_list):
-            name = row[1].replace(' ', '_')
-            country = row[0]
-            file_name = (reactor.replace(
-                os.path.dirname(path_list[index]), '')).replace('/', '')
-            if (name + '.xml' == file_name):
-                buildtime_dict.update({name: (country, delta)})
+    for i in matched:
+        delta = int(pris['build_month'][i] - int(start_year) * 12)
+        buildtime_dict.update({pris['file_name'][i]: (pris['rows'][i][0],
+                                                      delta)})
     return buildtime_dict
 
 
+def index_reactor_files(path_list):
+    """ Indexes reactor files by file name, the same
+    name write_reactors gives them.
+
+    Parameters
+    ----------
+    path_list: list
+        list of paths to reactor files
+
+    Returns
+    -------
+    file_index: dict
+        dictionary with key=[file name], and value=[path]
+    """
+    return {os.path.basename(path): path for path in path_list}
+
+
+def reconcile_reactors(pris, indices, file_index):
+    """ Pairs the selected reactors with their reactor files.
+
+    Parameters
+    ----------
+    pris: dict
+        PRIS dataset from load_pris
+    indices: list
+        indices of the reactors
+    file_index: dict
+        reactor files from index_reactor_files
+
+    Returns
+    -------
+    matched: list
+        indices of the reactors that have a file
+    missing: list
+        names of the reactors without a file
+    unused: list
+        file names that belong to no selected reactor
+    """
+    matched = []
+    missing = []
+    used = set()
+    for i in indices:
+        file_name = pris['reactor_file'][i]
+        if file_name in file_index:
+            matched.append(i)
+            used.add(file_name)
+        else:
+            missing.append(pris['name'][i])
+    unused = sorted(set(file_index.keys()) - used)
+    return matched, missing, unused
+
+
 def deploy_reactors(in_csv, region, start_year, deployinst_template,
-                    inclusions_template, reactors_path, deployment_path):
+                    inclusions_template, reactors_path, deployment_path,
+                    pris=None, workers=1, consolidate=False,
+                    manifest=None, dry_run=False, indices=None):
     """ Generates xml files that specify the reactors that will be included
     in a CYCLUS simulation.
 
@@ -672,6 +1511,21 @@ def deploy_reactors(in_csv, region, start_year, deployinst_template,
         path containing reactor files
     deployment_path: str
         output path for deployinst xml
+    pris: dict
+        PRIS dataset from load_pris, loaded from in_csv if None
+    workers: int
+        number of threads writing the files
+    consolidate: bool
+        if True, the reactor files are written into inclusions.xml
+        instead of being xincluded one by one
+    manifest: str
+        path to the manifest json file, every file is
+        written if None
+    dry_run: bool
+        if True, only reports the files that would be written
+    indices: list
+        indices of the reactors in pris, selected from
+        region if None
 
     Returns
     -------
@@ -679,20 +1533,43 @@ def deploy_reactors(in_csv, region, start_year, deployinst_template,
         dictionary with key=[name of reactor], and
         value=[set of country and buildtime]
     """
-    lists = []
     if reactors_path[-1] != '/':
         reactors_path += '/'
-    for files in os.listdir(reactors_path):
-        lists.append(reactors_path + files)
-    in_data = import_csv(in_csv, ',')
-    reactor_list = select_region(in_data, region)
-    buildtime = get_buildtime(reactor_list, start_year, lists)
+    if pris is None:
+        pris = load_pris(in_csv)
+    if indices is None:
+        indices = select_pris(pris, region)
+    if dry_run:
+        # a dry run writes no reactor file, index the ones
+        # write_reactors renders instead of the directory
+        file_index = index_reactor_files(
+            [reactors_path + pris['reactor_file'][i]
+             for i in rendered_reactors(pris, indices)])
+    else:
+        file_index = index_reactor_files([reactors_path + files for files
+                                          in os.listdir(reactors_path)])
+    matched, missing, unused = reconcile_reactors(pris, indices, file_index)
+    if len(missing) > 0:
+        print('%d reactors in %s have no file in %s:'
+              % (len(missing), region, reactors_path))
+        print(', '.join(missing))
+    if len(unused) > 0:
+        print('%d files in %s belong to no reactor in %s:'
+              % (len(unused), reactors_path, region))
+        print(', '.join(unused))
+    buildtime = get_buildtime(pris, matched, start_year, file_index)
+    reactor_files = None
+    if consolidate:
+        reactor_files = {pris['file_name'][i]:
+                         file_index[pris['reactor_file'][i]] for i in matched}
     write_deployment(buildtime, deployment_path, deployinst_template,
-                     inclusions_template)
+                     inclusions_template, workers, reactor_files, manifest,
+                     dry_run)
     return buildtime
 
 
-def render_cyclus(cyclus_template, region, in_dict, out_path):
+def render_cyclus(cyclus_template, region, in_dict, out_path, manifest=None,
+                  dry_run=False):
     """ Renders final CYCLUS input file with xml base, and institutions
     for each country
 
@@ -706,18 +1583,331 @@ def render_cyclus(cyclus_template, region, in_dict, out_path):
         in_dict should be buildtime_dict from get_buildtime function
     out_path: str
         output path for CYCLUS input file
-    output_name:
+    manifest: str
+        path to the manifest json file, every file is
+        written if None
+    dry_run: bool
+        if True, only reports the files that would be written
 
     Returns
     -------
-    null
-        writes CYCLUS input file in out_path
+    changed: list
+        list of (path, reason) of the files written
     """
     if out_path[-1] != '/':
         out_path += '/'
     cyclus_template = load_template(cyclus_template)
-    country_list = {value[0].replace(' ', '_') for value in in_dict.values()}
-    rendered = cyclus_template.render(countries=country_list,
-                                      base_dir=os.path.abspath(out_path) + '/')
-    with open(out_path + region + '.xml', 'w') as output:
-        output.write(rendered)
+    country_list = [x.replace(' ', '_')
+                    for x in get_countries(in_dict).values()]
+    output = render_output(cyclus_template, out_path + region + '.xml',
+                           countries=sorted(country_list),
+                           base_dir=os.path.abspath(out_path) + '/')
+    return write_files([output], manifest=manifest, dry_run=dry_run)
+
+
+xinclude_tag = '{http://www.w3.org/2001/XInclude}include'
+xml_base_attribute = '{http://www.w3.org/XML/1998/namespace}base'
+xpointer_pattern = re.compile(r'^xpointer\(/([^/()]+)(/child::\*)?\)$')
+
+
+def parse_xml(text):
+    """ Parses xml text, keeping its comments.
+
+    Parameters
+    ----------
+    text: str
+        xml text
+
+    Returns
+    -------
+    root: xml.etree.ElementTree.Element
+        root element
+    """
+    parser = ET.XMLParser(target=ET.TreeBuilder(insert_comments=True))
+    return ET.fromstring(text.lstrip('\ufeff'), parser)
+
+
+def select_xpointer(root, xpointer):
+    """ Returns the elements of an included document selected by an
+    xpointer. Only the xpointer(/root) and xpointer(/root/child::*)
+    forms used by the CYCLUS input templates are supported.
+
+    Parameters
+    ----------
+    root: xml.etree.ElementTree.Element
+        root element of the included document
+    xpointer: str
+        xpointer, or None for the whole document
+
+    Returns
+    -------
+    elements: list
+        selected elements
+    """
+    if xpointer is None:
+        return [root]
+    match = xpointer_pattern.match(xpointer)
+    if match is None or match.group(1) != root.tag:
+        raise ValueError('Unsupported xpointer ' + xpointer + ' for <' +
+                         root.tag + '>')
+    if match.group(2):
+        return list(root)
+    return [root]
+
+
+def include_xml(element, base, sources, parents):
+    """ Replaces the xincludes below an element by the elements they
+    include, recursively. Hrefs are resolved against base and the
+    xml:base attributes on the way.
+
+    Parameters
+    ----------
+    element: xml.etree.ElementTree.Element
+        element, changed in place
+    base: str
+        base path of the element
+    sources: dict
+        filled with key=[path of every file read], and
+        value=[hash of its text]
+    parents: tuple
+        files that include the element, to detect cycles
+
+    Returns
+    -------
+    null
+    """
+    if xml_base_attribute in element.attrib:
+        base = urllib.parse.urljoin(base, element.attrib[xml_base_attribute])
+    children = []
+    for child in list(element):
+        if child.tag != xinclude_tag:
+            include_xml(child, base, sources, parents)
+            children.append(child)
+            continue
+        if child.get('parse', 'xml') != 'xml' or not child.get('href'):
+            raise ValueError('Only xincludes of xml files are supported')
+        href, _, fragment = child.get('href').partition('#')
+        xpointer = child.get('xpointer', fragment or None)
+        included = select_xpointer(
+            resolve_xml(urllib.parse.urljoin(base, href), sources, parents),
+            xpointer)
+        tail = child.tail or ''
+        if len(included) > 0:
+            included[-1].tail = (included[-1].tail or '') + tail
+        elif len(children) > 0:
+            children[-1].tail = (children[-1].tail or '') + tail
+        else:
+            element.text = (element.text or '') + tail
+        children += included
+    element[:] = children
+
+
+def resolve_xml(in_file, sources=None, parents=(), text=None):
+    """ Returns the root element of an xml file with every xinclude
+    replaced by the elements it includes, recursively.
+
+    Parameters
+    ----------
+    in_file: str
+        path to the xml file
+    sources: dict
+        filled with key=[path of every file read], and
+        value=[hash of its text]
+    parents: tuple
+        files that include in_file, to detect cycles
+    text: str
+        text of the file, read from in_file if None
+
+    Returns
+    -------
+    root: xml.etree.ElementTree.Element
+        root element without xincludes
+    """
+    path = os.path.abspath(in_file)
+    if path in parents:
+        raise ValueError(in_file + ' includes itself')
+    if sources is None:
+        sources = {}
+    if text is None:
+        with open(path, 'r', encoding='utf-8') as source:
+            text = source.read()
+        sources[path] = get_hash(text)
+    root = parse_xml(text)
+    include_xml(root, path, sources, parents + (path,))
+    return root
+
+
+def minify_xml(element):
+    """ Removes the comments and the whitespace between tags
+    below an element, in place.
+
+    Parameters
+    ----------
+    element: xml.etree.ElementTree.Element
+        element to minify
+
+    Returns
+    -------
+    null
+    """
+    element[:] = [child for child in element if child.tag is not ET.Comment]
+    if element.text is not None and not element.text.strip():
+        element.text = None
+    for child in element:
+        if child.tail is not None and not child.tail.strip():
+            child.tail = None
+        minify_xml(child)
+
+
+def flatten_input(in_file, out_file=None, minify=False):
+    """ Writes a CYCLUS input file with every xinclude resolved,
+    so CYCLUS reads one file instead of hundreds of fragments.
+    The hash of every file read and of the flattened file is kept in
+    out_file.json, and the flattened file is only rebuilt when one of
+    them changes.
+
+    Parameters
+    ----------
+    in_file: str
+        path to the CYCLUS input file
+    out_file: str
+        path to the flattened file, in_file with a _flat
+        suffix if None
+    minify: bool
+        if True, removes comments and the whitespace
+        between tags
+
+    Returns
+    -------
+    out_file: str
+        path to the flattened file
+    """
+    if out_file is None:
+        out_file = os.path.splitext(in_file)[0] + '_flat.xml'
+    cache_file = out_file + '.json'
+    if os.path.exists(out_file) and os.path.exists(cache_file):
+        with open(cache_file, 'r') as source:
+            cache = json.load(source)
+        records = dict(cache['sources'])
+        records[out_file] = cache.get('output')
+        if cache['minify'] == minify and records[out_file] and all(
+                disk_hash(path, record) == record['output']
+                for path, record in records.items()):
+            return out_file
+    sources = {}
+    root = resolve_xml(in_file, sources)
+    if minify:
+        minify_xml(root)
+    text = ET.tostring(root, encoding='unicode') + '\n'
+    write_file((out_file, text))
+    cache = {'minify': minify,
+             'output': file_record(out_file, None, get_hash(text)),
+             'sources': {path: file_record(path, None, digest)
+                         for path, digest in sources.items()}}
+    with open(cache_file, 'w') as output:
+        json.dump(cache, output, indent=1, sort_keys=True)
+    return out_file
+
+
+def generate_region(job):
+    """ Writes the reactors, deployment and CYCLUS input file
+    of one region.
+
+    Parameters
+    ----------
+    job: tuple
+        (pris, region, indices, start_year, templates, out_path,
+        manifest, dry_run, flatten, minify), see generate_regions
+
+    Returns
+    -------
+    buildtime_dict: dict
+        dictionary with key=[name of reactor], and
+        value=[set of country and buildtime]
+    """
+    (pris, region, indices, start_year, templates, out_path,
+     manifest, dry_run, flatten, minify) = job
+    region_path = out_path + region + '/'
+    if manifest:
+        manifest = region_path + 'manifest.json'
+    else:
+        manifest = None
+    write_reactors(pris, indices, region_path + 'reactors',
+                   templates['reactor'], manifest=manifest, dry_run=dry_run)
+    buildtime = deploy_reactors(None, region, start_year,
+                                templates['deployinst'],
+                                templates['inclusions'],
+                                region_path + 'reactors',
+                                region_path + 'deployment', pris=pris,
+                                manifest=manifest, dry_run=dry_run,
+                                indices=indices)
+    render_cyclus(templates['cyclus'], region, buildtime, region_path,
+                  manifest=manifest, dry_run=dry_run)
+    if flatten and not dry_run:
+        flatten_input(region_path + region + '.xml', minify=minify)
+    return buildtime
+
+
+def generate_regions(in_csv, start_year, reactor_template,
+                     deployinst_template, inclusions_template,
+                     cyclus_template, regions=None,
+                     out_path='cyclus/input/', workers=1, manifest=False,
+                     dry_run=False, flatten=False, minify=False):
+    """ Generates the CYCLUS inputs of many regions in one run.
+    PRIS is parsed and partitioned into regions once, and the
+    regions are generated in a process pool if workers > 1.
+
+    Parameters
+    ----------
+    in_csv: str
+        path to pris reactor database
+    start_year: int
+        starting year of simulation
+    reactor_template: str
+        path to CYCAMORE::reactor config template file
+    deployinst_template: str
+        path to deployinst template
+    inclusions_template: str
+        path to inclusions template
+    cyclus_template: str
+        path to CYCLUS input file template
+    regions: list
+        names of the regions, every region if None
+    out_path: str
+        output path, each region is written in out_path/region
+    workers: int
+        number of processes
+    manifest: bool
+        if True, each region keeps a manifest.json of its
+        files and only rewrites the changed ones
+    dry_run: bool
+        if True, only reports the files that would be written
+    flatten: bool
+        if True, also writes region_flat.xml with every
+        xinclude resolved, see flatten_input
+    minify: bool
+        if True, minifies the flattened files
+
+    Returns
+    -------
+    buildtimes: OrderedDict
+        dictionary with key=[region name], and
+        value=[buildtime_dict of the region]
+    """
+    if out_path[-1] != '/':
+        out_path += '/'
+    pris = load_pris(in_csv)
+    partition = partition_regions(pris, regions)
+    templates = {'reactor': reactor_template,
+                 'deployinst': deployinst_template,
+                 'inclusions': inclusions_template,
+                 'cyclus': cyclus_template}
+    jobs = [(pris, region, indices, start_year, templates, out_path,
+             manifest, dry_run, flatten, minify)
+            for region, indices in partition.items()]
+    if workers > 1 and len(jobs) > 1:
+        with Pool(min(workers, len(jobs))) as pool:
+            buildtimes = pool.map(generate_region, jobs)
+    else:
+        buildtimes = [generate_region(job) for job in jobs]
+    return collections.OrderedDict(zip(partition.keys(), buildtimes))
@@ -1,8 +1,12 @@
 import numpy as np
 import pytest
 import collections
+import csv
+import json
+import matplotlib.pyplot as plt
 import sqlite3 as lite
 import os
+import shutil
 import sys
 path = os.path.realpath(__file__)
 sys.path.append(os.path.dirname(os.path.dirname(path)))
@@ -313,3 +317,371 @@ def test_powerseries_reactor():
         'Reactor_39']
     ans_powerseries_reactor_39 = [0, 1000.0, 1000.0, 0, 0, 0, 0, 0, 0, 0]
     assert_equal(powerseries_reactor_39, ans_powerseries_reactor_39)
+
+
+def test_commodity_per_institution():
+    """Test commodity_per_institution total and timeseries output"""
+    cur = get_sqlite_cursor()
+    totals = an.commodity_per_institution(cur, 'uox_waste')
+    assert totals['lwr_inst'] == pytest.approx(1000.0)
+    assert totals['fr_inst'] is None
+    series = an.commodity_per_institution(cur, 'uox', is_timeseries=True,
+                                          is_cum=False)
+    answer = [0, 300, 300, 300, 100, 0, 0, 0, 0, 0]
+    assert series['sink_source_facilities'] == pytest.approx(answer)
+    assert series['lwr_inst'] == [0] * 10
+
+
+def test_commodity_origin():
+    """Test commodity_origin with given and discovered prototypes"""
+    cur = get_sqlite_cursor()
+    origin = an.commodity_origin(cur, 'uox_waste', ['lwr', 'fr'],
+                                 is_cum=False)
+    answer = [0, 0, 0.3, 0, 0.4, 0, 0.3, 0, 0, 0]
+    assert list(origin.keys()) == ['lwr', 'fr']
+    assert origin['lwr'] == pytest.approx(answer)
+    assert origin['fr'] == [0] * 10
+    origin = an.commodity_origin(cur, 'uox')
+    assert list(origin.keys()) == ['enrichment']
+    assert origin['enrichment'][-1] == pytest.approx(1.0)
+
+
+def test_fuel_cycle_metrics():
+    """Test fuel_cycle_metrics against the single-metric functions"""
+    cur = get_sqlite_cursor()
+    metrics = an.fuel_cycle_metrics(cur)
+    assert np.allclose(metrics['nat_u'], an.nat_u_timeseries(cur))
+    assert np.allclose(metrics['fuel_loaded'], an.fuel_into_reactors(cur))
+    assert np.allclose(metrics['swu']['Enrichment_30'],
+                       an.swu_timeseries(cur)['Enrichment_30'])
+    assert np.allclose(metrics['u_util'], an.u_util_calc(cur))
+    spent_fuel = [0, 0, 0.3, 0.3, 0.7, 0.7, 1.0, 1.0, 1.0, 1.0]
+    assert np.allclose(metrics['spent_fuel'], spent_fuel)
+    lwr_capacity = [0, 1, 2, 2, 2, 1, 1, 0, 0, 0]
+    assert np.allclose(metrics['capacity']['lwr_inst'], lwr_capacity)
+    deployment = an.deployments(cur)
+    for key in deployment:
+        assert np.allclose(metrics['deployments'][key], deployment[key])
+
+
+def test_inventory_timeseries():
+    """Test inventory_timeseries and inventory_isotopics"""
+    cur = get_sqlite_cursor()
+    index = an.inventory_index(cur)
+    fill = an.inventory_timeseries(index, [26], ['fill'], kg_to_tons=False)
+    answer = [0, 0, 0, 0, 0, 5997.78, 5997.78, 5997.78, 5997.78, 5997.78]
+    assert fill == pytest.approx(answer)
+    assert an.inventory_timeseries(index, [26], ['fiss'])[-1] == \
+        pytest.approx(0.06986)
+    isotopics = an.inventory_isotopics(index, ['27'])
+    total = sum(isotopics[key] for key in isotopics)
+    answer = [0, 0, 0, 0.27944, 0.27944, 0.6487,
+              0.6487, 0.92814, 0.92814, 0.92814]
+    assert total == pytest.approx(answer)
+
+
+def test_incremental_refresh(tmpdir):
+    """Test incremental_refresh on an output that grows between refreshes"""
+    growing = str(tmpdir.join('growing.sqlite'))
+    shutil.copy(test_sqlite_path, growing)
+    con = lite.connect(growing)
+    con.execute('CREATE TABLE later AS SELECT * FROM transactions '
+                'WHERE rowid > 20')
+    con.execute('DELETE FROM transactions WHERE rowid > 20')
+    con.commit()
+    schema = con.execute('SELECT * FROM sqlite_master').fetchall()
+    # the output is followed read-only while it is written
+    cur = an.cursor(growing, read_only=True)
+    state = an.incremental_state(cur)
+    new_rows = an.incremental_refresh(cur, state)
+    assert new_rows['transactions'] == 20
+    with pytest.raises(lite.OperationalError):
+        cur.execute('CREATE TABLE written (value INTEGER)')
+    con.execute('INSERT INTO transactions SELECT * FROM later')
+    con.commit()
+    new_rows = an.incremental_refresh(cur, state)
+    assert new_rows['transactions'] == 17
+    assert new_rows['timeseriespower'] == 0
+    uox_waste = an.incremental_timeseries(state, 'uox_waste', True)
+    answer = an.facility_commodity_flux(get_sqlite_cursor(),
+                                        ['39', '40', '42'],
+                                        ['uox_waste'], True)['uox_waste']
+    assert uox_waste == pytest.approx(answer)
+    power = an.incremental_timeseries(state, 'timeseriespower',
+                                      is_cum=False)
+    assert power[1] == pytest.approx(1000.0)
+    assert con.execute('SELECT * FROM sqlite_master').fetchall() == schema
+
+
+def test_export_metrics(tmpdir):
+    """Test if exported metrics are read back unchanged"""
+    cur = get_sqlite_cursor()
+    file_name = str(tmpdir.join('metrics'))
+    schema = an.export_metrics(cur, file_name)
+    assert schema['attrs']['duration'] == 10
+    metrics = an.fuel_cycle_metrics(cur)
+    loaded = an.read_timeseries_table(file_name)
+    assert list(loaded.keys()) == list(metrics.keys())
+    assert np.array_equal(loaded['nat_u'], metrics['nat_u'])
+    assert np.array_equal(loaded['capacity']['lwr_inst'],
+                          metrics['capacity']['lwr_inst'])
+    assert isinstance(loaded['u_util'].base, np.memmap)
+
+
+def test_main(tmpdir):
+    """Test the command line entry point"""
+    output_dir = str(tmpdir)
+    an.main([test_sqlite_path, '--output-dir', output_dir,
+             '--format', 'json', '--metrics', 'nat_u',
+             '--start', '2', '--end', '5'])
+    with open(os.path.join(output_dir, 'test.json')) as source:
+        result = json.load(source)
+    assert list(result.keys()) == ['timestep', 'years', 'nat_u']
+    assert result['timestep'] == [2, 3, 4]
+    assert result['nat_u'] == pytest.approx(
+        an.nat_u_timeseries(get_sqlite_cursor())[2:5])
+
+
+def test_main_same_names(tmpdir):
+    """Test if outputs with the same name in different directories
+    get their own results and caches"""
+    for directory in ['a', 'b']:
+        tmpdir.mkdir(directory)
+        shutil.copy(test_sqlite_path,
+                    str(tmpdir.join(directory, 'test.sqlite')))
+    files = [str(tmpdir.join(directory, 'test.sqlite'))
+             for directory in ['a', 'b']]
+    names = an.output_names(files)
+    assert names[0] != names[1]
+    assert names[0].startswith('test_')
+    assert an.output_names(files[:1]) == ['test']
+    output_dir = str(tmpdir.join('out'))
+    an.main(files + ['--output-dir', output_dir, '--format', 'json',
+                     '--metrics', 'nat_u', '--cache'])
+    results = sorted(os.listdir(output_dir))
+    assert len([x for x in results if x.endswith('.json') and
+                not x.startswith('.')]) == 2
+    assert len([x for x in results if x.endswith('_cache.npy')]) == 2
+    # a cache without its table is recomputed
+    for name in results:
+        if name.endswith('_cache.npy'):
+            os.remove(os.path.join(output_dir, name))
+    an.main(files + ['--output-dir', output_dir, '--format', 'json',
+                     '--metrics', 'nat_u', '--cache'])
+    assert sorted(os.listdir(output_dir)) == results
+
+
+def test_render_figures(tmpdir):
+    """Test if render_figures saves every figure once per key"""
+    tmpdir.chdir()
+    timestep = np.arange(10)
+    dictionary = collections.OrderedDict()
+    dictionary['lwr_government'] = np.arange(10) * 1000.0
+    dictionary['fr_government'] = np.ones(10)
+    jobs = [(an.multiple_line_plots, (dictionary, timestep, 'Years',
+                                      'Mass', 'Mass', 'mass', 2000)),
+            ('stacked_bar_chart', (dictionary, timestep, 'Years',
+                                   'Mass', 'Mass', 'stack', 2000))]
+    an.render_figures(jobs, workers=2)
+    assert sorted(os.listdir(str(tmpdir))) == ['fr_mass.png', 'lwr_mass.png',
+                                               'stack.png']
+    # rendering in the calling process leaves its figures and backend
+    figure = plt.figure()
+    backend = plt.get_backend()
+    an.render_figures(jobs, workers=1)
+    assert plt.get_fignums() == [figure.number]
+    assert plt.get_backend() == backend
+    plt.close(figure)
+
+
+def test_decimate():
+    """Test if decimate keeps the budget, the end points and the peaks"""
+    x = np.arange(1000)
+    y = np.zeros(1000)
+    y[500] = 10.0
+    for method in ['lttb', 'minmax']:
+        dec_x, dec_y = an.decimate(x, y, 50, method)
+        assert len(dec_x) <= 50
+        assert dec_x[0] == 0 and dec_x[-1] == 999
+        assert 500 in dec_x
+        assert np.all(np.diff(dec_x) > 0)
+    dec_x, dec_y = an.decimate(x, np.vstack((y, y)), 50)
+    assert dec_y.shape == (2, len(dec_x))
+    dec_x, dec_y = an.decimate(x, y, None)
+    assert len(dec_x) == 1000
+
+
+def test_plot_in_out_flux_empty():
+    """Test if plot_in_out_flux draws a facility without transactions"""
+    cur = get_sqlite_cursor()
+    for is_cum in [False, True]:
+        for is_tot in [False, True]:
+            an.plot_in_out_flux(cur, 'sink', False, 'sink', is_cum, is_tot)
+            plt.close('all')
+    an.plot_out_flux_basic(cur, 'sink', 'sink')
+    plt.close('all')
+
+
+def test_stacked_bar_chart(tmpdir):
+    """Test if stacked_bar_chart draws bars up to max_bars, and one
+    stepped area per stack above it"""
+    dictionary = collections.OrderedDict()
+    dictionary['lwr_government'] = np.ones(400)
+    dictionary['fr_government'] = np.zeros(400)
+    dictionary['mox_government'] = np.arange(400) * 2.0
+    outputname = str(tmpdir.join('stack'))
+    ax = an.stacked_bar_chart(dictionary, np.arange(400), 'Years', 'Power',
+                              'Power', outputname + '_bar', 2000,
+                              max_bars=400)
+    assert os.path.exists(outputname + '_bar.png')
+    assert len(ax.patches) == 0
+    # one collection per stack that has values, one bar per timestep
+    assert [x.get_label() for x in ax.collections] == ['lwr', 'mox']
+    assert [len(x.get_paths()) for x in ax.collections] == [400, 400]
+    tops = [path.vertices[:, 1].max()
+            for path in ax.collections[1].get_paths()]
+    assert np.allclose(tops, 1 + np.arange(400) * 2.0)
+    assert ax.get_ylim()[0] == 0
+    ax = an.stacked_bar_chart(dictionary, np.arange(400), 'Years', 'Power',
+                              'Power', outputname + '_area', 2000,
+                              max_bars=300)
+    assert os.path.exists(outputname + '_area.png')
+    assert len(ax.patches) == 0
+    assert len(ax.collections) == 2
+    assert [x.get_label() for x in ax.collections] == ['lwr', 'mox']
+    assert an.stacked_bar_chart({}, np.arange(400), 'Years', 'Power',
+                                'Power', outputname, 2000) is None
+
+
+def test_top_series():
+    """Test if top_series keeps the largest series and sums the rest"""
+    dictionary = {'u235': np.array([0, 5]),
+                  'u238': np.array([0, 90]),
+                  'pu239': np.array([9, 1]),
+                  'cs137': np.array([0, 4])}
+    selection = an.top_series(dictionary, 2)
+    assert list(selection.keys()) == ['u238', 'u235', 'other']
+    assert np.array_equal(selection['other'], [9, 5])
+    selection = an.top_series(dictionary, 1, by='peak')
+    assert list(selection.keys()) == ['u238', 'other']
+    assert len(an.top_series(dictionary, None)) == 4
+
+
+def test_group_timeseries():
+    """Test if group_timeseries sums nuclides into groups"""
+    isotopes = collections.OrderedDict()
+    isotopes['U235'] = [1, 2]
+    isotopes['U238'] = [10, 20]
+    isotopes['Pu239'] = [3, 3]
+    isotopes['Am241'] = [1]
+    isotopes['Cs137'] = [0, 5]
+    isotopes['Th232'] = [2, 0]
+    isotopes['He4'] = [0, 1]
+    isotopes['Pb206'] = [1, 1]
+    groups = an.group_timeseries(isotopes)
+    assert list(groups.keys()) == ['U', 'Pu', 'MA', 'TRU', 'OA', 'FP',
+                                   'other']
+    assert np.array_equal(groups['U'], [11, 22])
+    assert np.array_equal(groups['MA'], [1, 0])
+    assert np.array_equal(groups['TRU'], [4, 3])
+    assert np.array_equal(groups['OA'], [2, 0])
+    assert np.array_equal(groups['FP'], [0, 5])
+    assert np.array_equal(groups['other'], [1, 2])
+    custom = {'fissile': lambda z, a: (a % 2 == 1) & (z >= 92)}
+    assert np.array_equal(an.group_timeseries(isotopes, custom)['fissile'],
+                          [5, 5])
+
+
+def test_nuclide_groups_partition():
+    """Test if U, TRU, OA, FP and other partition the recipe nuclides"""
+    recipes = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', '..', 'database', 'vision_recipes',
+                           'uox.csv')
+    with open(recipes) as source:
+        nuclides = [row[0] for row in csv.reader(source)][2:]
+    names = list(an.nuclide_groups().keys())
+    matrix = an.group_matrix(nuclides)
+    parts = [names.index(x) for x in ['U', 'TRU', 'OA', 'FP', 'other']]
+    assert np.array_equal(matrix[parts].sum(axis=0), np.ones(len(nuclides)))
+    assert np.all(matrix[names.index('Pu')] <= matrix[names.index('TRU')])
+    assert np.all(matrix[names.index('MA')] <= matrix[names.index('TRU')])
+    fp = [nuclides[i] for i in np.flatnonzero(matrix[names.index('FP')])]
+    assert 'Cs137' in fp and 'Sr90' in fp
+    assert 'He4' not in fp and 'Pb206' not in fp
+
+
+def test_decay_storage():
+    """Test if decay_storage matches decaying the storage step by step"""
+    chain = collections.OrderedDict()
+    chain[942410000] = {'decay_const': np.log(2) / (14.29 * 3.15576e7),
+                        'atomic_mass': 241.0, 'q_val': 0.0208,
+                        'children': {952410000: 1.0}}
+    chain[952410000] = {'decay_const': 0.0, 'atomic_mass': 241.0,
+                        'q_val': 0.0, 'children': {}}
+    additions = {'Pu241': np.ones(100)}
+    decayed = an.decay_timeseries(additions, 14.29 * 12, chain)
+    assert np.allclose(decayed['Pu241'], 0.5)
+    assert np.allclose(decayed['Am241'], 0.5)
+    storage = an.decay_storage(additions, chain)
+    operator = an.decay_operator(chain, 1)
+    expected = np.zeros(2)
+    for t in range(100):
+        expected = operator.dot(expected) + [1, 0]
+        assert np.allclose([storage['Pu241'][t], storage['Am241'][t]],
+                           expected)
+    heat = an.decay_heat_timeseries(additions, chain)
+    assert np.allclose(heat, an.decay_heat_vector(chain)[0])
+
+
+def test_decay_operator_stiff():
+    """Test if decay_operator conserves the atoms of the stiff
+    Rn222 to Pb206 chain, where Po214 lives for 164 microseconds"""
+    year = 3.15576e7
+    half_lives = [('Rn222', 3.8235 * 86400), ('Po218', 3.098 * 60),
+                  ('Pb214', 26.8 * 60), ('Bi214', 19.9 * 60),
+                  ('Po214', 164.3e-6), ('Pb210', 22.2 * year),
+                  ('Bi210', 5.012 * 86400), ('Po210', 138.376 * 86400),
+                  ('Pb206', np.inf)]
+    atomic_mass = [222.0, 218.0, 214.0, 214.0, 214.0, 210.0, 210.0, 210.0,
+                   206.0]
+    chain = collections.OrderedDict()
+    for i, (nuclide, half_life) in enumerate(half_lives):
+        children = {}
+        if i + 1 < len(half_lives):
+            children[half_lives[i + 1][0]] = 1.0
+        chain[nuclide] = {'decay_const': np.log(2) / half_life,
+                          'atomic_mass': atomic_mass[i], 'q_val': 0.0,
+                          'children': children}
+    masses = np.zeros(len(chain))
+    masses[0] = 222.0
+    for months in [1, 1200]:
+        decayed = an.decay_operator(chain, months).dot(masses)
+        assert np.all(decayed >= 0)
+        assert np.isclose((decayed / atomic_mass).sum(), 1, rtol=1e-12)
+    # after a century, Rn222 has long decayed through to Pb210
+    assert np.isclose(decayed[5] / 210, 2 ** -(100 / 22.2), rtol=1e-3)
+
+
+def test_flow_tensor():
+    """Test if flow_tensor reproduces trade_timeseries for every pair"""
+    cur = get_sqlite_cursor()
+    flows = an.flow_tensor(cur)
+    for sender, receiver, commodity, mass in an.flow_links(flows):
+        trade = an.trade_timeseries(cur, sender, receiver, True, False)
+        flow = an.flow_timeseries(flows, [sender], [receiver])
+        assert np.allclose(list(trade.values())[0], flow)
+    links = an.flow_links(flows)
+    assert ('lwr', 'uox_reprocessing', 'uox_waste', 1.0) in links
+    balance = an.flow_balance(flows, kg_to_tons=False)
+    assert balance['lwr'][-1] == 0.0
+
+
+def test_trade_timeseries_isotopic():
+    """Test if the isotopic trades add up to the bulk trades"""
+    cur = get_sqlite_cursor()
+    bulk = an.trade_timeseries(cur, 'lwr', 'uox_reprocessing', True, False)
+    isotopes = an.trade_timeseries(cur, 'lwr', 'uox_reprocessing',
+                                   True, True)
+    assert sorted(isotopes.keys()) == ['Pu238', 'U235', 'U238']
+    total = np.sum([isotopes[x] for x in isotopes], axis=0)
+    assert np.allclose(total, list(bulk.values())[0])
@@ -0,0 +1,591 @@
+import collections
+import numpy as np
+import pytest
+import os
+import sqlite3
+import xml.etree.ElementTree as ET
+import sys
+from fuzzywuzzy import fuzz
+path = os.path.realpath(__file__)
+sys.path.append(os.path.dirname(os.path.dirname(path)))
+import name_matching as nm
+import predicting_the_past_import as ptp
+
+pris_reactors = ['OHI-1', 'OHI-2', 'ASCO-1', 'KORI-1', 'KORI-2',
+                 'SHIN-KORI-1', 'FERMI-2', 'COOK-1', 'LASALLE-1',
+                 'ST. ALBAN-1', 'PALO VERDE-1', 'PALO VERDE-2',
+                 'DIABLO CANYON-1', 'BRUCE-A1', 'GRAVELINES-1',
+                 'OLKILUOTO-1', 'HADDAM NECK', 'FITZPATRICK', 'DOEL-3',
+                 'BEZNAU-1']
+webscrape_plants = ['Ōi Nuclear Power Plant', 'Ascó Nuclear Power Plant',
+                    'Kori Nuclear Power Plant', 'Enrico Fermi Nuclear '
+                    'Generating Station', 'Donald C. Cook Nuclear Plant',
+                    'LaSalle County Nuclear Generating Station',
+                    'Saint-Alban Nuclear Power Plant',
+                    'Palo Verde Nuclear Generating Station',
+                    'Diablo Canyon Power Plant',
+                    'Bruce Nuclear Generating Station',
+                    'Gravelines Nuclear Power Station',
+                    'Olkiluoto Nuclear Power Plant',
+                    'Connecticut1 Yankee', 'James A. FitzPatrick',
+                    'Doel Nuclear Power Station', 'Beznau Nuclear Plant',
+                    'Kori Nuclear Power Plant']
+
+pris_csv = """Country,Unit,Type,MWe,,,,,,,Commercial,Shutdown,,Lat,Long
+France,GRAVELINES-1,PWR,951,,,,,,,"Nov 25, 1980",,,51.0147,2.1361
+BELGIUM,DOEL-3,PWR,1006,,,,,,,1982-10-01,2022-09-23,,51.3247,4.2597
+UNITED STATES,PALO VERDE-1,PWR,1311,,,,,,,"Jan 28, 1986",,,,
+FRANCE,SMALL-1,PWR,300,,,,,,,"Jan 1, 1990",,,,
+JAPAN,OHI-1,PWR,1120,,,,,,,N/A,,,,
+SPAIN,ASCO-1,PWR,995,,,,,,,not a date,,,,
+RUSSIA,BALTIC-1,VVER-1200,1109,,,,,,,,,,,
+CANADA,BRUCE-1,PHWR,760,,,,,,,01/09/1977,1997-10-31,,,
+"""
+
+
+def write_pris(tmpdir):
+    """Writes the PRIS fixture and returns its path"""
+    in_csv = str(tmpdir.join('pris.csv'))
+    with open(in_csv, 'w') as output:
+        output.write(pris_csv)
+    return in_csv
+
+
+def brute_force_matches(pris_names, webscrape_names, others, threshold):
+    """Matches names by comparing every pair, the last
+    webscrape name wins"""
+    matches = [None] * len(pris_names)
+    for j, web in enumerate(webscrape_names):
+        for i, pris in enumerate(pris_names):
+            if fuzz.ratio(web, pris) > threshold:
+                matches[i] = j
+                continue
+            for key, value in others.items():
+                if (fuzz.ratio(pris, key.lower()) > 80 and
+                        fuzz.ratio(web, value.lower()) > 75):
+                    matches[i] = j
+    return matches
+
+
+def test_get_candidates():
+    """Test if get_candidates pairs names that share a trigram and
+    pairs short names with every name"""
+    left, right = nm.get_candidates(['palo verde', 'ab'],
+                                     ['palo verde', 'verde', 'ba', 'kori'],
+                                     40)
+    pairs = set(zip(left.tolist(), right.tolist()))
+    assert (0, 0) in pairs and (0, 1) in pairs
+    assert (0, 3) not in pairs
+    # no shared trigram, but 'ab' is shorter than full_scan_length
+    assert (1, 2) in pairs
+    left, right = nm.get_candidates(['ab'], ['ba'], 40, full_scan_length=0)
+    assert len(left) == 0
+
+
+def test_match_names():
+    """Test if match_names matches the brute force comparison"""
+    others = ptp.get_edge_cases()
+    pris_names = [ptp.sanitize_pris_name(x) for x in pris_reactors]
+    web_names = [ptp.sanitize_webscrape_name(x) for x in webscrape_plants]
+    for threshold in [78, 64, 40]:
+        matches = nm.match_names(pris_names, web_names, others, threshold)
+        assert matches == brute_force_matches(pris_names, web_names,
+                                              others, threshold)
+    matches = nm.match_names(pris_names, web_names, others, 78)
+    assert matches[pris_reactors.index('OHI-1')] == 0
+    assert matches[pris_reactors.index('KORI-1')] == 16
+    assert matches[pris_reactors.index('BEZNAU-1')] == 15
+    assert nm.match_names(['ab'], ['ba'], {}, 40) == [0]
+
+
+def test_cached_match_names(tmpdir):
+    """Test if cached_match_names reuses, forces and invalidates
+    match decisions"""
+    cache = str(tmpdir.join('cache.sqlite'))
+    others = ptp.get_edge_cases()
+    pris_names = [ptp.sanitize_pris_name(x) for x in pris_reactors]
+    web_names = [ptp.sanitize_webscrape_name(x) for x in webscrape_plants]
+    coordinates = [(float(i), -float(i)) for i in range(len(web_names))]
+    answer = nm.match_names(pris_names, web_names, others, 78)
+    matches, stats = nm.cached_match_names(pris_names, web_names, others,
+                                            78, cache, coordinates)
+    assert matches == answer
+    assert stats['hit_rate'] == 0
+    matches, stats = nm.cached_match_names(pris_names, web_names, others,
+                                            78, cache)
+    assert matches == answer
+    assert stats['hit_rate'] == 1
+    # the coordinates of the last row of the plant are stored
+    con = sqlite3.connect(cache)
+    assert con.execute('SELECT lat, long FROM comparisons WHERE '
+                       'pris_name = "kori" AND webscrape_name = "kori" '
+                       'AND threshold = 78').fetchall() == [(16.0, -16.0)]
+    con.close()
+    # a new plant name is only compared with the cached PRIS names
+    matches, stats = nm.cached_match_names(pris_names,
+                                            web_names + ['kaliningrad'],
+                                            others, 78, cache)
+    assert stats['new_pairs'] == len(set(pris_names))
+    assert matches == nm.match_names(pris_names, web_names + ['kaliningrad'],
+                                      others, 78)
+
+    nm.force_match(cache, 'olkiluoto', 'olkiluoto', False)
+    nm.force_match(cache, 'doel', 'beznau')
+    matches = nm.cached_match_names(pris_names, web_names, others, 78,
+                                     cache)[0]
+    assert matches[pris_reactors.index('OLKILUOTO-1')] is None
+    assert matches[pris_reactors.index('DOEL-3')] == 15
+    # forced decisions hold under a new threshold, and the decisions
+    # of each threshold are kept
+    matches, stats = nm.cached_match_names(pris_names, web_names, others,
+                                            90, cache)
+    assert stats['hit_rate'] == 0
+    assert matches[pris_reactors.index('DOEL-3')] == 15
+    assert nm.cached_match_names(pris_names, web_names, others, 78,
+                                  cache)[1]['hit_rate'] == 1
+
+    nm.invalidate_match(cache, pris_name='doel')
+    matches, stats = nm.cached_match_names(pris_names, web_names, others,
+                                            90, cache)
+    assert stats['new_pairs'] == len(set(web_names))
+    assert matches[pris_reactors.index('DOEL-3')] == 14
+    nm.invalidate_match(cache)
+    matches, stats = nm.cached_match_names(pris_names, web_names, others,
+                                            78, cache)
+    assert stats['hit_rate'] == 0
+    assert matches == answer
+
+
+def test_cached_match_names_pairs(tmpdir):
+    """Test if names first seen in different runs are still
+    compared with each other"""
+    cache = str(tmpdir.join('cache.sqlite'))
+    nm.invalidate_match(cache, pris_name='palisades')
+    for pris_names, web_names in [(['palisades'], ['zion']),
+                                  (['dresden'], ['palisades']),
+                                  (['palisades'], ['palisades'])]:
+        matches, stats = nm.cached_match_names(pris_names, web_names, {},
+                                                78, cache)
+        assert stats['hit_rate'] == 0
+        assert matches == nm.match_names(pris_names, web_names, {}, 78)
+    assert matches == [0]
+
+
+def test_load_pris(tmpdir):
+    """Test if load_pris parses the PRIS columns once"""
+    pris = ptp.load_pris(write_pris(tmpdir))
+    assert pris['header'][1] == 'Unit'
+    assert len(pris['rows']) == 8
+    assert pris['country'][0] == 'FRANCE'
+    assert pris['file_name'][2] == 'PALO_VERDE-1'
+    assert pris['reactor_file'][2] == 'PALO_VERDE-1.xml'
+    assert pris['deployable'].tolist() == [True, True, True, False,
+                                           False, False, False, True]
+    n_days_month = 365.0 / 12
+    assert pris['lifetime'][0] == 720
+    assert pris['lifetime'][1] == int(14602 / n_days_month)
+    assert pris['build_month'][0] == 1980 * 12 + 11 + round(25 / n_days_month)
+    assert pris['build_month'][3] == 1990 * 12 + 1
+    assert pris['build_month'][6] == 0
+    assert ptp.select_pris(pris, 'europe').tolist() == [0, 1]
+    assert ptp.select_pris(pris, 'NORTH_AMERICA').tolist() == [2, 7]
+    with pytest.raises(ValueError):
+        ptp.select_pris(pris, 'ATLANTIS')
+
+
+def test_parse_dates():
+    """Test if parse_dates parses every format and reports failures"""
+    strings = ['2001-02-03', 'Mar 4, 1999', '04/05/1987', 'not a date',
+               '', '01/01/1970', '1990-01-01 00:00:00']
+    dates, failed = ptp.parse_dates(strings)
+    answer = ['2001-02-03', '1999-03-04', '1987-04-05', 'NaT', 'NaT',
+              '1970-01-01', '1990-01-01']
+    assert dates.astype('datetime64[D]').astype(str).tolist() == answer
+    assert failed.tolist() == [3]
+
+
+def test_load_pris_date_errors(tmpdir):
+    """Test if load_pris reports the dates it cannot parse"""
+    pris = ptp.load_pris(write_pris(tmpdir))
+    assert pris['date_errors'] == [(5, 'Commercial', 'not a date')]
+    assert pris['build_month'][7] == 1977 * 12 + 1 + round(9 * 12 / 365.0)
+
+
+def test_reconcile_reactors(tmpdir):
+    """Test if reactors are paired with their files by name"""
+    pris = ptp.load_pris(write_pris(tmpdir))
+    file_index = ptp.index_reactor_files(['reactors/GRAVELINES-1.xml',
+                                          'other/PALO_VERDE-1.xml',
+                                          'reactors/ZION-1.xml'])
+    assert file_index['PALO_VERDE-1.xml'] == 'other/PALO_VERDE-1.xml'
+    matched, missing, unused = ptp.reconcile_reactors(pris, [0, 1, 2],
+                                                      file_index)
+    assert matched == [0, 2]
+    assert missing == ['DOEL-3']
+    assert unused == ['ZION-1.xml']
+    buildtime = ptp.get_buildtime(pris, [0, 1, 2], 1970,
+                                  list(file_index.values()))
+    assert list(buildtime.keys()) == ['GRAVELINES-1', 'PALO_VERDE-1']
+    assert buildtime['GRAVELINES-1'] == ('France', 10 * 12 + 12)
+
+
+templates = os.path.join(os.path.dirname(os.path.dirname(path)), '..',
+                         'input', 'predicting-the-past', 'templates')
+recipes_csv = os.path.join(os.path.dirname(os.path.dirname(path)), '..',
+                           'database', 'vision_recipes', 'uox.csv')
+
+
+def write_us_input(tmpdir):
+    """Renders the United States template and the files it includes,
+    returns the path of the input"""
+    base = tmpdir.mkdir('cyclus')
+    us = base.mkdir('united_states')
+    reactors = us.mkdir('reactors')
+    buildtimes = us.mkdir('buildtimes')
+    for name in ['DOEL-3', 'GRAVELINES-1']:
+        reactors.join(name + '.xml').write(
+            '<?xml version="1.0"?>\n<facility><name>' + name +
+            '</name><config><Reactor/></config></facility>\n')
+    buildtimes.join('inclusions.xml').write(
+        '<inclusions xmlns:xi="http://www.w3.org/2001/XInclude">\n'
+        '<xi:include href="../reactors/DOEL-3.xml"/>\n'
+        '<xi:include href="../reactors/GRAVELINES-1.xml"/>\n'
+        '</inclusions>\n')
+    for country, name in [('Belgium', 'DOEL-3'), ('France', 'GRAVELINES-1')]:
+        buildtimes.mkdir(country).join('deployinst.xml').write(
+            '<DeployInst><prototypes><val>' + name + '</val></prototypes>'
+            '<build_times><val>1</val></build_times></DeployInst>\n')
+    recipe = ptp.load_template(os.path.join(templates,
+                                            'recipes_template.xml'))
+    us.mkdir('recipes').join('uox_51.xml').write(recipe.render(
+        fresh=ptp.get_recipe(recipes_csv, 51, 'fresh'),
+        spent=ptp.get_recipe(recipes_csv, 51, 'spent')))
+    template = ptp.load_template(os.path.join(
+        templates, 'united_states', 'united_states_template.xml'))
+    in_file = base.join('united_states.xml')
+    in_file.write(template.render(base_dir=str(base) + '/',
+                                  countries=['Belgium', 'France'],
+                                  burnup=51))
+    return str(in_file)
+
+
+def test_flatten_input(tmpdir):
+    """Test if flatten_input resolves the includes of the United States
+    template, with xml:base and xpointers"""
+    in_file = write_us_input(tmpdir)
+    out_file = ptp.flatten_input(in_file)
+    assert out_file == in_file[:-4] + '_flat.xml'
+    root = ET.parse(out_file).getroot()
+    assert root.tag == 'simulation'
+    assert len(root.findall('.//' + ptp.xinclude_tag)) == 0
+    assert root.find('inclusions') is None and root.find('recipes') is None
+    facilities = [x.findtext('name') for x in root.findall('facility')]
+    assert facilities[:2] == ['DOEL-3', 'GRAVELINES-1']
+    assert 'Sink_HLW' in facilities
+    recipes = [x.findtext('name') for x in root.findall('recipe')]
+    assert recipes[:2] == ['fresh_uox', 'spent_uox']
+    institutions = root.findall('region/institution')
+    assert [x.findtext('name') for x in institutions] == ['FuelCycle',
+                                                         'Belgium', 'France']
+    assert institutions[1].find('config/DeployInst/prototypes/val').text == \
+        'DOEL-3'
+
+    # cached until an included file changes
+    mtime = os.path.getmtime(out_file)
+    assert ptp.flatten_input(in_file) == out_file
+    assert os.path.getmtime(out_file) == mtime
+    deployinst = os.path.join(os.path.dirname(in_file), 'united_states',
+                              'buildtimes', 'France', 'deployinst.xml')
+    with open(deployinst, 'w') as output:
+        output.write('<DeployInst><prototypes><val>CHOOZ-1</val>'
+                     '</prototypes></DeployInst>\n')
+    root = ET.parse(ptp.flatten_input(in_file, minify=True)).getroot()
+    assert root.find('region/institution[3]/config/DeployInst/prototypes/'
+                     'val').text == 'CHOOZ-1'
+    with open(out_file) as source:
+        flattened = source.read()
+    assert '>\n' not in flattened.strip()
+    # rebuilt if the flattened file itself was changed
+    with open(out_file, 'w') as output:
+        output.write(flattened[:100])
+    ptp.flatten_input(in_file, minify=True)
+    with open(out_file) as source:
+        assert source.read() == flattened
+
+
+def test_flatten_input_errors(tmpdir):
+    """Test if flatten_input rejects cycles and unsupported xpointers"""
+    cycle = tmpdir.join('cycle.xml')
+    cycle.write('<a xmlns:xi="http://www.w3.org/2001/XInclude">'
+                '<xi:include href="cycle.xml"/></a>')
+    with pytest.raises(ValueError):
+        ptp.flatten_input(str(cycle))
+    tmpdir.join('b.xml').write('<b><c/></b>')
+    pointer = tmpdir.join('pointer.xml')
+    pointer.write('<a xmlns:xi="http://www.w3.org/2001/XInclude">'
+                  '<xi:include href="b.xml#xpointer(/other/child::*)"/></a>')
+    with pytest.raises(ValueError):
+        ptp.flatten_input(str(pointer))
+
+
+inclusions_template = ('<inclusions '
+                       'xmlns:xi="http://www.w3.org/2001/XInclude">'
+                       '{% for name in reactors %}\n'
+                       '<xi:include href="../reactors/{{name}}.xml"/>'
+                       '{% endfor %}\n</inclusions>\n')
+deployinst_template = ('<DeployInst><prototypes>{% for name in reactors %}'
+                       '<val>{{name}}</val>{% endfor %}</prototypes>'
+                       '<build_times>{% for name, t in reactors.items() %}'
+                       '<val>{{t}}</val>{% endfor %}</build_times>'
+                       '</DeployInst>\n')
+
+cyclus_template = ('<simulation xmlns:xi="http://www.w3.org/2001/XInclude">'
+                   '{% for country in countries %}<xi:include href="'
+                   '{{ base_dir }}deployment/{{ country }}/deployinst.xml"/>'
+                   '{% endfor %}<xi:include href="{{ base_dir }}deployment/'
+                   'inclusions.xml"/></simulation>')
+
+
+def write_templates(tmpdir):
+    """Writes the deployment templates and returns their paths"""
+    paths = {}
+    for name, text in [('inclusions', inclusions_template),
+                       ('deployinst', deployinst_template),
+                       ('cyclus', cyclus_template)]:
+        paths[name] = str(tmpdir.join(name + '.xml'))
+        with open(paths[name], 'w') as output:
+            output.write(text)
+    paths['reactor'] = os.path.join(templates, 'reactors_template.xml')
+    return paths
+
+
+def test_deploy_reactors_consolidate(tmpdir):
+    """Test if the consolidated inclusions.xml holds the elements the
+    per-reactor inclusions.xml includes, under the same root"""
+    in_csv = write_pris(tmpdir)
+    paths = write_templates(tmpdir)
+    pris = ptp.load_pris(in_csv)
+    reactors = str(tmpdir.join('reactors'))
+    ptp.write_reactors(pris, ptp.select_pris(pris, 'EUROPE'), reactors,
+                       paths['reactor'])
+    roots = []
+    for consolidate in [False, True]:
+        deployment = str(tmpdir.join('deployment_' + str(consolidate)))
+        buildtime = ptp.deploy_reactors(in_csv, 'EUROPE', 1965,
+                                        paths['deployinst'],
+                                        paths['inclusions'], reactors,
+                                        deployment, pris,
+                                        consolidate=consolidate)
+        assert list(buildtime.keys()) == ['GRAVELINES-1', 'DOEL-3']
+        roots.append(ET.parse(os.path.join(deployment,
+                                           'inclusions.xml')).getroot())
+    per_reactor, consolidated = roots
+    assert per_reactor.tag == consolidated.tag == 'inclusions'
+    assert [x.tag for x in per_reactor] == [ptp.xinclude_tag] * 2
+    assert [x.tag for x in consolidated] == ['facility'] * 2
+    assert [x.findtext('name') for x in consolidated] == ['GRAVELINES-1',
+                                                          'DOEL-3']
+    resolved = ptp.resolve_xml(os.path.join(
+        str(tmpdir.join('deployment_False')), 'inclusions.xml'))
+    assert (ET.tostring(resolved, encoding='unicode') ==
+            ET.tostring(consolidated, encoding='unicode'))
+    # included the way the CYCLUS templates include it
+    top = tmpdir.join('top.xml')
+    top.write('<simulation xmlns:xi="http://www.w3.org/2001/XInclude">'
+              '<xi:include href="deployment_True/inclusions.xml'
+              '#xpointer(/inclusions/child::*)"/></simulation>')
+    simulation = ptp.resolve_xml(str(top))
+    assert [x.tag for x in simulation] == ['facility'] * 2
+
+
+def test_write_deployment_countries(tmpdir):
+    """Test if write_deployment writes one deployinst.xml per country,
+    whatever the case of its name, in order of the reactors"""
+    paths = write_templates(tmpdir)
+    deployment = str(tmpdir.join('deployment'))
+    in_dict = collections.OrderedDict([('GRAVELINES-1', ('France', 10)),
+                                       ('DOEL-3', ('BELGIUM', 5)),
+                                       ('CHINON-B1', ('FRANCE', 20))])
+    changed = ptp.write_deployment(in_dict, deployment,
+                                   paths['deployinst'], paths['inclusions'])
+    assert [os.path.relpath(x[0], deployment) for x in changed] == [
+        'France/deployinst.xml', 'BELGIUM/deployinst.xml', 'inclusions.xml']
+    assert sorted(os.listdir(deployment)) == ['BELGIUM', 'France',
+                                              'inclusions.xml']
+    france = ET.parse(os.path.join(deployment, 'France', 'deployinst.xml'))
+    assert [x.text for x in france.find('prototypes')] == ['GRAVELINES-1',
+                                                          'CHINON-B1']
+    assert [x.text for x in france.find('build_times')] == ['10', '20']
+
+
+def test_write_files_manifest(tmpdir):
+    """Test if write_files only rewrites the files whose inputs
+    changed or that were modified on disk"""
+    tmpdir.join('template.txt').write('value: {{ value }}')
+    template = ptp.load_template(str(tmpdir.join('template.txt')))
+    manifest = str(tmpdir.join('manifest.json'))
+    a, b = str(tmpdir.join('a.txt')), str(tmpdir.join('b.txt'))
+    outputs = [ptp.render_output(template, a, value=1),
+               ptp.render_output(template, b, value=2)]
+    assert ptp.write_files(outputs, manifest=manifest) == [(a, 'new'),
+                                                           (b, 'new')]
+    assert ptp.write_files(outputs, manifest=manifest) == []
+    # numpy parameters hash like their python values
+    assert (ptp.render_output(template, a, value=np.int64(1)) ==
+            outputs[0])
+    tmpdir.join('a.txt').write('edited')
+    assert (ptp.write_files(outputs, manifest=manifest) ==
+            [(a, 'modified on disk')])
+    assert tmpdir.join('a.txt').read() == 'value: 1'
+    outputs[1] = ptp.render_output(template, b, value=3)
+    assert (ptp.write_files(outputs, manifest=manifest) ==
+            [(b, 'inputs changed')])
+    assert tmpdir.join('b.txt').read() == 'value: 3'
+    # a dry run writes neither the files nor the manifest
+    before = tmpdir.join('manifest.json').read()
+    outputs[0] = ptp.render_output(template, a, value=4)
+    assert (ptp.write_files(outputs, manifest=manifest, dry_run=True) ==
+            [(a, 'inputs changed')])
+    assert tmpdir.join('a.txt').read() == 'value: 1'
+    assert tmpdir.join('manifest.json').read() == before
+    c = str(tmpdir.join('new', 'c.txt'))
+    assert (ptp.write_files([ptp.render_output(template, c, value=5)],
+                            dry_run=True) == [(c, 'new')])
+    assert not os.path.exists(c)
+
+
+def test_deploy_reactors_dry_run(tmpdir, capsys):
+    """Test if a dry run deploys the reactors write_reactors would
+    render, without reactor files on disk"""
+    in_csv = write_pris(tmpdir)
+    paths = write_templates(tmpdir)
+    pris = ptp.load_pris(in_csv)
+    reactors = str(tmpdir.join('reactors'))
+    deployment = str(tmpdir.join('deployment'))
+    changed = ptp.write_reactors(pris, ptp.select_pris(pris, 'EUROPE'),
+                                 reactors, paths['reactor'], dry_run=True)
+    assert len(changed) == 2
+    buildtime = ptp.deploy_reactors(in_csv, 'EUROPE', 1965,
+                                    paths['deployinst'], paths['inclusions'],
+                                    reactors, deployment, pris,
+                                    dry_run=True)
+    assert list(buildtime.keys()) == ['GRAVELINES-1', 'DOEL-3']
+    assert 'have no file' not in capsys.readouterr().out
+    assert os.listdir(reactors) == []
+    assert not os.path.exists(os.path.join(deployment, 'inclusions.xml'))
+
+
+def test_partition_regions(tmpdir):
+    """Test if partition_regions selects the reactors select_pris
+    selects in each region"""
+    pris = ptp.load_pris(write_pris(tmpdir))
+    partition = ptp.partition_regions(pris)
+    assert list(partition.keys()) == sorted(ptp.get_regions().keys())
+    for region, indices in partition.items():
+        assert list(indices) == list(ptp.select_pris(pris, region))
+    partition = ptp.partition_regions(pris, ['europe', 'ALL'])
+    assert list(partition.keys()) == ['europe', 'ALL']
+    assert list(partition['europe']) == [0, 1]
+    with pytest.raises(ValueError):
+        ptp.partition_regions(pris, ['ATLANTIS'])
+
+
+def read_tree(root):
+    """Returns the text of every file below root, by relative path"""
+    texts = {}
+    for directory, _, files in os.walk(root):
+        for name in files:
+            file_name = os.path.join(directory, name)
+            with open(file_name, 'r') as source:
+                texts[os.path.relpath(file_name, root)] = source.read()
+    return texts
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_generate_regions(tmpdir, workers):
+    """Test if generate_regions writes the files the one region
+    functions write"""
+    in_csv = write_pris(tmpdir)
+    paths = write_templates(tmpdir)
+    pris = ptp.load_pris(in_csv)
+    reference = str(tmpdir.join('reference')) + '/'
+    for region in ['EUROPE', 'ALL']:
+        region_path = reference + region + '/'
+        ptp.write_reactors(pris, ptp.select_pris(pris, region),
+                           region_path + 'reactors', paths['reactor'])
+        buildtime = ptp.deploy_reactors(in_csv, region, 1965,
+                                        paths['deployinst'],
+                                        paths['inclusions'],
+                                        region_path + 'reactors',
+                                        region_path + 'deployment', pris)
+        ptp.render_cyclus(paths['cyclus'], region, buildtime, region_path)
+    generated = str(tmpdir.join('generated')) + '/'
+    buildtimes = ptp.generate_regions(in_csv, 1965, paths['reactor'],
+                                      paths['deployinst'],
+                                      paths['inclusions'], paths['cyclus'],
+                                      ['EUROPE', 'ALL'], generated, workers)
+    assert list(buildtimes.keys()) == ['EUROPE', 'ALL']
+    assert list(buildtimes['EUROPE'].keys()) == ['GRAVELINES-1', 'DOEL-3']
+    assert len(buildtimes['ALL']) == 4
+    expected = read_tree(reference)
+    assert sorted(expected.keys()) == sorted(read_tree(generated).keys())
+    for name, text in read_tree(generated).items():
+        assert text == expected[name].replace(reference, generated)
+    assert 'EUROPE/reactors/GRAVELINES-1.xml' in expected
+
+
+def test_get_recipe(tmpdir):
+    """Test if the recipe library holds the compositions of
+    get_composition_fresh and get_composition_spent, and is
+    reloaded when the csv changes"""
+    in_list = ptp.import_csv(recipes_csv, ',')
+    for burnup in [33, 51, 100]:
+        assert (ptp.get_recipe(recipes_csv, burnup, 'fresh') ==
+                ptp.get_composition_fresh(in_list, burnup))
+        assert (ptp.get_recipe(recipes_csv, burnup, 'spent') ==
+                ptp.get_composition_spent(in_list, burnup))
+    # any other burnup reads the 100 columns
+    assert (ptp.get_recipe(recipes_csv, 42) ==
+            ptp.get_composition_fresh(in_list, 42) ==
+            ptp.get_recipe(recipes_csv, 100))
+    assert (ptp.get_composition_spent(in_list, 42) ==
+            ptp.get_recipe(recipes_csv, 100, 'spent'))
+    with pytest.raises(ValueError):
+        ptp.get_recipe(recipes_csv, 51, 'mox')
+    in_csv = tmpdir.join('uox.csv')
+    with open(recipes_csv, 'r') as source:
+        in_csv.write(source.read())
+    library = ptp.load_recipe_library(str(in_csv))
+    assert ptp.load_recipe_library(str(in_csv)) is library
+    os.utime(str(in_csv), (0, 0))
+    assert ptp.load_recipe_library(str(in_csv)) is not library
+
+
+def test_produce_recipe_library(tmpdir, monkeypatch):
+    """Test if produce_recipe_library writes the files produce_recipes
+    writes for each burnup and region"""
+    monkeypatch.chdir(tmpdir)
+    recipe_template = os.path.join(templates, 'recipes_template.xml')
+    expected = {}
+    for region in ['EUROPE', 'ASIA']:
+        for burnup in [33, 51, 100]:
+            changed = ptp.produce_recipes(recipes_csv, recipe_template,
+                                          burnup, region)
+            assert len(changed) == 1
+            with open(changed[0][0], 'r') as source:
+                expected[os.path.normpath(changed[0][0])] = source.read()
+            os.remove(changed[0][0])
+    changed = ptp.produce_recipe_library(recipes_csv, recipe_template,
+                                         ['EUROPE', 'ASIA'], workers=2)
+    assert sorted(os.path.normpath(x[0]) for x in changed) == sorted(expected)
+    for name, text in expected.items():
+        with open(name, 'r') as source:
+            assert source.read() == text
+    assert 'cyclus/input/EUROPE/recipes/uox_51.xml' in expected
+    # the files of the other regions are new, the written ones unchanged
+    regions = sorted(set(ptp.get_regions()) - {'EUROPE', 'ASIA'})
+    assert (ptp.produce_recipe_library(recipes_csv, recipe_template,
+                                       dry_run=True) ==
+            [('cyclus/input/' + region + '/recipes//uox_' + str(burnup) +
+              '.xml', 'new') for region in regions
+             for burnup in [33, 51, 100]])